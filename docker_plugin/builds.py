@@ -0,0 +1,308 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Streaming, content addressed image builds from a local directory.
+
+The build context is a tar of the directory without the files its
+.dockerignore excludes. It is generated while it is sent, one chunk at a
+time, never written to disk or held in memory as a whole. The context is
+hashed first, file names, modes and contents plus the build parameters,
+and a per daemon cache on disk maps the hash to the built image id, so
+building the same context again, from any path, only tags the existing
+image.
+"""
+
+# Built-in Imports
+import fcntl
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import stat
+import tarfile
+
+# Cloudify Imports
+from docker_plugin import docker_client
+from docker_plugin import imports
+from docker_plugin import locks
+from docker_plugin import streams
+
+CHUNK_SIZE = 1024 * 1024
+DOCKERFILE = 'Dockerfile'
+DOCKERIGNORE = '.dockerignore'
+# build_image passes these to docker-py's build itself
+RESERVED_PARAMS = ('path', 'fileobj', 'custom_context', 'encoding', 'tag',
+                   'stream', 'dockerfile')
+
+_BUILT = re.compile(r'Successfully built ([0-9a-f]+)')
+
+
+def read_dockerignore(path):
+    """ Returns the patterns of the .dockerignore file in the directory
+        path, as (pattern, excluded) pairs: lines starting with ! are
+        exceptions.
+    """
+
+    patterns = []
+    try:
+        with open(os.path.join(path, DOCKERIGNORE)) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return patterns
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        excluded = not line.startswith('!')
+        pattern = os.path.normpath(line.lstrip('!').strip()).lstrip('/')
+        patterns.append((pattern, excluded))
+    return patterns
+
+
+def _match(pattern, parts):
+    """ Whether the pattern segments match the path segments, one by one
+        as Docker's filepath.Match does, so * and ? do not match a /. A
+        ** segment matches any number of segments.
+    """
+
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(_match(pattern[1:], parts[i:])
+                   for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0]) and \
+        _match(pattern[1:], parts[1:])
+
+
+def is_excluded(name, patterns):
+    """ Whether the context file name is excluded. The last pattern that
+        matches the name or one of its directories decides.
+    """
+
+    parts = name.split('/')
+    prefixes = [parts[:i] for i in range(1, len(parts) + 1)]
+    excluded = False
+    for pattern, exclude in patterns:
+        pattern = pattern.split('/')
+        if any(_match(pattern, prefix) for prefix in prefixes):
+            excluded = exclude
+    return excluded
+
+
+def context_files(path, dockerfile=DOCKERFILE):
+    """ Returns the sorted context names of the files, directories and
+        links under path that .dockerignore does not exclude. The
+        Dockerfile and .dockerignore are always sent, the daemon needs
+        them.
+    """
+
+    patterns = read_dockerignore(path)
+    keep = set([dockerfile, DOCKERIGNORE])
+    # without exceptions an excluded directory excludes all of it
+    prune = not any(not exclude for _, exclude in patterns)
+    names = []
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        prefix = '' if relative == '.' else relative + '/'
+        for name in list(dirs):
+            if prune and is_excluded(prefix + name, patterns):
+                dirs.remove(name)
+        for name in dirs + files:
+            name = prefix + name
+            if name in keep or not is_excluded(name, patterns):
+                names.append(name)
+    return sorted(names)
+
+
+class BuildContext(object):
+    """ The build context of a directory, hashed with hash() and sent as
+        an uncompressed tar by iterating over it.
+
+    :param params: the build parameters that change the image, e.g.
+        nocache, part of the hash.
+    """
+
+    def __init__(self, path, dockerfile=DOCKERFILE, params=None,
+                 chunk_size=None):
+        self.path = path
+        self.dockerfile = dockerfile
+        self.params = params or {}
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.names = context_files(path, dockerfile)
+        if dockerfile not in self.names:
+            raise IOError('No {0} in {1}.'.format(dockerfile, path))
+        self.size = 0
+
+    def _info(self, name):
+        full_path = os.path.join(self.path, name)
+        st = os.lstat(full_path)
+        info = tarfile.TarInfo(name)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = int(st.st_mtime)
+        if stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(full_path)
+        elif stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = st.st_size
+        return full_path, info
+
+    def _chunks(self, full_path):
+        with open(full_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def hash(self):
+        """ Returns the sha256 digest of the context and parameters. Mtimes
+            are left out, a fresh checkout of the same files has the same
+            hash.
+        """
+
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps(
+            [self.dockerfile, self.params], sort_keys=True).encode('utf-8'))
+        for name in self.names:
+            full_path, info = self._info(name)
+            sha256.update('\0{0}\0{1}\0{2:o}\0{3}\0'.format(
+                name, info.type, info.mode, info.linkname).encode('utf-8'))
+            if info.isreg():
+                for chunk in self._chunks(full_path):
+                    sha256.update(chunk)
+        return 'sha256:{0}'.format(sha256.hexdigest())
+
+    def __iter__(self):
+        for name in self.names:
+            full_path, info = self._info(name)
+            header = info.tobuf(tarfile.GNU_FORMAT)
+            self.size += len(header)
+            yield header
+            if not info.isreg():
+                continue
+            sent = 0
+            for chunk in self._chunks(full_path):
+                # the header has the size, a file that grew is cut
+                chunk = chunk[:info.size - sent]
+                sent += len(chunk)
+                self.size += len(chunk)
+                yield chunk
+            padding = b'\0' * ((info.size - sent) + (
+                -info.size % tarfile.BLOCKSIZE))
+            self.size += len(padding)
+            yield padding
+        end = b'\0' * (2 * tarfile.BLOCKSIZE)
+        self.size += len(end)
+        yield end
+
+
+class BuildCache(object):
+    """ The images built on one daemon, stored as JSON next to the image
+        locks, see locks.LOCK_DIR. Maps context hashes to image ids.
+    """
+
+    def __init__(self, client):
+        daemon = getattr(docker_client.unwrap(client), 'base_url', None)
+        name = hashlib.sha1(str(daemon).encode('utf-8')).hexdigest()
+        self.path = os.path.join(
+            locks.LOCK_DIR, 'builds-{0}.json'.format(name))
+
+    def image_id(self, digest):
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return json.load(f).get(digest)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def add(self, digest, image_id):
+        if not os.path.isdir(locks.LOCK_DIR):
+            os.makedirs(locks.LOCK_DIR)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.load(f)
+            except ValueError:
+                cache = {}
+            cache[digest] = image_id
+            f.seek(0)
+            f.truncate()
+            json.dump(cache, f)
+
+
+def build_image(client, path, repository, tag, logger, dockerfile=None,
+                params=None):
+    """ Builds the directory at path as repository:tag, unless the same
+        context was already built on the daemon.
+
+    :param client: the client. see docker_client.
+    :param path: the path of a local directory with a Dockerfile.
+    :param dockerfile: the name of the Dockerfile in path.
+    :param params: other arguments of docker-py's Client.build, e.g.
+        nocache or rm, but none of RESERVED_PARAMS. The base image is not
+        pulled unless pull is set.
+    :param logger: an oplog.OperationLogger.
+    :raises APIError: when the daemon fails the build.
+    :raises streams.StreamError: when the build output is an error.
+    :raises IOError: when path has no Dockerfile.
+    :raises OSError: when a file of the context is removed or unreadable
+        while it is sent.
+    :raises ValueError: when params has one of RESERVED_PARAMS.
+    :return: the image id.
+    """
+
+    reserved = sorted(set(params or {}).intersection(RESERVED_PARAMS))
+    if reserved:
+        raise ValueError('build_params may not set {0}, they are set from '
+                         'the image properties'.format(', '.join(reserved)))
+    params = dict(params or {})
+    params.setdefault('pull', False)
+    context = BuildContext(path, dockerfile or DOCKERFILE, params)
+    cache = BuildCache(client)
+    digest = context.hash()
+
+    image_id = cache.image_id(digest)
+    if image_id is not None and imports.image_exists(client, image_id):
+        logger.info('Context was already built, tagging the image.',
+                    path=path, digest=digest, image_id=image_id,
+                    image='{0}:{1}'.format(repository, tag))
+        client.tag(image_id, repository, tag=tag, force=True)
+        return image_id
+
+    output = client.build(
+        fileobj=iter(context), custom_context=True, stream=True,
+        tag='{0}:{1}'.format(repository, tag), dockerfile=dockerfile,
+        **params)
+    image_id = None
+    for message in streams.decode_json_stream(output):
+        streams.raise_for_error(message)
+        text = (message.get('stream') or '').strip()
+        if text:
+            logger.debug('Build output.', output=text)
+        built = _BUILT.search(text)
+        if built:
+            image_id = built.group(1)
+        elif (message.get('aux') or {}).get('ID'):
+            image_id = message['aux']['ID']
+
+    logger.info('Built image.', path=path, files=len(context.names),
+                context_bytes=context.size, digest=digest,
+                image_id=image_id)
+    if image_id is not None:
+        cache.add(digest, image_id)
+    return image_id
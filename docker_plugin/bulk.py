@@ -0,0 +1,357 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Lifecycle operations for many container instances on one daemon.
+
+The functions here do what the create_container, start, stop and
+remove_container tasks do, for a list of BulkItems, through a bounded
+thread pool and one client. They run in threads, so they do not use the
+(thread local) cloudify ctx. Errors, including failed pulls and
+connection errors, are recorded per item. Images are pulled as their
+pull_policy asks and started containers wait for their readiness
+probes, like the tasks do. Instances the tasks would handle another way,
+with use_external_resource or with an image imported from src or built,
+fail instead.
+
+With an engine.EngineClient the same operations are instead built as
+Calls and multiplexed from the calling thread, one phase at a time.
+"""
+
+# Built-in Imports
+from multiprocessing.pool import ThreadPool
+
+# Third-party Imports
+import requests
+from docker.errors import APIError, DockerException
+
+# Cloudify Imports
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import engine as docker_engine
+from docker_plugin import oplog
+from docker_plugin import readiness
+from docker_plugin import streams
+from docker_plugin import utils
+
+CREATE = 'create'
+START = 'start'
+STOP = 'stop'
+DELETE = 'delete'
+
+
+class BulkItem(object):
+    """ One node instance of a bulk operation.
+
+    :param probes: the readiness probes start waits for, see readiness.
+    :param readiness_timeout: the number of seconds start waits for them.
+    """
+
+    def __init__(self, instance_id, properties, runtime_properties,
+                 probes=None, readiness_timeout=60):
+        self.instance_id = instance_id
+        self.properties = properties
+        self.runtime_properties = runtime_properties
+        self.probes = probes or []
+        self.readiness_timeout = readiness_timeout
+        self.error = None
+
+
+def _check(operation, item):
+    """ Raises NonRecoverableError for an item the tasks would handle
+        another way than the bulk operations do.
+    """
+
+    if item.properties.get('use_external_resource'):
+        raise NonRecoverableError(
+            'instances with use_external_resource are not supported by '
+            'bulk operations.')
+    if operation == CREATE:
+        image = item.properties.get('image') or {}
+        if image.get('src') or image.get('build') or \
+                not image.get('repository'):
+            raise NonRecoverableError(
+                'bulk create needs an image repository, images imported '
+                'from src or built are not supported.')
+        utils.get_pull_policy(image)
+    elif operation == START:
+        readiness.validate(item.probes)
+
+
+def _create(client, item, params):
+    image = item.properties.get('image') or {}
+    arguments = dict()
+    arguments['name'] = item.properties.get('name') or item.instance_id
+    arguments['image'] = utils.get_image_id(
+        image.get('tag') or 'latest', image['repository'], client)
+    arguments.update(params)
+    container = client.create_container(**arguments)
+    item.runtime_properties['image_id'] = arguments['image']
+    item.runtime_properties['container_id'] = container.get('Id')
+
+
+def _start(client, item, params):
+    container_id = item.runtime_properties['container_id']
+    client.start(container=container_id, **params)
+    utils.store_inspect(item.runtime_properties, item.properties,
+                        item.instance_id,
+                        client.inspect_container(container_id))
+
+
+def _stop(client, item, params):
+    container_id = item.runtime_properties['container_id']
+    client.stop(container=container_id, **params)
+    try:
+        client.wait(container_id, timeout=params.get('timeout', 10) + 30)
+    except (requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError):
+        raise NonRecoverableError(
+            'Container {0} did not exit.'.format(container_id))
+
+
+def _remove(client, item, params):
+    client.remove_container(
+        container=item.runtime_properties['container_id'], **params)
+    del item.runtime_properties['container_id']
+
+
+OPERATIONS = {
+    CREATE: _create,
+    START: _start,
+    STOP: _stop,
+    DELETE: _remove,
+}
+
+
+def _create_call(engine, client, item, params):
+    image = item.properties.get('image') or {}
+    params.setdefault('name', item.properties.get('name') or item.instance_id)
+    params['image'] = utils.get_image_id(
+        image.get('tag') or 'latest', image['repository'], client)
+    item.runtime_properties['image_id'] = params['image']
+    return engine.create_container(**params)
+
+
+def _created(item, result):
+    item.runtime_properties['container_id'] = result.get('Id')
+
+
+def _start_call(engine, client, item, params):
+    return engine.start(item.runtime_properties['container_id'], **params)
+
+
+def _inspect_call(engine, client, item, params):
+    return engine.inspect_container(item.runtime_properties['container_id'])
+
+
+def _inspected(item, result):
+    utils.store_inspect(item.runtime_properties, item.properties,
+                        item.instance_id, result)
+
+
+def _stop_call(engine, client, item, params):
+    return engine.stop(item.runtime_properties['container_id'], **params)
+
+
+def _wait_call(engine, client, item, params):
+    return engine.wait(item.runtime_properties['container_id'],
+                       timeout=params.get('timeout', 10) + 30)
+
+
+def _remove_call(engine, client, item, params):
+    return engine.remove_container(
+        item.runtime_properties['container_id'], **params)
+
+
+def _removed(item, result):
+    del item.runtime_properties['container_id']
+
+
+# The phases of each operation on an EngineClient: a function that builds
+# an item's Call and an optional function that handles its result. Every
+# phase runs for all items before the next one starts.
+ENGINE_OPERATIONS = {
+    CREATE: [(_create_call, _created)],
+    START: [(_start_call, None), (_inspect_call, _inspected)],
+    STOP: [(_stop_call, None), (_wait_call, None)],
+    DELETE: [(_remove_call, _removed)],
+}
+
+
+def pull_missing_images(client, items, logger):
+    """ Pulls each distinct image of items once, when the pull_policy of
+        any item that uses it asks for it, see utils.get_pull_policy. A
+        failed pull, or a missing image all its items must not pull, is
+        recorded on the items that use the image.
+    """
+
+    references = {}
+    for item in items:
+        image = item.properties['image']
+        references.setdefault(
+            (image['repository'], image.get('tag') or 'latest'),
+            []).append(item)
+
+    for (repository, tag), image_items in sorted(references.items()):
+        policies = set(utils.get_pull_policy(item.properties['image'])
+                       for item in image_items)
+        try:
+            _pull_image(client, repository, tag, policies, logger)
+        except (APIError, requests.RequestException, NonRecoverableError,
+                streams.StreamError, ValueError) as e:
+            for item in image_items:
+                _record_error(CREATE, item, e, logger)
+
+
+def _pull_image(client, repository, tag, policies, logger):
+    if utils.ALWAYS not in policies:
+        if utils.find_image_id(tag, repository, client) is not None:
+            return
+        if policies == set([utils.NEVER]):
+            raise NonRecoverableError(
+                'Image {0}:{1} is not present and pull_policy is {2}.'
+                .format(repository, tag, utils.NEVER))
+    progress = streams.PullProgress(
+        logger, '{0}:{1}'.format(repository, tag), 30)
+    for message in streams.decode_json_stream(
+            client.pull(repository, tag=tag, stream=True)):
+        progress.update(message)
+    utils.invalidate_image_index(client, repository)
+
+
+def wait_ready(client, items, max_workers, logger):
+    """ Runs the readiness probes of the started items, see readiness.
+        Bulk operations are not retried, so an item whose probes did not
+        pass within its readiness_timeout fails.
+    """
+
+    def wait(item):
+        try:
+            not_ready = readiness.run_probes(
+                client, item.runtime_properties['container_id'],
+                item.probes, item.readiness_timeout)
+            if not_ready:
+                raise NonRecoverableError(
+                    'Readiness probes did not pass: {0}.'.format('; '.join(
+                        readiness.describe(probe) for probe in not_ready)))
+        except NonRecoverableError as e:
+            _record_error(START, item, e, logger)
+
+    _map(wait, [item for item in items if item.probes], max_workers)
+
+
+def _map(function, items, max_workers):
+    if not items:
+        return
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _record_error(operation, item, error, logger):
+    item.error = '{0}: {1}'.format(type(error).__name__, str(error))
+    logger.error('Bulk operation failed.', operation=operation,
+                 instance=item.instance_id, error=item.error)
+
+
+def _run_engine(engine, client, operation, items, params, max_workers,
+                logger):
+    for build, handle in ENGINE_OPERATIONS[operation]:
+        calls = []
+        for item in items:
+            if item.error is not None:
+                continue
+            try:
+                calls.append((item, build(engine, client, item,
+                                          dict(params))))
+            except (NonRecoverableError, requests.RequestException,
+                    KeyError) as e:
+                _record_error(operation, item, e, logger)
+
+        engine.run([call for _, call in calls], max_connections=max_workers)
+
+        for item, call in calls:
+            try:
+                result = call.get()
+                if handle is not None:
+                    handle(item, result)
+            except (docker_engine.EngineError, streams.StreamError,
+                    NonRecoverableError, KeyError) as e:
+                _record_error(operation, item, e, logger)
+
+
+def run(client, operation, items, params, max_workers, logger, engine=None):
+    """ Runs operation for every item through a pool of max_workers
+        threads. Runtime properties are updated on the items, failures
+        are recorded in item.error.
+
+    :param client: the client. see docker_client.
+    :param operation: one of create, start, stop and delete.
+    :param items: a list of BulkItems.
+    :param params: the docker-py parameters of the operation.
+    :param logger: a logger, failures are logged through an
+        oplog.OperationLogger, so repeated ones are rate limited.
+    :param engine: an engine.EngineClient for the same daemon. If given,
+        the calls of all items are multiplexed on it, at most
+        max_workers at a time, instead of using the thread pool.
+    :return: the items that failed.
+    """
+
+    if operation not in OPERATIONS:
+        raise NonRecoverableError(
+            'Unknown bulk operation {0}. Allowed operations: {1}.'.format(
+                operation, ', '.join(sorted(OPERATIONS))))
+    if not items:
+        return []
+    logger = oplog.wrap(logger)
+    try:
+        _run(client, operation, items, params, max_workers, logger, engine)
+    finally:
+        logger.flush()
+    return [item for item in items if item.error is not None]
+
+
+def _run(client, operation, items, params, max_workers, logger, engine):
+    for item in items:
+        try:
+            _check(operation, item)
+        except NonRecoverableError as e:
+            _record_error(operation, item, e, logger)
+
+    if operation == CREATE:
+        pull_missing_images(
+            client, [item for item in items if item.error is None], logger)
+
+    if engine is not None:
+        _run_engine(engine, client, operation, items, params, max_workers,
+                    logger)
+    else:
+        function = OPERATIONS[operation]
+
+        def run_item(item):
+            try:
+                function(client, item, dict(params))
+            except (APIError, DockerException, requests.RequestException,
+                    NonRecoverableError, KeyError) as e:
+                _record_error(operation, item, e, logger)
+
+        # the items that were rejected or whose image could not be
+        # pulled already failed
+        _map(run_item, [item for item in items if item.error is None],
+             max_workers)
+
+    if operation == START:
+        wait_ready(client, [item for item in items if item.error is None],
+                   max_workers, logger)
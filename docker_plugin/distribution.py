@@ -0,0 +1,211 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Saving an image from one daemon and loading it into many.
+
+docker save keeps the layers, tags and metadata docker import loses. The
+saved archive is read from the source daemon once, in chunks, optionally
+gzip compressed on the way, and every chunk is handed to all targets:
+each target daemon loads it from its own bounded queue on its own
+thread, and an optional local archive file is written as it goes. No
+intermediate copy is written to disk and memory stays bounded by the
+queue size, the slowest target sets the pace. A target that fails is
+dropped, the others carry on.
+"""
+
+# Built-in Imports
+import io
+import threading
+import time
+import zlib
+
+# Third-party Imports
+from six.moves import queue
+
+# Cloudify Imports
+from docker_plugin import docker_client
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_SIZE = 8
+
+# Seconds between checks whether a target with a full queue failed.
+PUT_INTERVAL = 0.1
+
+_END = object()
+
+
+class Target(object):
+    """ A consumer of the archive on its own thread.
+
+    :param name: e.g. the daemon's base_url.
+    :param load: called with an iterator over the archive's chunks, see
+        load_target.
+    """
+
+    def __init__(self, name, load, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.load = load
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.bytes = 0
+        self.duration = None
+        self.done = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def put(self, chunk):
+        """ Queues chunk. Returns False when the target failed and takes
+            no more chunks.
+        """
+
+        while not self.done.is_set():
+            try:
+                self.queue.put(chunk, timeout=PUT_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is _END:
+                return
+            self.bytes += len(chunk)
+            yield chunk
+
+    def _run(self):
+        started = time.time()
+        try:
+            self.load(self._chunks())
+        except Exception as e:
+            self.error = '{0}: {1}'.format(type(e).__name__, e)
+        finally:
+            self.duration = time.time() - started
+            self.done.set()
+
+
+def file_target(path, queue_size=QUEUE_SIZE):
+    """ Returns a Target writing the archive to a local file.
+    """
+
+    def write(chunks):
+        with io.open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+    return Target(path, write, queue_size)
+
+
+def read_chunks(archive, chunk_size=CHUNK_SIZE, compress=False):
+    """ Yields the chunks of a file like archive, gzip compressed if
+        compress.
+    """
+
+    compressor = zlib.compressobj(
+        6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    while True:
+        chunk = archive.read(chunk_size)
+        if not chunk:
+            break
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def fan_out(chunks, targets):
+    """ Hands every chunk to every target that has not failed and waits
+        for all of them.
+
+    :return: the number of bytes read from chunks.
+    """
+
+    for target in targets:
+        target.start()
+    size = 0
+    live = list(targets)
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            live = [target for target in live if target.put(chunk)]
+            if not live:
+                break
+    finally:
+        for target in live:
+            target.put(_END)
+        for target in targets:
+            target.join()
+    return size
+
+
+def _load_image(client, chunks):
+    # docker-py's load_image, without the client's read timeout. The
+    # daemon answers once it loaded the whole archive, and the slowest
+    # target sets the pace of all of them.
+    client._raise_for_status(client._post(
+        client._url('/images/load'), data=chunks, timeout=None))
+
+
+def load_target(name, client, queue_size=QUEUE_SIZE):
+    """ Returns a Target loading the archive into the daemon of client.
+    """
+
+    def load(chunks):
+        docker_client.call(client, 'load_image', _load_image, chunks)
+    return Target(name, load, queue_size)
+
+
+def distribute(source, image, targets, compress=False, output=None,
+               chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+    """ Saves image from the source daemon and loads it into the target
+        daemons, reading it once.
+
+    :param source: the docker-py client of the source daemon.
+    :param image: the image reference, e.g. repository:tag.
+    :param targets: a dict of target name to docker-py client.
+    :param compress: whether to gzip the archive sent and written.
+    :param output: a local file to also write the archive to.
+    :raises docker.errors.APIError: when the save fails.
+    :return: a dict of the bytes read, the duration and, per target,
+        the bytes loaded, the duration and the error, if any.
+    """
+
+    started = time.time()
+    fan = [load_target(name, client, queue_size)
+           for name, client in sorted(targets.items())]
+    if output:
+        fan.append(file_target(output, queue_size))
+    archive = source.get_image(image)
+    try:
+        size = fan_out(read_chunks(archive, chunk_size, compress), fan)
+    finally:
+        # the rest is not read when every target failed
+        archive.close()
+    return {
+        'bytes': size,
+        'duration': time.time() - started,
+        'targets': dict(
+            (target.name, {'bytes': target.bytes,
+                           'duration': target.duration,
+                           'error': target.error})
+            for target in fan),
+    }
@@ -12,6 +12,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+# Built-in Imports
+import atexit
+import collections
+import copy
+import functools
+import json
+import threading
+import time
 
 # Third-party Imports
 from docker.client import Client
@@ -19,12 +27,103 @@ from docker.errors import DockerException
 
 # Cloudify Imports
 from cloudify.exceptions import NonRecoverableError
+from docker_plugin import instrumentation
+
+# Clients idle for longer than this are closed and dropped from the pool.
+# A client is idle once every leased function that got it has returned.
+IDLE_TIMEOUT = 300
+
+# Clients idle for longer than this are pinged before being handed out.
+HEALTH_CHECK_INTERVAL = 30
+
+_pool = {}
+_pool_lock = threading.Lock()
+_leases = threading.local()
+
+
+class _PooledClient(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.time()
+        self.users = 0
+
+
+def _pool_key(daemon_client):
+    """Normalize a daemon_client dictionary into a hashable pool key.
+
+    Objects that cannot be serialized (e.g. docker.tls.TLSConfig) are keyed
+    by their repr, so distinct instances get distinct clients.
+    """
+
+    return json.dumps(daemon_client, sort_keys=True, default=repr)
+
+
+def _close(client):
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+def _is_healthy(client):
+    try:
+        client.ping()
+    except Exception:
+        return False
+    return True
+
+
+def _evict_idle(now):
+    for key, entry in list(_pool.items()):
+        if not entry.users and now - entry.last_used > IDLE_TIMEOUT:
+            del _pool[key]
+            _close(entry.client)
+
+
+def _checkout(entry, now):
+    """Hand out the client of entry, in use until the leased function
+    running in this thread, if any, returns. Call with _pool_lock held."""
+
+    entry.last_used = now
+    lease = getattr(_leases, 'entries', None)
+    if lease is not None:
+        entry.users += 1
+        lease.append(entry)
+    return entry.client
+
+
+def leased(func):
+    """ Keeps the clients func gets from the pool in use until it
+        returns, so a long pull, build or stream of func does not have
+        its client closed as idle by another thread's get_client.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_leases, 'entries', None)
+        _leases.entries = []
+        try:
+            return func(*args, **kwargs)
+        finally:
+            entries, _leases.entries = _leases.entries, outer
+            now = time.time()
+            with _pool_lock:
+                for entry in entries:
+                    entry.users -= 1
+                    entry.last_used = now
+    return wrapper
 
 
 def get_client(daemon_client):
     """Get client.
 
     Returns docker client using daemon_client as configuration.
+    Clients are pooled per process and keyed by the normalized
+    daemon_client, so repeated operations against the same daemon
+    reuse the same HTTP session and its keep-alive connections.
+    Called from a leased function, the client is not evicted before
+    that function returns.
 
     :param daemon_client: optional configuration for client creation
     :raises NonRecoverableError:
@@ -32,8 +131,254 @@ def get_client(daemon_client):
     :return: docker client
     """
 
+    daemon_client = daemon_client or {}
+    key = _pool_key(daemon_client)
+    now = time.time()
+
+    with _pool_lock:
+        _evict_idle(now)
+        entry = _pool.get(key)
+        if entry is not None:
+            if now - entry.last_used <= HEALTH_CHECK_INTERVAL or \
+                    entry.users:
+                return _checkout(entry, now)
+            # The ping may take as long as the client timeout, the other
+            # daemons' clients are not held up by it.
+            del _pool[key]
+
+    if entry is not None:
+        if _is_healthy(entry.client):
+            return _put_back(key, entry, now)
+        _close(entry.client)
+
+    with _pool_lock:
+        entry = _pool.get(key)
+        if entry is not None:
+            return _checkout(entry, now)
+        try:
+            client = Client(**daemon_client)
+        except DockerException as e:
+            raise NonRecoverableError(
+                'Error while getting client: {0}.'.format(str(e)))
+
+        client.hooks['response'].append(instrumentation.count_bytes)
+        entry = _pool[key] = _PooledClient(client)
+        return _checkout(entry, now)
+
+
+def _put_back(key, entry, now):
+    """Return the client of a checked entry to the pool, unless another
+    thread pooled one for key meanwhile."""
+
+    with _pool_lock:
+        pooled = _pool.get(key)
+        if pooled is None:
+            _pool[key] = entry
+            return _checkout(entry, now)
+        client = _checkout(pooled, now)
+    _close(entry.client)
+    return client
+
+
+def get_operation_client(daemon_client):
+    """Get a pooled client wrapped in an OperationClient.
+
+    Call once per operation, the read cache lives as long as the wrapper.
+    Calls are recorded by the running operation's instrumentation, if any.
+
+    :param daemon_client: optional configuration for client creation
+    :return: OperationClient
+    """
+
+    return OperationClient(get_client(daemon_client),
+                           recorder=instrumentation.current_recorder())
+
+
+def unwrap(client):
+    """Return the docker client behind an OperationClient."""
+
+    return getattr(client, 'wrapped', client)
+
+
+def call(client, name, function, *args, **kwargs):
+    """Call function(docker client, *args, **kwargs), for API calls no
+    docker-py method makes with the needed arguments. Through an
+    OperationClient it is counted and recorded as the call name, like a
+    mutating method."""
+
+    wrapped = unwrap(client)
+
+    def method(*args, **kwargs):
+        return function(wrapped, *args, **kwargs)
+    if client is wrapped:
+        return method(*args, **kwargs)
+    return client._call(name, method)(*args, **kwargs)
+
+
+class OperationClient(object):
+    """Memoizes docker API reads for the duration of one operation.
+
+    Reads (see READ_METHODS) with the same arguments hit the daemon at
+    most once. Any other API call may change daemon state, so it clears
+    the cache. Every call that reaches the daemon is counted in calls
+    and, if there is a recorder, recorded with its duration, bytes
+    transferred and error class, see instrumentation. Calls that return
+    a stream, e.g. pull(stream=True) or get_image, are recorded when the
+    stream is exhausted or closed, with the bytes read from it.
+    """
+
+    READ_METHODS = frozenset([
+        'containers',
+        'images',
+        'info',
+        'inspect_container',
+        'inspect_image',
+        'top',
+        'version',
+    ])
+
+    def __init__(self, client, cache=True, recorder=None):
+        self.wrapped = client
+        self.recorder = recorder
+        self.calls = collections.Counter()
+        self.cache_hits = 0
+        self._cache = {} if cache else None
+        self._lock = threading.Lock()
+
+    def uncached(self):
+        """Return a view of this client that counts but never caches
+        reads, for polling loops."""
+
+        view = OperationClient(self.wrapped, cache=False,
+                               recorder=self.recorder)
+        view.calls = self.calls
+        view._lock = self._lock
+        return view
+
+    def __getattr__(self, name):
+        attribute = getattr(self.wrapped, name)
+        if not callable(attribute):
+            return attribute
+        if self._cache is not None and name in self.READ_METHODS:
+            return self._cached_call(name, attribute)
+        return self._call(name, attribute)
+
+    def _cached_call(self, name, method):
+        def call(*args, **kwargs):
+            key = json.dumps([name, args, kwargs], sort_keys=True,
+                             default=repr)
+            with self._lock:
+                if key in self._cache:
+                    self.cache_hits += 1
+                    return copy.deepcopy(self._cache[key])
+                self.calls[name] += 1
+            result = self._invoke(name, method, args, kwargs)
+            with self._lock:
+                self._cache[key] = result
+            return copy.deepcopy(result)
+        return call
+
+    def _call(self, name, method):
+        def call(*args, **kwargs):
+            with self._lock:
+                self.calls[name] += 1
+                if self._cache is not None:
+                    self._cache.clear()
+            return self._invoke(name, method, args, kwargs)
+        return call
+
+    def _invoke(self, name, method, args, kwargs):
+        if self.recorder is None:
+            return method(*args, **kwargs)
+        started = time.time()
+        transferred = instrumentation.transferred()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            self.recorder.record(
+                name, time.time() - started,
+                instrumentation.transferred() - transferred,
+                type(e).__name__)
+            raise
+
+        call = _RecordedCall(self.recorder, name, started,
+                             instrumentation.transferred() - transferred)
+        if hasattr(result, 'read'):
+            return _RecordedReader(result, call)
+        if isinstance(result, collections.Iterator):
+            return _recorded_stream(result, call)
+        call.finish()
+        return result
+
+
+class _RecordedCall(object):
+    """An API call, recorded once when finish is called."""
+
+    def __init__(self, recorder, name, started, transferred):
+        self.recorder = recorder
+        self.name = name
+        self.started = started
+        self.transferred = transferred
+        self.error = None
+        self.finished = False
+
+    def finish(self, error=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.recorder.record(self.name, time.time() - self.started,
+                             self.transferred, error)
+
+
+def _recorded_stream(stream, call):
+    error = None
     try:
-        return Client(**daemon_client)
-    except DockerException as e:
-        raise NonRecoverableError(
-            'Error while getting client: {0}.'.format(str(e)))
+        for chunk in stream:
+            call.transferred += len(chunk)
+            yield chunk
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        # also when the consumer closes the generator early
+        call.finish(error)
+
+
+class _RecordedReader(object):
+    """A file like response body, e.g. of get_image, that finishes its
+    call at the end of the body or when closed."""
+
+    def __init__(self, raw, call):
+        self._raw = raw
+        self._call = call
+
+    def read(self, *args, **kwargs):
+        try:
+            data = self._raw.read(*args, **kwargs)
+        except Exception as e:
+            self._call.finish(type(e).__name__)
+            raise
+        self._call.transferred += len(data)
+        # read() without a size reads the whole body
+        if not data or not (args or kwargs):
+            self._call.finish()
+        return data
+
+    def close(self):
+        self._call.finish()
+        self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def close_clients():
+    """Close every pooled client and empty the pool."""
+
+    with _pool_lock:
+        for entry in _pool.values():
+            _close(entry.client)
+        _pool.clear()
+
+
+atexit.register(close_clients)
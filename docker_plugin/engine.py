@@ -0,0 +1,621 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A minimal Docker Engine API client that multiplexes many calls from
+one thread.
+
+docker-py's Client blocks on each call, so running a call for many
+containers at once costs a thread per call. EngineClient builds Calls
+instead and run() drives all of them concurrently over non blocking
+sockets with poll, one connection per call. Unlike select, poll takes
+file descriptors above FD_SETSIZE, so thousands of calls can be open
+at once. It talks to the daemon a daemon_client dictionary describes: a
+unix socket, TCP or TCP with TLS.
+"""
+
+# Built-in Imports
+import collections
+import errno
+import json
+import select
+import socket
+import ssl
+import time
+
+# Third-party Imports
+import six
+from six.moves.urllib.parse import quote, urlencode, urlparse
+from docker.constants import DEFAULT_DOCKER_API_VERSION
+from docker.tls import TLSConfig
+from docker import utils as docker_utils
+
+# Cloudify Imports
+from docker_plugin import streams
+
+DEFAULT_TIMEOUT = 60
+MAX_CONNECTIONS = 64
+RECV_SIZE = 64 * 1024
+
+# Seconds to wait before connecting again when a unix socket's listen
+# backlog is full.
+RETRY_INTERVAL = 0.01
+
+
+class EngineError(Exception):
+    """ A failed Engine API call. status is the HTTP status, if any.
+    """
+
+    def __init__(self, message, status=None):
+        super(EngineError, self).__init__(message)
+        self.status = status
+
+
+class StopStream(Exception):
+    """ Raised by an on_message callback to end a streamed response
+        early. The call completes without an error.
+    """
+
+
+class Call(object):
+    """ One Engine API request and, once run, its result or error.
+
+    :param on_message: called with each object of a streamed JSON
+        response, e.g. the progress messages of a pull. It may raise
+        StopStream to end the call, or any other error to fail it.
+    :param on_data: like on_message, but called with each chunk of a
+        raw streamed response, e.g. the frames of container logs.
+    :param timeout: seconds the call may take, None for no limit.
+    """
+
+    def __init__(self, method, path, params=None, body=None,
+                 on_message=None, timeout=DEFAULT_TIMEOUT, versioned=True,
+                 on_data=None):
+        self.method = method
+        self.path = path
+        self.params = dict(
+            (k, v) for k, v in (params or {}).items() if v is not None)
+        self.body = body
+        self.on_message = on_message
+        self.on_data = on_data
+        self.timeout = timeout
+        self.versioned = versioned
+        self.status = None
+        self.result = None
+        self.error = None
+        self.duration = None
+        self._chunks = []
+        self._decoder = streams.JsonStreamDecoder() if on_message else None
+
+    def __repr__(self):
+        return '<Call {0} {1}>'.format(self.method, self.path)
+
+    def get(self):
+        """ Returns the decoded response body.
+
+        :raises EngineError: when the call failed.
+        :raises streams.StreamError: when the streamed response reported
+            an error.
+        """
+
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _on_data(self, data):
+        if self.on_data is not None and self.status < 400:
+            self.on_data(data)
+        elif self._decoder is not None and self.status < 400:
+            for message in self._decoder.feed(data):
+                self.on_message(message)
+        else:
+            self._chunks.append(data)
+
+    def _on_complete(self):
+        body = b''.join(self._chunks)
+        if self.status >= 400:
+            try:
+                message = json.loads(body.decode('utf-8'))['message']
+            except (ValueError, KeyError, TypeError):
+                message = body.decode('utf-8', 'replace').strip()
+            raise EngineError(
+                '{0} {1} failed with {2}: {3}'.format(
+                    self.method, self.path, self.status, message),
+                status=self.status)
+        if self._decoder is not None:
+            self._decoder.close()
+        elif body:
+            try:
+                self.result = json.loads(body.decode('utf-8'))
+            except ValueError:
+                self.result = body.decode('utf-8', 'replace')
+
+
+class _ResponseParser(object):
+    """ Incremental HTTP/1.1 response parser. Bodies may be delimited by
+        Content-Length, chunked or delimited by the end of the connection.
+    """
+
+    def __init__(self, call):
+        self.call = call
+        self.done = False
+        self._buf = b''
+        self._state = 'head'
+        self._length = None
+        self._chunked = False
+
+    def feed(self, data):
+        self._buf += data
+        while not self.done:
+            if self._state == 'head':
+                if not self._parse_head():
+                    return
+            elif self._chunked:
+                if not self._parse_chunk():
+                    return
+            elif self._length is not None:
+                data = self._buf[:self._length]
+                self._buf = self._buf[len(data):]
+                self._length -= len(data)
+                if data:
+                    self.call._on_data(data)
+                if not self._length:
+                    self.done = True
+                return
+            else:
+                if self._buf:
+                    self.call._on_data(self._buf)
+                self._buf = b''
+                return
+
+    def eof(self):
+        if self._state == 'body' and not self._chunked \
+                and self._length is None:
+            self.done = True
+        if not self.done:
+            raise EngineError('Connection closed before the response to '
+                              '{0} {1} was complete.'.format(
+                                  self.call.method, self.call.path))
+
+    def _parse_head(self):
+        end = self._buf.find(b'\r\n\r\n')
+        if end < 0:
+            return False
+        lines = self._buf[:end].decode('iso-8859-1').split('\r\n')
+        self._buf = self._buf[end + 4:]
+        try:
+            status = int(lines[0].split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise EngineError('Malformed status line {0!r}.'.format(lines[0]))
+        if status == 100:
+            return True
+        headers = dict(
+            (name.strip().lower(), value.strip()) for name, value in
+            (line.split(':', 1) for line in lines[1:] if ':' in line))
+        self.call.status = status
+        self._state = 'body'
+        self._chunked = 'chunked' in headers.get(
+            'transfer-encoding', '').lower()
+        if 'content-length' in headers and not self._chunked:
+            self._length = int(headers['content-length'])
+        if status in (204, 304) or self._length == 0 or \
+                self.call.method == 'HEAD':
+            self.done = True
+        return True
+
+    def _parse_chunk(self):
+        if self._state == 'body':
+            end = self._buf.find(b'\r\n')
+            if end < 0:
+                return False
+            size = int(self._buf[:end].split(b';')[0], 16)
+            self._buf = self._buf[end + 2:]
+            if size == 0:
+                self.done = True
+                return False
+            self._length = size
+            self._state = 'chunk'
+        if self._state == 'chunk':
+            data = self._buf[:self._length]
+            self._buf = self._buf[len(data):]
+            self._length -= len(data)
+            if data:
+                self.call._on_data(data)
+            if self._length:
+                return False
+            self._state = 'chunk_end'
+        if len(self._buf) < 2:
+            return False
+        self._buf = self._buf[2:]
+        self._state = 'body'
+        self._length = None
+        return True
+
+
+class _Connection(object):
+    """ Drives one Call over its own connection, as far as the socket
+        allows without blocking.
+    """
+
+    def __init__(self, engine, call):
+        self.engine = engine
+        self.call = call
+        self.parser = _ResponseParser(call)
+        self.request = engine._request(call)
+        self.sock = None
+        self.state = 'connect'
+        self.wants_write = True
+        self.started = time.time()
+        self.deadline = None if call.timeout is None \
+            else self.started + call.timeout
+
+    @property
+    def done(self):
+        return self.state == 'done'
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def start(self):
+        """ Returns False when the daemon's listen backlog is full and
+            the call should be started again later.
+        """
+
+        try:
+            self.sock = self.engine._connect()
+            if self.engine.family == socket.AF_UNIX:
+                self._connected()
+        except socket.error as e:
+            if e.errno == errno.EAGAIN and self.sock is None:
+                return False
+            self.fail(e)
+        except EngineError as e:
+            self.fail(e)
+        return True
+
+    def fail(self, error):
+        if not isinstance(error, (EngineError, streams.StreamError)):
+            error = EngineError('{0} {1} failed: {2}'.format(
+                self.call.method, self.call.path, error))
+        self.call.error = error
+        self._close()
+
+    def _close(self):
+        self.state = 'done'
+        self.call.duration = time.time() - self.started
+        if self.sock is not None:
+            self.sock.close()
+
+    def _connected(self):
+        if self.engine.ssl_context is None:
+            self.state = 'send'
+            return
+        self.sock = self.engine.ssl_context.wrap_socket(
+            self.sock, do_handshake_on_connect=False,
+            server_hostname=self.engine.host)
+        self.state = 'handshake'
+
+    def step(self):
+        """ Advances the connection after poll reported it ready.
+        """
+
+        try:
+            if self.state == 'connect':
+                error = self.sock.getsockopt(
+                    socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                    raise socket.error(error, 'Connect failed')
+                self._connected()
+            if self.state == 'handshake':
+                self.sock.do_handshake()
+                self.state = 'send'
+            if self.state == 'send':
+                sent = self.sock.send(self.request)
+                self.request = self.request[sent:]
+                if self.request:
+                    return
+                self.state = 'recv'
+                self.wants_write = False
+            if self.state == 'recv':
+                self._recv()
+        except StopStream:
+            self._close()
+        except ssl.SSLWantReadError:
+            self.wants_write = False
+        except ssl.SSLWantWriteError:
+            self.wants_write = True
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                               errno.EINTR):
+                self.fail(e)
+        except (EngineError, streams.StreamError, ValueError) as e:
+            self.fail(e)
+
+    def _recv(self):
+        while True:
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                self.parser.eof()
+            else:
+                self.parser.feed(data)
+            if self.parser.done:
+                self.call._on_complete()
+                self._close()
+                return
+            pending = getattr(self.sock, 'pending', None)
+            if not pending or not pending():
+                return
+
+
+def _poll(connections, timeout):
+    """ Returns the connections that are ready to write, if they want
+        to, or to read, waiting at most timeout seconds.
+    """
+
+    poller = select.poll()
+    by_fileno = {}
+    for connection in connections:
+        by_fileno[connection.fileno()] = connection
+        poller.register(connection, select.POLLOUT if connection.wants_write
+                        else select.POLLIN)
+    try:
+        events = poller.poll(None if timeout is None else timeout * 1000)
+    except select.error as e:
+        if e.args[0] != errno.EINTR:
+            raise
+        return []
+    # errors and hang ups surface in step, from the socket
+    return [by_fileno[fileno] for fileno, _ in events]
+
+
+class EngineClient(object):
+    """ Builds Engine API Calls for a daemon and runs them concurrently.
+
+    :param daemon_client: the daemon_client dictionary given to the
+        tasks, see docker_client.get_client. base_url, version, timeout
+        and tls are used.
+    """
+
+    def __init__(self, daemon_client=None):
+        daemon_client = daemon_client or {}
+        base_url = docker_utils.parse_host(daemon_client.get('base_url'))
+        self.timeout = daemon_client.get('timeout') or DEFAULT_TIMEOUT
+        self.ssl_context = None
+
+        if base_url.startswith('http+unix://'):
+            path = base_url[len('http+unix://'):]
+            self.family = socket.AF_UNIX
+            self.address = path if path.startswith('/') else '/' + path
+            self.host = 'docker'
+        else:
+            url = urlparse(base_url)
+            self.family = socket.AF_INET
+            self.host = url.hostname
+            self.address = (url.hostname, url.port or 80)
+            tls = daemon_client.get('tls', False)
+            if url.scheme == 'https' or tls:
+                self.ssl_context = self._ssl_context(tls)
+
+        self.version = daemon_client.get('version') or \
+            DEFAULT_DOCKER_API_VERSION
+        if self.version == 'auto':
+            self.version = self.run_one(
+                Call('GET', '/version', versioned=False,
+                     timeout=self.timeout))['ApiVersion']
+
+    @staticmethod
+    def _ssl_context(tls):
+        context = ssl.create_default_context()
+        if not isinstance(tls, TLSConfig):
+            return context
+        if tls.verify is False:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif isinstance(tls.verify, six.string_types):
+            context.load_verify_locations(tls.verify)
+        if tls.assert_hostname is False:
+            context.check_hostname = False
+        if tls.cert:
+            context.load_cert_chain(*tls.cert)
+        return context
+
+    def _connect(self):
+        if self.family == socket.AF_UNIX:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except socket.error:
+                sock.close()
+                raise
+            sock.setblocking(False)
+            return sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        error = sock.connect_ex(self.address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise socket.error(error, 'Connect to {0}:{1} failed'.format(
+                *self.address))
+        return sock
+
+    def _request(self, call):
+        path = quote(call.path, safe='/:@')
+        if call.versioned:
+            path = '/v{0}{1}'.format(self.version, path)
+        if call.params:
+            path = '{0}?{1}'.format(path, urlencode(sorted(
+                call.params.items())))
+        body = b''
+        headers = ['Host: {0}'.format(self.host), 'Connection: close',
+                   'User-Agent: cloudify-docker-plugin']
+        if call.body is not None:
+            body = json.dumps(call.body).encode('utf-8')
+            headers.append('Content-Type: application/json')
+        if body or call.method == 'POST':
+            headers.append('Content-Length: {0}'.format(len(body)))
+        head = '{0} {1} HTTP/1.1\r\n{2}\r\n\r\n'.format(
+            call.method, path, '\r\n'.join(headers))
+        return head.encode('iso-8859-1') + body
+
+    def run(self, calls, max_connections=MAX_CONNECTIONS, until=None):
+        """ Runs calls concurrently, at most max_connections at a time,
+            and returns them. Check each result with call.get().
+
+        :param until: a time.time() at which the calls still running end
+            as if their on_message raised StopStream, e.g. streams that
+            are read for a fixed time. Calls not started by then fail.
+        """
+
+        pending = collections.deque(calls)
+        active = []
+        while pending or active:
+            if until is not None and time.time() >= until:
+                for connection in active:
+                    if not connection.done:
+                        connection._close()
+                for call in pending:
+                    call.error = EngineError(
+                        '{0} {1} was not started before the deadline.'
+                        .format(call.method, call.path))
+                break
+            backlog_full = False
+            while pending and len(active) < max_connections:
+                connection = _Connection(self, pending.popleft())
+                if not connection.start():
+                    pending.appendleft(connection.call)
+                    backlog_full = True
+                    break
+                active.append(connection)
+
+            now = time.time()
+            for connection in active:
+                if connection.deadline is not None and \
+                        not connection.done and now >= connection.deadline:
+                    connection.fail(EngineError(
+                        '{0} {1} timed out after {2}s.'.format(
+                            connection.call.method, connection.call.path,
+                            connection.call.timeout)))
+            active = [c for c in active if not c.done]
+            if not active:
+                if backlog_full:
+                    time.sleep(RETRY_INTERVAL)
+                continue
+
+            deadlines = [c.deadline for c in active if c.deadline]
+            if backlog_full:
+                deadlines.append(now + RETRY_INTERVAL)
+            if until is not None:
+                deadlines.append(until)
+            timeout = max(0, min(deadlines) - now) if deadlines else None
+            for connection in _poll(active, timeout):
+                if not connection.done:
+                    connection.step()
+            active = [c for c in active if not c.done]
+        return calls
+
+    def run_one(self, call):
+        """ Runs one call and returns its result.
+        """
+
+        self.run([call])
+        return call.get()
+
+    def create_container(self, image, command=None, name=None, **kwargs):
+        """ Takes the arguments of docker-py's Client.create_container.
+        """
+
+        if isinstance(kwargs.get('volumes'), six.string_types):
+            kwargs['volumes'] = [kwargs['volumes']]
+        config = docker_utils.create_container_config(
+            self.version, image, command, **kwargs)
+        return Call('POST', '/containers/create', params={'name': name},
+                    body=config, timeout=self.timeout)
+
+    def start(self, container, **kwargs):
+        """ Takes the arguments of docker-py's Client.start.
+        """
+
+        host_config = docker_utils.create_host_config(**kwargs)
+        return Call('POST', '/containers/{0}/start'.format(container),
+                    body=host_config or None, timeout=self.timeout)
+
+    def stop(self, container, timeout=10):
+        return Call('POST', '/containers/{0}/stop'.format(container),
+                    params={'t': timeout}, timeout=timeout + self.timeout)
+
+    def wait(self, container, timeout=None):
+        return Call('POST', '/containers/{0}/wait'.format(container),
+                    timeout=timeout)
+
+    def remove_container(self, container, v=False, link=False, force=False):
+        return Call('DELETE', '/containers/{0}'.format(container),
+                    params={'v': int(v), 'link': int(link),
+                            'force': int(force)},
+                    timeout=self.timeout)
+
+    def inspect_container(self, container):
+        return Call('GET', '/containers/{0}/json'.format(container),
+                    timeout=self.timeout)
+
+    def top(self, container):
+        return Call('GET', '/containers/{0}/top'.format(container),
+                    timeout=self.timeout)
+
+    def containers(self, all=False, filters=None):
+        return Call('GET', '/containers/json',
+                    params={'all': int(all), 'filters': docker_utils.
+                            convert_filters(filters) if filters else None},
+                    timeout=self.timeout)
+
+    def images(self, name=None, filters=None):
+        return Call('GET', '/images/json',
+                    params={'filter': name, 'filters': docker_utils.
+                            convert_filters(filters) if filters else None},
+                    timeout=self.timeout)
+
+    def pull(self, repository, tag='latest', on_message=None):
+        """ The pull fails when the daemon streams an error message.
+
+        :param on_message: called with each progress message.
+        """
+
+        def handle(message):
+            streams.raise_for_error(message)
+            if on_message is not None:
+                on_message(message)
+
+        return Call('POST', '/images/create',
+                    params={'fromImage': repository, 'tag': tag},
+                    on_message=handle, timeout=None)
+
+    def stats(self, container, on_message, timeout=None):
+        """ Streams the resource usage of container, about one message a
+            second, until on_message raises StopStream.
+        """
+
+        return Call('GET', '/containers/{0}/stats'.format(container),
+                    on_message=on_message, timeout=timeout)
+
+    def logs(self, container, on_data, since=None, stdout=True,
+             stderr=True, timestamps=True, tail='all', timeout=None):
+        """ Streams the multiplexed log of container as it is now, see
+            logs.LogStreamer. since, in seconds since the epoch, needs
+            API version 1.19 and is ignored by older daemons.
+        """
+
+        return Call('GET', '/containers/{0}/logs'.format(container),
+                    params={'stdout': int(stdout), 'stderr': int(stderr),
+                            'timestamps': int(timestamps), 'tail': tail,
+                            'since': since},
+                    on_data=on_data, timeout=timeout)
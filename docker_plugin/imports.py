@@ -0,0 +1,186 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Streaming, content addressed import of local image tarballs.
+
+Tarballs (plain, gzip or xz, the daemon decompresses them) are read and
+sent in chunks, never held in memory as a whole. A per daemon cache on
+disk maps the tarball to its sha256 digest and the digest to the
+imported image id, so importing the same content again, from any path,
+only tags the existing image. A tarball the cache does not know is read
+twice: hashed first, to find content imported from another path, then
+sent if it was not.
+"""
+
+# Built-in Imports
+import fcntl
+import hashlib
+import json
+import os
+
+# Third-party Imports
+from docker.errors import APIError
+
+# Cloudify Imports
+from docker_plugin import docker_client
+from docker_plugin import locks
+from docker_plugin import streams
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def read_chunks(path, chunk_size=None):
+    """ Yields the file at path in chunks.
+    """
+
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size or CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def file_digest(path):
+    """ Returns the sha256 digest of the file at path.
+    """
+
+    sha256 = hashlib.sha256()
+    for chunk in read_chunks(path):
+        sha256.update(chunk)
+    return 'sha256:{0}'.format(sha256.hexdigest())
+
+
+class ImportCache(object):
+    """ The tarballs imported into one daemon, stored as JSON next to the
+        image locks, see locks.LOCK_DIR. Maps tarball paths (with size
+        and mtime) to digests and digests to image ids.
+    """
+
+    def __init__(self, client):
+        daemon = getattr(docker_client.unwrap(client), 'base_url', None)
+        name = hashlib.sha1(str(daemon).encode('utf-8')).hexdigest()
+        self.path = os.path.join(
+            locks.LOCK_DIR, 'imports-{0}.json'.format(name))
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'files': {}, 'images': {}}
+
+    def digest(self, path):
+        """ Returns the digest of the tarball at path if it was imported
+            before and has not changed since.
+        """
+
+        entry = self._read()['files'].get(os.path.abspath(path))
+        if entry is None or entry[:2] != self._stat(path):
+            return None
+        return entry[2]
+
+    def image_id(self, digest):
+        return self._read()['images'].get(digest)
+
+    def add(self, path, digest, image_id):
+        if not os.path.isdir(locks.LOCK_DIR):
+            os.makedirs(locks.LOCK_DIR)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.load(f)
+            except ValueError:
+                cache = {'files': {}, 'images': {}}
+            cache['files'][os.path.abspath(path)] = \
+                self._stat(path) + [digest]
+            cache['images'][digest] = image_id
+            f.seek(0)
+            f.truncate()
+            json.dump(cache, f)
+
+
+def image_exists(client, image_id):
+    """ Whether the daemon behind client has the image image_id.
+    """
+
+    try:
+        client.inspect_image(image_id)
+    except APIError:
+        return False
+    return True
+
+
+def _import_from_stream(client, chunks, repository, tag):
+    # docker-py's import_image_from_stream, without the client's read
+    # timeout. The daemon answers once it imported the whole tarball.
+    return client._result(client._post(
+        client._url('/images/create'), data=chunks,
+        params={'fromSrc': '-', 'repo': repository, 'tag': tag},
+        headers={'Content-Type': 'application/tar',
+                 'Transfer-Encoding': 'chunked'},
+        timeout=None))
+
+
+def _parse_image_id(output):
+    try:
+        messages = list(streams.decode_json_stream([output]))
+    except ValueError:
+        return output.strip() or None
+    for message in reversed(messages):
+        streams.raise_for_error(message)
+        if message.get('status'):
+            return message['status']
+    return None
+
+
+def import_tarball(client, path, repository, tag, logger):
+    """ Imports the tarball at path as repository:tag, unless the same
+        tarball was already imported into the daemon.
+
+    :param client: the client. see docker_client.
+    :param path: the path of a local tarball.
+    :raises APIError: when the daemon fails the import.
+    :raises requests.RequestException: when the daemon is unreachable.
+    :raises streams.StreamError: when the import output is an error.
+    :return: the image id.
+    """
+
+    cache = ImportCache(client)
+    digest = cache.digest(path) or file_digest(path)
+
+    image_id = cache.image_id(digest)
+    if image_id is not None and image_exists(client, image_id):
+        logger.info('{0} ({1}) was already imported as {2}, tagging it '
+                    '{3}:{4}.'.format(path, digest, image_id, repository, tag))
+        client.tag(image_id, repository, tag=tag, force=True)
+        cache.add(path, digest, image_id)
+        return image_id
+
+    output = docker_client.call(
+        client, 'import_image_from_stream', _import_from_stream,
+        read_chunks(path), repository, tag)
+    image_id = _parse_image_id(output)
+    logger.info('Imported {0} ({1} bytes, {2}) as {3}.'.format(
+        path, os.path.getsize(path), digest, image_id))
+    if image_id is not None:
+        cache.add(path, digest, image_id)
+    return image_id
@@ -0,0 +1,194 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per call instrumentation of the docker API calls of an operation.
+
+Operations decorated with instrumented get a Recorder, which the
+OperationClients created during the operation (see docker_client) feed
+with the name, duration, bytes transferred and error class of every call
+that reaches the daemon. When the operation ends the aggregate is logged,
+see oplog, and, if the node's api_call_stats property is true,
+stored in the api_call_stats runtime property, keyed by operation.
+
+Every call is also written to the sink, if one is set with set_sink or
+the DOCKER_PLUGIN_CALL_LOG environment variable names a JSON lines file.
+"""
+
+# Built-in Imports
+import functools
+import json
+import os
+import threading
+import time
+
+# Cloudify Imports
+from cloudify import ctx
+from docker_plugin import oplog
+
+CALL_LOG_ENV = 'DOCKER_PLUGIN_CALL_LOG'
+
+_local = threading.local()
+_sink = None
+
+
+class JsonLinesSink(object):
+    """ Appends each record as one JSON object per line to a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+def set_sink(sink):
+    """ Sets the sink of the call records of all operations.
+
+    :param sink: an object with a write(record) method, or None.
+    """
+
+    global _sink
+    _sink = sink
+
+
+def get_sink():
+    if _sink is not None:
+        return _sink
+    path = os.environ.get(CALL_LOG_ENV)
+    return JsonLinesSink(path) if path else None
+
+
+def count_bytes(response, **_):
+    """ A requests response hook that adds the request and response body
+        sizes to the bytes transferred by the current thread. Streamed
+        bodies without a Content-Length are not counted.
+    """
+
+    body = response.request.body
+    sent = len(body) if isinstance(body, (bytes, type(u''))) else 0
+    received = int(response.headers.get('Content-Length') or 0)
+    _local.transferred = transferred() + sent + received
+
+
+def transferred():
+    """ Returns the bytes transferred by the calls of the current thread.
+    """
+
+    return getattr(_local, 'transferred', 0)
+
+
+def current_recorder():
+    """ Returns the Recorder of the running operation, or None.
+    """
+
+    return getattr(_local, 'recorder', None)
+
+
+class Recorder(object):
+    """ Aggregates the docker API calls of one operation.
+
+    :param context: fields added to every record written to the sink.
+    """
+
+    def __init__(self, context=None, sink=None, clock=time.time):
+        self.context = context or {}
+        self.sink = sink
+        self.clock = clock
+        self.started = clock()
+        self.sink_error = None
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration, transferred_bytes, error=None):
+        with self._lock:
+            stats = self._calls.setdefault(name, {
+                'count': 0, 'duration': 0.0, 'max_duration': 0.0,
+                'bytes': 0, 'errors': {}})
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            stats['bytes'] += transferred_bytes
+            if error is not None:
+                stats['errors'][error] = stats['errors'].get(error, 0) + 1
+
+        if self.sink is None:
+            return
+        record = dict(self.context, call=name, duration=duration,
+                      bytes=transferred_bytes, error=error,
+                      timestamp=self.clock())
+        try:
+            self.sink.write(record)
+        except (IOError, OSError) as e:
+            self.sink_error = str(e)
+
+    def summary(self):
+        """ Returns the totals and the per call name aggregates.
+        """
+
+        with self._lock:
+            calls = dict((name, dict(stats, errors=dict(stats['errors'])))
+                         for name, stats in self._calls.items())
+        return {
+            'calls': sum(stats['count'] for stats in calls.values()),
+            'api_duration': sum(stats['duration'] for stats in calls.values()),
+            'bytes': sum(stats['bytes'] for stats in calls.values()),
+            'errors': sum(sum(stats['errors'].values())
+                          for stats in calls.values()),
+            'duration': self.clock() - self.started,
+            'by_call': calls,
+        }
+
+
+def instrumented(func):
+    """ Records the docker API calls of an operation. Apply below
+        cloudify's operation decorator.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = Recorder(
+            context={'operation': func.__name__,
+                     'node_instance': ctx.instance.id},
+            sink=get_sink())
+        _local.recorder = recorder
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.recorder = None
+            report(func.__name__, recorder)
+    return wrapper
+
+
+def report(operation, recorder):
+    """ Logs the summary of recorder and, if the node asks for it, stores
+        it in the api_call_stats runtime property. It is stored for failed
+        operations too, so instrumented is applied above staging.staged.
+    """
+
+    summary = recorder.summary()
+    log = oplog.current()
+    log.info('Docker API calls.', operation=operation, summary=summary)
+    if recorder.sink_error is not None:
+        log.warning('Failed to write Docker API call records.',
+                    error=recorder.sink_error)
+    if ctx.node.properties.get('api_call_stats'):
+        stats = dict(ctx.instance.runtime_properties.get(
+            'api_call_stats') or {})
+        stats[operation] = summary
+        ctx.instance.runtime_properties['api_call_stats'] = stats
@@ -0,0 +1,39 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Deferred imports of the modules only some operations need, so
+importing the operation modules stays cheap for a fresh worker."""
+
+# Built-in Imports
+import importlib
+
+
+class LazyModule(object):
+    """ Stands in for a module and imports it on first attribute access.
+        Attributes are looked up on the real module every time, so
+        patching the module is seen through the stand-in.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+    def __repr__(self):
+        return '<LazyModule {0}{1}>'.format(
+            self.__name, '' if self.__module is None else ' (imported)')
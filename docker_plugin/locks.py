@@ -0,0 +1,126 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Host wide locks that let one operation transfer an image while the
+other operations that need the same image on the same daemon wait for it
+and reuse its result."""
+
+# Built-in Imports
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Cloudify Imports
+from cloudify.exceptions import RecoverableError
+from docker_plugin import docker_client
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-docker-plugin')
+
+# Seconds to wait for another operation's transfer of the same image.
+LOCK_TIMEOUT = 1800
+
+# The longest sleep between attempts to take a held lock.
+MAX_POLL_INTERVAL = 1.0
+
+
+class ImageLock(object):
+    """ An exclusive flock on a file named after the daemon and image.
+        The holder records the image id it produced in the file, so
+        operations that were waiting for the lock can reuse it. Waiting
+        for longer than timeout seconds, e.g. for a hung pull, raises
+        RecoverableError.
+    """
+
+    def __init__(self, daemon, image, timeout=None):
+        self.daemon = daemon
+        self.image = image
+        self.timeout = LOCK_TIMEOUT if timeout is None else timeout
+        name = hashlib.sha1(
+            '{0}|{1}'.format(daemon, image).encode('utf-8')).hexdigest()
+        self.path = os.path.join(LOCK_DIR, '{0}.lock'.format(name))
+        self.started = None
+        self._file = None
+
+    def __enter__(self):
+        try:
+            os.makedirs(LOCK_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.started = time.time()
+        self._file = open(self.path, 'a+')
+        interval = 0.05
+        while True:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    self._close()
+                    raise
+            remaining = self.started + self.timeout - time.time()
+            if remaining <= 0:
+                self._close()
+                raise RecoverableError(
+                    'Timed out after {0}s waiting for another operation to '
+                    'transfer image {1}.'.format(self.timeout, self.image))
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def __exit__(self, *_):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._close()
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+
+    def result(self):
+        """ Returns the image id recorded by a holder that finished after
+            this operation started waiting, or None.
+        """
+
+        self._file.seek(0)
+        try:
+            record = json.loads(self._file.read())
+        except ValueError:
+            return None
+        if record.get('finished', 0) < self.started:
+            return None
+        return record.get('image_id')
+
+    def record(self, image_id):
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(json.dumps(
+            {'image': self.image, 'image_id': image_id,
+             'finished': time.time()}))
+        self._file.flush()
+
+
+def image_lock(client, image, timeout=None):
+    """ Returns the ImageLock of image on the daemon behind client.
+
+    :param client: the client. see docker_client.
+    :param image: the image reference, e.g. repository:tag.
+    :param timeout: the seconds to wait for the lock, LOCK_TIMEOUT if
+        not given.
+    """
+
+    daemon = getattr(docker_client.unwrap(client), 'base_url', None)
+    return ImageLock(daemon, image, timeout)
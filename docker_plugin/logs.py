@@ -0,0 +1,237 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Incremental container logs.
+
+The daemon sends a container's log as frames of an 8 byte header, the
+stream and the length, and the payload, unless the container has a TTY,
+in which case the log is sent as is. FrameDecoder demultiplexes the
+frames and LogStreamer splits them into timestamped lines as they
+arrive, so memory stays bounded by the chunk size and max_line_length
+however long the log is. The timestamp of the last line written is the
+cursor: the next fetch asks the daemon for lines since its second and
+skips the lines up to and including it.
+"""
+
+# Built-in Imports
+import calendar
+import io
+import re
+import struct
+
+# Third-party Imports
+import six
+
+# Cloudify Imports
+from docker_plugin import engine as docker_engine
+
+STDIN = 'stdin'
+STDOUT = 'stdout'
+STDERR = 'stderr'
+STREAMS = (STDIN, STDOUT, STDERR)
+
+HEADER_SIZE = 8
+MAX_LINE_LENGTH = 16 * 1024
+
+_TIMESTAMP = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,9}))?Z$')
+
+
+def parse_timestamp(value):
+    """ Returns (seconds, nanoseconds) of a UTC RFC 3339 timestamp with
+        nanoseconds, as the daemon writes them in logs, or None.
+    """
+
+    match = _TIMESTAMP.match(value or '')
+    if match is None:
+        return None
+    seconds = calendar.timegm(
+        tuple(int(part) for part in match.groups()[:6]))
+    return seconds, int((match.group(7) or '0').ljust(9, '0'))
+
+
+class FrameDecoder(object):
+    """ Incremental decoder of a multiplexed log stream. A stream that
+        does not start with a frame header is taken for the raw output
+        of a TTY container.
+    """
+
+    def __init__(self):
+        self.multiplexed = None
+        self._header = b''
+        self._stream = None
+        self._remaining = 0
+
+    def feed(self, data):
+        """ Returns the (stream, bytes) parts of the frames in data.
+        """
+
+        if self.multiplexed is None:
+            self._header += data
+            if len(self._header) < HEADER_SIZE:
+                return []
+            data, self._header = self._header, b''
+            self.multiplexed = six.indexbytes(data, 0) in (0, 1, 2) and \
+                data[1:4] == b'\0\0\0'
+        if not self.multiplexed:
+            return [(STDOUT, data)] if data else []
+
+        parts = []
+        while data:
+            if not self._remaining:
+                needed = HEADER_SIZE - len(self._header)
+                self._header += data[:needed]
+                data = data[needed:]
+                if len(self._header) < HEADER_SIZE:
+                    break
+                stream, self._remaining = struct.unpack(
+                    '>BxxxL', self._header)
+                self._stream = STREAMS[stream] if stream < 3 else STDOUT
+                self._header = b''
+                continue
+            payload = data[:self._remaining]
+            data = data[len(payload):]
+            self._remaining -= len(payload)
+            parts.append((self._stream, payload))
+        return parts
+
+
+class LogStreamer(object):
+    """ Writes the lines of a streamed log after the cursor to sink.
+
+    :param sink: called with stream, timestamp and line, without its
+        newline, for each new line.
+    :param cursor: the timestamp of the last line written before.
+    :param max_lines: the most lines to write, the call stops after
+        them and the next fetch continues from there. None for no limit.
+    :param max_line_length: longer lines are truncated.
+    """
+
+    def __init__(self, sink, cursor=None, max_lines=None,
+                 max_line_length=MAX_LINE_LENGTH):
+        self.sink = sink
+        self.cursor = cursor
+        self.max_lines = max_lines
+        self.max_line_length = max_line_length
+        self.lines = 0
+        self.skipped = 0
+        self.truncated = 0
+        self.bytes = 0
+        self._after = parse_timestamp(cursor)
+        self._decoder = FrameDecoder()
+        self._partial = dict((stream, []) for stream in STREAMS)
+        self._partial_length = dict((stream, 0) for stream in STREAMS)
+        self._overflow = set()
+
+    @property
+    def since(self):
+        """ The since parameter of the next fetch.
+        """
+
+        return self._after[0] if self._after else None
+
+    def on_data(self, data):
+        """ The engine.Call on_data callback.
+        """
+
+        self.bytes += len(data)
+        for stream, payload in self._decoder.feed(data):
+            self._feed(stream, payload)
+
+    def close(self):
+        """ Writes the lines the log ended without a newline.
+        """
+
+        try:
+            for stream in STREAMS:
+                if self._partial_length[stream]:
+                    self._line(stream, b'')
+        except docker_engine.StopStream:
+            pass
+
+    def _feed(self, stream, payload):
+        while payload:
+            end = payload.find(b'\n')
+            if end < 0:
+                self._append(stream, payload)
+                return
+            self._append(stream, payload[:end])
+            payload = payload[end + 1:]
+            self._line(stream, b'')
+
+    def _append(self, stream, data):
+        room = self.max_line_length - self._partial_length[stream]
+        if len(data) > room:
+            self._overflow.add(stream)
+            data = data[:room]
+        if not data:
+            return
+        self._partial[stream].append(data)
+        self._partial_length[stream] += len(data)
+
+    def _line(self, stream, data):
+        line = b''.join(self._partial[stream]) + data
+        truncated = stream in self._overflow
+        self._partial[stream] = []
+        self._partial_length[stream] = 0
+        self._overflow.discard(stream)
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        line = line.decode('utf-8', 'replace')
+        timestamp, _, text = line.partition(u' ')
+        key = parse_timestamp(timestamp)
+        if key is None:
+            timestamp, text = None, line
+        elif self._after is not None and key <= self._after:
+            self.skipped += 1
+            return
+        if self.max_lines is not None and self.lines >= self.max_lines:
+            raise docker_engine.StopStream()
+        if truncated:
+            self.truncated += 1
+        self.sink(stream, timestamp, text)
+        self.lines += 1
+        if key is not None:
+            self.cursor, self._after = timestamp, key
+
+
+class FileSink(object):
+    """ Appends the lines to a file, as timestamp, stream and line.
+    """
+
+    def __init__(self, path):
+        self.file = io.open(path, 'a', encoding='utf-8')
+
+    def __call__(self, stream, timestamp, text):
+        self.file.write(u'{0} {1} {2}\n'.format(
+            timestamp or '-', stream, text))
+
+    def close(self):
+        self.file.close()
+
+
+class LoggerSink(object):
+    """ Logs the lines, stderr lines as warnings.
+    """
+
+    def __init__(self, logger, container):
+        self.logger = logger
+        self.prefix = container[:12]
+
+    def __call__(self, stream, timestamp, text):
+        log = self.logger.warning if stream == STDERR else self.logger.info
+        log(u'[{0} {1}] {2}'.format(self.prefix, stream, text))
+
+    def close(self):
+        pass
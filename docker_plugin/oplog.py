@@ -0,0 +1,243 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bounded, structured logging of the plugin's operations.
+
+Every record is a fixed message followed by its fields as one JSON
+object, e.g. 'Container created. {"container": "4f2a..."}'. Field values
+are cut down to a few list items and dict keys and a few hundred
+characters per string, and the whole record to MAX_LENGTH, so the size of
+a record does not depend on how many containers, ports or processes it
+describes.
+
+The verbosity of an operation is its log_verbosity input: debug, info,
+warning or error. Details such as docker-py arguments and top tables are
+logged at debug and dropped by default. ctx.logger itself drops debug
+records, so with debug verbosity they are written at info.
+
+A message is logged at most burst times per interval seconds. The rest
+are counted and reported in one record when the interval ends or the
+operation finishes.
+"""
+
+# Built-in Imports
+import functools
+import json
+import logging
+import threading
+import time
+
+# Third-party Imports
+import six
+
+# Cloudify Imports
+from cloudify import ctx
+from cloudify.exceptions import NonRecoverableError
+
+DEBUG = 'debug'
+INFO = 'info'
+WARNING = 'warning'
+ERROR = 'error'
+VERBOSITIES = {
+    DEBUG: logging.DEBUG,
+    INFO: logging.INFO,
+    WARNING: logging.WARNING,
+    ERROR: logging.ERROR,
+}
+
+MAX_LENGTH = 1024
+MAX_ITEMS = 10
+MAX_STRING = 256
+MAX_DEPTH = 6
+BURST = 5
+INTERVAL = 60
+
+_local = threading.local()
+
+
+def bound(value, max_items=MAX_ITEMS, max_string=MAX_STRING,
+          depth=MAX_DEPTH):
+    """ Returns a copy of value with at most max_items items per list and
+        dict, at most max_string characters per string and at most depth
+        levels of nesting. What is left out is replaced by a note saying
+        how much was.
+    """
+
+    if isinstance(value, six.string_types):
+        if len(value) <= max_string:
+            return value
+        return u'{0}...(+{1} chars)'.format(
+            value[:max_string], len(value) - max_string)
+    if isinstance(value, dict):
+        if depth <= 0:
+            return u'{{...{0} keys}}'.format(len(value))
+        keys = sorted(value, key=str)
+        result = dict((str(key), bound(value[key], max_items, max_string,
+                                       depth - 1))
+                      for key in keys[:max_items])
+        if len(keys) > max_items:
+            result['...'] = u'+{0} keys'.format(len(keys) - max_items)
+        return result
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if depth <= 0:
+            return u'[...{0} items]'.format(len(value))
+        items = list(value)
+        result = [bound(item, max_items, max_string, depth - 1)
+                  for item in items[:max_items]]
+        if len(items) > max_items:
+            result.append(u'...+{0} items'.format(len(items) - max_items))
+        return result
+    if value is None or isinstance(
+            value, (bool, float) + six.integer_types):
+        return value
+    return bound(str(value), max_items, max_string, depth)
+
+
+def level_of(verbosity):
+    """ Returns the logging level of a log_verbosity input.
+
+    :raises NonRecoverableError: when verbosity is not one of VERBOSITIES.
+    """
+
+    level = VERBOSITIES.get(str(verbosity or INFO).lower())
+    if level is None:
+        raise NonRecoverableError(
+            'Unknown log_verbosity {0}. Allowed values: {1}.'.format(
+                verbosity, ', '.join(sorted(VERBOSITIES))))
+    return level
+
+
+class OperationLogger(object):
+    """ Writes bounded, structured, rate limited records to a logger.
+        It can stand in for the logger, info(message) and the like work
+        unchanged.
+
+    :param logger: a logging.Logger, usually ctx.logger.
+    :param verbosity: the lowest level logged, see VERBOSITIES.
+    :param burst: how many times a message is logged per interval.
+    :param interval: the rate limiting interval in seconds.
+    """
+
+    def __init__(self, logger, verbosity=INFO, max_length=MAX_LENGTH,
+                 burst=BURST, interval=INTERVAL, clock=time.time):
+        self.logger = logger
+        self.level = level_of(verbosity)
+        self.max_length = max_length
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def debug(self, message, **fields):
+        self.log(logging.DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(logging.INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(logging.WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(logging.ERROR, message, **fields)
+
+    def log(self, level, message, **fields):
+        """ Logs message with fields unless the level is below the
+            verbosity or message was already logged burst times in the
+            current interval.
+        """
+
+        if level < self.level:
+            return
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(message)
+            if window is not None and now - window['started'] >= \
+                    self.interval:
+                self._report_suppressed(message, window)
+                window = None
+            if window is None:
+                window = self._windows[message] = {
+                    'started': now, 'count': 0, 'suppressed': 0,
+                    'level': level}
+            window['count'] += 1
+            if window['count'] > self.burst:
+                window['suppressed'] += 1
+                return
+        self._write(level, message, fields)
+
+    def flush(self):
+        """ Reports the messages suppressed so far.
+        """
+
+        with self._lock:
+            windows, self._windows = self._windows, {}
+        for message, window in sorted(windows.items()):
+            self._report_suppressed(message, window)
+
+    def _report_suppressed(self, message, window):
+        if window['suppressed']:
+            self._write(window['level'], 'Suppressed repeated messages.',
+                        {'message': message,
+                         'suppressed': window['suppressed']})
+
+    def _write(self, level, message, fields):
+        if fields:
+            message = u'{0} {1}'.format(message, json.dumps(
+                bound(fields), sort_keys=True, default=str))
+        if len(message) > self.max_length:
+            message = u'{0}...(+{1} chars)'.format(
+                message[:self.max_length], len(message) - self.max_length)
+        # ctx.logger drops records below info, the ones the verbosity
+        # asks for are written at info at least.
+        self.logger.log(max(level, logging.INFO), message)
+
+
+def wrap(logger, verbosity=INFO):
+    """ Returns logger if it is an OperationLogger, otherwise an
+        OperationLogger writing to it.
+    """
+
+    if isinstance(logger, OperationLogger):
+        return logger
+    return OperationLogger(logger, verbosity)
+
+
+def current():
+    """ Returns the OperationLogger of the running operation, or one
+        writing to ctx.logger outside of logged operations.
+    """
+
+    logger = getattr(_local, 'logger', None)
+    if logger is None:
+        return OperationLogger(ctx.logger)
+    return logger
+
+
+def logged(func):
+    """ Gives an operation an OperationLogger with the verbosity of its
+        log_verbosity input. Apply below cloudify's operation decorator.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        logger = OperationLogger(
+            ctx.logger, kwargs.get('log_verbosity') or INFO)
+        _local.logger = logger
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.logger = None
+            logger.flush()
+    return wrapper
@@ -0,0 +1,233 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Readiness probes run against a started container.
+
+A probe is a dictionary with a type key and type specific keys:
+
+    {'type': 'process', 'name': '/usr/sbin/sshd'}
+    {'type': 'tcp', 'port': 5432}
+    {'type': 'http', 'port': 8080, 'path': '/health', 'status': 200}
+    {'type': 'exec', 'command': 'pg_isready'}
+
+All probes of a container run concurrently, each one retried with an
+exponential backoff until it passes or the overall deadline is reached.
+A probe that fails with an error stops all of them.
+Probes run in their own threads, so they must not use the (thread local)
+cloudify ctx.
+"""
+
+# Built-in Imports
+import socket
+import threading
+import time
+
+# Third-party Imports
+import requests
+from six.moves import queue
+
+# Cloudify Imports
+from cloudify.exceptions import NonRecoverableError
+
+INITIAL_INTERVAL = 0.1
+MAX_INTERVAL = 2.0
+CONNECT_TIMEOUT = 2.0
+
+
+def process_probe(client, container, probe):
+    """ Passes when a process whose command contains probe['name']
+        is running in the container.
+    """
+
+    top_result = client.top(container)
+    # last element of list is the command executed
+    return any(probe['name'] in process[-1]
+               for process in top_result.get('Processes') or [])
+
+
+def tcp_probe(client, container, probe):
+    """ Passes when probe['port'] accepts connections on the container IP.
+    """
+
+    address = (_get_ip_address(client, container, probe), int(probe['port']))
+    try:
+        connection = socket.create_connection(address, CONNECT_TIMEOUT)
+    except (socket.error, socket.timeout):
+        return False
+    connection.close()
+    return True
+
+
+def http_probe(client, container, probe):
+    """ Passes when a GET of probe['path'] on the container IP answers with
+        probe['status'], or with any status below 400 if not given.
+    """
+
+    url = '{0}://{1}:{2}{3}'.format(
+        probe.get('scheme', 'http'),
+        _get_ip_address(client, container, probe),
+        probe['port'], probe.get('path', '/'))
+    try:
+        response = requests.get(url, timeout=CONNECT_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return False
+    if 'status' in probe:
+        return response.status_code == int(probe['status'])
+    return response.status_code < 400
+
+
+def exec_probe(client, container, probe):
+    """ Passes when probe['command'] exits with code 0 in the container.
+    """
+
+    exec_id = client.exec_create(container, probe['command'])
+    client.exec_start(exec_id)
+    return client.exec_inspect(exec_id).get('ExitCode') == 0
+
+
+PROBES = {
+    'process': process_probe,
+    'tcp': tcp_probe,
+    'http': http_probe,
+    'exec': exec_probe,
+}
+
+# The keys each probe type needs.
+REQUIRED_KEYS = {
+    'process': ['name'],
+    'tcp': ['port'],
+    'http': ['port'],
+    'exec': ['command'],
+}
+
+
+def _get_ip_address(client, container, probe):
+    if probe.get('host'):
+        return probe['host']
+    if '_ip_address' not in probe:
+        network_settings = \
+            client.inspect_container(container).get('NetworkSettings') or {}
+        probe['_ip_address'] = network_settings.get('IPAddress')
+    if not probe['_ip_address']:
+        # e.g. network_mode host, the agent would probe itself.
+        raise NonRecoverableError(
+            'The container has no IP address, set the host of the probe.')
+    return probe['_ip_address']
+
+
+def describe(probe):
+    return ' '.join('{0}={1}'.format(k, v)
+                    for k, v in sorted(probe.items())
+                    if not k.startswith('_'))
+
+
+def validate(probes):
+    """ Raises NonRecoverableError for probes of an unknown type or
+        without the keys their type needs.
+    """
+
+    for probe in probes:
+        if probe.get('type') not in PROBES:
+            raise NonRecoverableError(
+                'Unknown readiness probe type in {0}. Allowed types: {1}.'
+                .format(probe, ', '.join(sorted(PROBES))))
+        missing = [key for key in REQUIRED_KEYS[probe['type']]
+                   if key not in probe]
+        if missing:
+            raise NonRecoverableError(
+                'Readiness probe {0} is missing {1}.'.format(
+                    probe, ', '.join(missing)))
+
+
+class _ProbeRunner(threading.Thread):
+    """ Retries one probe until it passes, the deadline is reached or
+        stop is set, then puts itself on the finished queue.
+    """
+
+    def __init__(self, client, container, probe, deadline, stop, finished):
+        super(_ProbeRunner, self).__init__()
+        self.daemon = True
+        self.client = client
+        self.container = container
+        self.probe = dict(probe)
+        self.deadline = deadline
+        self.stop = stop
+        self.finished = finished
+        self.passed = False
+        self.error = None
+        self.attempts = 0
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self.finished.put(self)
+
+    def _run(self):
+        check = PROBES[self.probe['type']]
+        interval = INITIAL_INTERVAL
+        while not self.stop.is_set():
+            self.attempts += 1
+            try:
+                self.passed = check(self.client, self.container, self.probe)
+            except Exception as e:
+                # Reported by run_probes, not as a traceback of the thread.
+                self.error = e
+                return
+            if self.passed:
+                return
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                return
+            self.stop.wait(min(interval, remaining))
+            interval = min(interval * 2, MAX_INTERVAL)
+
+
+def run_probes(client, container, probes, timeout):
+    """ Runs probes concurrently until all pass or timeout seconds pass.
+
+    :param client: the client. see docker_client.
+    :param container: the container id.
+    :param probes: a list of probe dictionaries.
+    :param timeout: the overall deadline in seconds.
+    :raises NonRecoverableError: when a probe is not valid or fails with
+        an error, e.g. of the docker API or the connection to the daemon.
+    :return: a list of the probes that did not pass.
+    """
+
+    validate(probes)
+    deadline = time.time() + timeout
+    stop = threading.Event()
+    finished = queue.Queue()
+    runners = [_ProbeRunner(client, container, probe, deadline, stop,
+                            finished)
+               for probe in probes]
+    for runner in runners:
+        runner.start()
+    try:
+        for _ in runners:
+            try:
+                done = finished.get(
+                    timeout=max(deadline - time.time(), 0) + CONNECT_TIMEOUT)
+            except queue.Empty:
+                break
+            if done.error is not None:
+                raise NonRecoverableError(
+                    'Readiness probe {0} failed: {1}'.format(
+                        describe(done.probe), str(done.error)))
+    finally:
+        # the others are not waited for
+        stop.set()
+
+    return [runner.probe for runner in runners if not runner.passed]
@@ -0,0 +1,204 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Registry mirror selection for pulls.
+
+The registries configuration lists mirrors of the default registry.
+Mirrors are probed with a request to their API root and ranked by the
+latency measured and the throughput of the pulls from them. A Ranking
+is kept per agent on disk, next to the image locks, and probes expire
+after ttl seconds. A mirror that is down or failed a pull is ranked last
+until its entry expires. Probes run from the agent, which is usually the
+daemon's host.
+"""
+
+# Built-in Imports
+import fcntl
+import json
+import os
+import threading
+import time
+
+# Third-party Imports
+import requests
+
+# Cloudify Imports
+from docker_plugin import locks
+
+DEFAULT_TTL = 3600
+DEFAULT_TIMEOUT = 2
+
+# The pull size a throughput is weighed at against a latency.
+REFERENCE_BYTES = 100 * 1024 * 1024
+
+
+class Mirror(object):
+    """ A registry mirror, given as host[:port] or as a URL.
+    """
+
+    def __init__(self, address):
+        address = address.rstrip('/')
+        if '://' in address:
+            self.url = address
+            self.host = address.split('://', 1)[1]
+        else:
+            self.url = 'https://{0}'.format(address)
+            self.host = address
+
+    def __repr__(self):
+        return self.host
+
+    def repository(self, repository):
+        """ Returns the name of repository on the mirror, official images
+            are in library.
+        """
+
+        if '/' not in repository:
+            repository = 'library/{0}'.format(repository)
+        return '{0}/{1}'.format(self.host, repository)
+
+
+class Config(object):
+    """ The registries configuration.
+
+    :param registries: a dict with mirrors, a list of host[:port] or
+        URLs, and optionally ttl, probe_timeout and fallback, whether to
+        pull from the default registry when no mirror has the image.
+    :raises ValueError: when the configuration is not valid.
+    """
+
+    def __init__(self, registries=None):
+        registries = dict(registries or {})
+        unknown = set(registries) - set(
+            ['mirrors', 'ttl', 'probe_timeout', 'fallback'])
+        if unknown:
+            raise ValueError('Unknown registries keys: {0}.'.format(
+                ', '.join(sorted(unknown))))
+        self.mirrors = [Mirror(m) for m in registries.get('mirrors') or []]
+        self.ttl = registries.get('ttl', DEFAULT_TTL)
+        self.probe_timeout = registries.get('probe_timeout', DEFAULT_TIMEOUT)
+        self.fallback = registries.get('fallback', True)
+
+    def applies(self, repository):
+        """ Whether repository is on the default registry, so on the
+            mirrors. Repositories of other registries start with a host.
+        """
+
+        if not self.mirrors:
+            return False
+        if '/' not in repository:
+            return True
+        first = repository.split('/', 1)[0]
+        return not ('.' in first or ':' in first or first == 'localhost')
+
+
+def probe(mirror, timeout):
+    """ Returns the seconds the API root of mirror took to answer, or None
+        when it did not. An authentication challenge is an answer.
+    """
+
+    started = time.time()
+    try:
+        response = requests.get('{0}/v2/'.format(mirror.url),
+                                timeout=timeout)
+    except requests.RequestException:
+        return None
+    if response.status_code >= 500:
+        return None
+    return time.time() - started
+
+
+class Ranking(object):
+    """ The probes and pull results of the mirrors, stored as JSON in
+        locks.LOCK_DIR and shared by the operations on the agent.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.path = os.path.join(locks.LOCK_DIR, 'registries.json')
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _update(self, host, **fields):
+        if not os.path.isdir(locks.LOCK_DIR):
+            os.makedirs(locks.LOCK_DIR)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                entries = json.load(f)
+            except ValueError:
+                entries = {}
+            entries.setdefault(host, {}).update(fields)
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f)
+
+    def entries(self):
+        return self._read()
+
+    def rank(self, config):
+        """ Returns the mirrors of config, fastest first. Mirrors without a
+            probe younger than ttl are probed, concurrently.
+        """
+
+        now = self.clock()
+        entries = self._read()
+        stale = [m for m in config.mirrors
+                 if now - entries.get(m.host, {}).get('probed', -config.ttl)
+                 >= config.ttl]
+        latencies = {}
+
+        def run(mirror):
+            latencies[mirror.host] = probe(mirror, config.probe_timeout)
+
+        threads = [threading.Thread(target=run, args=(m, )) for m in stale]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for mirror in stale:
+            self._update(mirror.host, probed=now,
+                         latency=latencies[mirror.host])
+        entries = self._read()
+
+        def key(mirror):
+            entry = entries.get(mirror.host, {})
+            failed = entry.get('failed')
+            down = entry.get('latency') is None or \
+                failed is not None and now - failed < config.ttl
+            seconds = entry.get('latency') or 0
+            if entry.get('throughput'):
+                seconds += REFERENCE_BYTES / float(entry['throughput'])
+            return down, seconds
+
+        return sorted(config.mirrors, key=key)
+
+    def record_pull(self, mirror, size, seconds):
+        """ Records a successful pull of size bytes in seconds.
+        """
+
+        fields = {'failed': None}
+        if size and seconds > 0:
+            fields['throughput'] = size / float(seconds)
+        self._update(mirror.host, **fields)
+
+    def record_failure(self, mirror):
+        self._update(mirror.host, failed=self.clock())
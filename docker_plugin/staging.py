@@ -0,0 +1,132 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Staged runtime property writes.
+
+Operations decorated with staged write their runtime properties to a
+RuntimePropertyBuffer instead of ctx.instance.runtime_properties. The
+buffer is applied to the instance in one mutation when the operation
+succeeds and dropped when it fails, so what a failed or retried
+operation wrote through the buffer is not stored. Cloudify's operation
+decorator sends the manager one update per operation either way.
+
+Two writes bypass the buffer on purpose, to be kept when the operation
+fails: api_call_stats, see instrumentation.report, and the logs_cursor
+of a stream_logs fetch that failed part way.
+"""
+
+# Built-in Imports
+import collections
+import functools
+import threading
+
+# Cloudify Imports
+from cloudify import ctx
+
+_local = threading.local()
+_DELETED = object()
+
+
+class RuntimePropertyBuffer(collections.MutableMapping):
+    """ A view of runtime properties that keeps its changes until flush.
+        Values are not copied, mutating a value read from the buffer in
+        place bypasses it.
+
+    :param runtime_properties: the runtime properties to change.
+    """
+
+    def __init__(self, runtime_properties):
+        self.runtime_properties = runtime_properties
+        self._changes = {}
+
+    def __getitem__(self, key):
+        if key not in self._changes:
+            return self.runtime_properties[key]
+        value = self._changes[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._changes[key] = _DELETED
+
+    def __iter__(self):
+        for key in self.runtime_properties:
+            if key not in self._changes:
+                yield key
+        for key, value in self._changes.items():
+            if value is not _DELETED:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in self._changes:
+            return self._changes[key] is not _DELETED
+        return key in self.runtime_properties
+
+    def flush(self):
+        """ Applies the changes to the runtime properties in one update,
+            plus one deletion per deleted key.
+        """
+
+        changes, self._changes = self._changes, {}
+        for key, value in changes.items():
+            if value is _DELETED:
+                self.runtime_properties.pop(key, None)
+        updates = dict((key, value) for key, value in changes.items()
+                       if value is not _DELETED)
+        if updates:
+            self.runtime_properties.update(updates)
+
+    def discard(self):
+        self._changes = {}
+
+
+def runtime_properties():
+    """ Returns the RuntimePropertyBuffer of the running operation, or
+        ctx.instance.runtime_properties outside of staged operations.
+    """
+
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        return ctx.instance.runtime_properties
+    return buffer
+
+
+def staged(func):
+    """ Stages the runtime property writes of an operation, see
+        RuntimePropertyBuffer. Apply below cloudify's operation decorator.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        buffer = RuntimePropertyBuffer(ctx.instance.runtime_properties)
+        _local.buffer = buffer
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            buffer.discard()
+            raise
+        finally:
+            _local.buffer = None
+        buffer.flush()
+        return result
+    return wrapper
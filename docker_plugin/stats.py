@@ -0,0 +1,279 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Container resource usage from the daemon's streaming stats endpoint.
+
+The daemon streams a cumulative stats message per container about once a
+second. ContainerStats turns consecutive messages into rates: CPU percent,
+network and block I/O bytes per second, and memory usage. It downsamples
+them into fixed interval aggregates kept in a RingBuffer of the last few
+intervals. Collector reads the stats streams of many containers over one
+engine.EngineClient, so a single thread watches all of them with one
+connection per container instead of one request per container per tick.
+"""
+
+# Built-in Imports
+import array
+import calendar
+import functools
+import re
+import time
+
+# Cloudify Imports
+from docker_plugin import engine as docker_engine
+
+# The aggregate of one interval.
+FIELDS = ('start', 'samples', 'cpu_percent', 'memory_bytes',
+          'network_rx_bps', 'network_tx_bps', 'blkio_read_bps',
+          'blkio_write_bps')
+
+_TIMESTAMP = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)$')
+
+
+def parse_timestamp(value):
+    """ Returns the seconds since the epoch of an RFC 3339 timestamp as
+        the daemon writes them, or None.
+    """
+
+    match = _TIMESTAMP.match(value or '')
+    if match is None:
+        return None
+    seconds = calendar.timegm(
+        tuple(int(part) for part in match.groups()[:6]))
+    fraction, zone = match.group(7), match.group(8)
+    if fraction:
+        seconds += float(fraction[:10])
+    if zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds -= offset if zone[0] == '+' else -offset
+    return seconds
+
+
+class RingBuffer(object):
+    """ The last capacity rows of a fixed number of numbers, stored in
+        one flat array of doubles.
+    """
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self._values = array.array('d', [0.0]) * (width * capacity)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        offset = self._next * self.width
+        self._values[offset:offset + self.width] = array.array('d', row)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def rows(self):
+        """ Returns the rows, oldest first, as tuples.
+        """
+
+        first = (self._next - self._count) % self.capacity
+        return [tuple(self._values[i * self.width:(i + 1) * self.width])
+                for i in ((first + n) % self.capacity
+                          for n in range(self._count))]
+
+
+def _counters(message):
+    cpu = message.get('cpu_stats') or {}
+    usage = cpu.get('cpu_usage') or {}
+    networks = message.get('networks') or \
+        {'': message.get('network') or {}}
+    blkio = (message.get('blkio_stats') or {}).get(
+        'io_service_bytes_recursive') or []
+    return {
+        'cpu': usage.get('total_usage') or 0,
+        'system': cpu.get('system_cpu_usage') or 0,
+        'cpus': cpu.get('online_cpus') or
+        len(usage.get('percpu_usage') or []) or 1,
+        'rx': sum(n.get('rx_bytes') or 0 for n in networks.values()),
+        'tx': sum(n.get('tx_bytes') or 0 for n in networks.values()),
+        'read': sum(e.get('value') or 0 for e in blkio
+                    if (e.get('op') or '').lower() == 'read'),
+        'write': sum(e.get('value') or 0 for e in blkio
+                     if (e.get('op') or '').lower() == 'write'),
+    }
+
+
+class ContainerStats(object):
+    """ Downsamples the stats messages of one container into interval
+        second aggregates, keeping the last capacity of them.
+
+    :param clock: the time of messages without a timestamp.
+    """
+
+    def __init__(self, interval=10, capacity=60, clock=time.time):
+        self.interval = interval
+        self.clock = clock
+        self.buffer = RingBuffer(len(FIELDS), capacity)
+        self.samples = 0
+        self.memory_limit = None
+        self._previous = None
+        self._bucket = None
+
+    def add(self, message):
+        """ Adds a stats message. The first one only sets the baseline.
+        """
+
+        now = parse_timestamp(message.get('read')) or self.clock()
+        counters = _counters(message)
+        previous, self._previous = self._previous, (now, counters)
+        memory = message.get('memory_stats') or {}
+        self.memory_limit = memory.get('limit') or self.memory_limit
+        if previous is None or now <= previous[0]:
+            return
+
+        elapsed = now - previous[0]
+
+        # counters restart from zero when the container restarts
+        def rate(name):
+            return max(0, counters[name] - previous[1][name]) / elapsed
+
+        system = counters['system'] - previous[1]['system']
+        cpu = max(0, counters['cpu'] - previous[1]['cpu'])
+        sample = (
+            100.0 * cpu * counters['cpus'] / system if system > 0 else 0.0,
+            memory.get('usage') or 0,
+            rate('rx'), rate('tx'), rate('read'), rate('write'))
+
+        start = now - now % self.interval
+        if self._bucket is not None and self._bucket[0] != start:
+            self.flush()
+        if self._bucket is None:
+            self._bucket = [start, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+        bucket = self._bucket
+        bucket[1] += 1
+        bucket[2] += sample[0]
+        bucket[3] = max(bucket[3], sample[1])
+        for i in range(2, 6):
+            bucket[i + 2] += sample[i]
+        self.samples += 1
+
+    def flush(self):
+        """ Closes the current interval, averaging its sums.
+        """
+
+        bucket, self._bucket = self._bucket, None
+        if bucket is None:
+            return
+        samples = bucket[1]
+        self.buffer.append(
+            bucket[:2] + [bucket[2] / samples, bucket[3]] +
+            [value / samples for value in bucket[4:]])
+
+    def summary(self):
+        """ Returns the aggregates of the closed intervals: means of the
+            rates, the peak CPU and memory, and the last interval.
+        """
+
+        rows = [dict(zip(FIELDS, row)) for row in self.buffer.rows()]
+        if not rows:
+            return {'samples': self.samples, 'intervals': 0}
+
+        def mean(field):
+            return round(sum(row[field] * row['samples'] for row in rows) /
+                         sum(row['samples'] for row in rows), 2)
+
+        return {
+            'samples': self.samples,
+            'intervals': len(rows),
+            'interval': self.interval,
+            'start': rows[0]['start'],
+            'end': rows[-1]['start'] + self.interval,
+            'cpu_percent': mean('cpu_percent'),
+            'max_cpu_percent': round(max(r['cpu_percent'] for r in rows), 2),
+            'memory_bytes': int(rows[-1]['memory_bytes']),
+            'max_memory_bytes': int(max(r['memory_bytes'] for r in rows)),
+            'memory_limit': self.memory_limit,
+            'network_rx_bps': mean('network_rx_bps'),
+            'network_tx_bps': mean('network_tx_bps'),
+            'blkio_read_bps': mean('blkio_read_bps'),
+            'blkio_write_bps': mean('blkio_write_bps'),
+        }
+
+
+class Collector(object):
+    """ Reads the stats streams of many containers for duration seconds.
+
+    :param engine: an engine.EngineClient of the containers' daemon.
+    :param containers: a dict of a key, e.g. a node instance id, to the
+        container id.
+    :param on_summary: called with a dict of key to ContainerStats
+        summary every summary_interval seconds.
+    """
+
+    def __init__(self, engine, containers, duration, interval=10,
+                 capacity=60, summary_interval=60, on_summary=None,
+                 clock=time.time):
+        self.engine = engine
+        self.containers = containers
+        self.duration = duration
+        self.summary_interval = summary_interval
+        self.on_summary = on_summary
+        self.clock = clock
+        self.stats = dict((key, ContainerStats(interval, capacity, clock))
+                          for key in containers)
+        self.errors = {}
+        self._end = None
+        self._last_summary = None
+
+    def summaries(self):
+        return dict((key, stats.summary())
+                    for key, stats in self.stats.items())
+
+    def run(self):
+        """ Collects until duration passed and returns the summaries.
+            Containers whose stream failed are in errors.
+        """
+
+        started = self.clock()
+        self._end = started + self.duration
+        self._last_summary = started
+        calls = dict(
+            (key, self.engine.stats(
+                container, functools.partial(self._on_message, key),
+                timeout=self.duration + self.engine.timeout))
+            for key, container in self.containers.items())
+        # quiet streams end at the deadline too, without an error
+        self.engine.run(calls.values(), max_connections=len(calls) or 1,
+                        until=time.time() + self.duration)
+
+        for key, call in calls.items():
+            try:
+                call.get()
+            except docker_engine.EngineError as e:
+                self.errors[key] = str(e)
+        for stats in self.stats.values():
+            stats.flush()
+        summaries = self.summaries()
+        if self.on_summary is not None:
+            self.on_summary(summaries)
+        return summaries
+
+    def _on_message(self, key, message):
+        self.stats[key].add(message)
+        now = self.clock()
+        if self.on_summary is not None and \
+                now - self._last_summary >= self.summary_interval:
+            self._last_summary = now
+            self.on_summary(self.summaries())
+        if now >= self._end:
+            raise docker_engine.StopStream()
@@ -0,0 +1,148 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Helpers for the streamed JSON responses of the docker daemon."""
+
+# Built-in Imports
+import codecs
+import json
+import time
+
+
+class StreamError(Exception):
+    """An error reported by the daemon inside a streamed response."""
+
+
+class JsonStreamDecoder(object):
+    """ Incremental decoder for a streamed docker response. The daemon
+        does not align objects with chunks, a chunk may hold several
+        objects or only part of one.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = u''
+
+    def feed(self, chunk):
+        """ Returns the objects completed by chunk.
+        """
+
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        self._buf += chunk
+        objects = []
+        while True:
+            self._buf = self._buf.lstrip()
+            if not self._buf:
+                break
+            try:
+                obj, end = self._decoder.raw_decode(self._buf)
+            except ValueError:
+                break
+            self._buf = self._buf[end:]
+            objects.append(obj)
+        return objects
+
+    def close(self):
+        """ :raises ValueError: when the stream ended inside an object.
+        """
+
+        if self._buf.strip():
+            raise ValueError(
+                'Stream ended with an incomplete JSON object: {0}'.format(
+                    self._buf[:100]))
+
+
+def decode_json_stream(chunks):
+    """ Yields the JSON objects of a streamed docker response.
+
+    :param chunks: an iterable of str/bytes chunks.
+    :raises ValueError: when the stream ends in the middle of an object.
+    """
+
+    decoder = JsonStreamDecoder()
+    for chunk in chunks:
+        for obj in decoder.feed(chunk):
+            yield obj
+    decoder.close()
+
+
+def raise_for_error(message):
+    """ Raises StreamError if message is an error message.
+    """
+
+    error = message.get('error') or \
+        (message.get('errorDetail') or {}).get('message')
+    if error:
+        raise StreamError(error)
+
+
+class PullProgress(object):
+    """ Aggregates the per layer progress messages of a pull into overall
+        progress and logs it at most once every interval seconds.
+    """
+
+    DONE = ('Download complete', 'Pull complete', 'Already exists')
+
+    def __init__(self, logger, name, interval, clock=time.time):
+        self.logger = logger
+        self.name = name
+        self.interval = interval
+        self.clock = clock
+        self.started = clock()
+        self.finished = None
+        self.last_log = None
+        self.layers = dict()
+
+    @property
+    def total_bytes(self):
+        return sum(total for _, total in self.layers.values())
+
+    @property
+    def downloaded_bytes(self):
+        return sum(current for current, _ in self.layers.values())
+
+    @property
+    def duration(self):
+        return (self.finished or self.clock()) - self.started
+
+    def update(self, message):
+        raise_for_error(message)
+
+        layer = message.get('id')
+        status = message.get('status', '')
+        detail = message.get('progressDetail') or {}
+
+        if layer and status == 'Downloading' and detail.get('total'):
+            self.layers[layer] = [detail.get('current', 0), detail['total']]
+        elif layer in self.layers and status in self.DONE:
+            self.layers[layer][0] = self.layers[layer][1]
+
+        now = self.clock()
+        if self.last_log is None or now - self.last_log >= self.interval:
+            self.last_log = now
+            self.log()
+
+    def log(self):
+        done = sum(1 for current, total in self.layers.values()
+                   if current >= total)
+        self.logger.info(
+            'Pulling {0}: {1}/{2} layers, {3}/{4} bytes, {5:.1f}s.'.format(
+                self.name, done, len(self.layers), self.downloaded_bytes,
+                self.total_bytes, self.duration))
+
+    def finish(self):
+        self.finished = self.clock()
+        self.log()
@@ -16,9 +16,10 @@
 """Cloudify tasks that operate docker containers using python docker api"""
 
 # Built-in Imports
-import json
+import os
 
 # Third-party Imports
+import requests
 from docker.errors import APIError
 
 # Cloudify Imports
@@ -27,10 +28,33 @@ from cloudify.exceptions import NonRecoverableError, RecoverableError
 from cloudify.decorators import operation
 from docker_plugin import utils
 from docker_plugin import docker_client
+from docker_plugin import instrumentation
+from docker_plugin import oplog
+from docker_plugin import staging
+from docker_plugin.lazy import LazyModule
+
+# Only some operations build, pull, import, probe or read logs.
+builds = LazyModule('docker_plugin.builds')
+container_logs = LazyModule('docker_plugin.logs')
+docker_engine = LazyModule('docker_plugin.engine')
+imports = LazyModule('docker_plugin.imports')
+locks = LazyModule('docker_plugin.locks')
+readiness = LazyModule('docker_plugin.readiness')
+registry_mirrors = LazyModule('docker_plugin.registries')
+streams = LazyModule('docker_plugin.streams')
+
+# The runtime property of the timestamp of the last log line fetched.
+LOGS_CURSOR = 'logs_cursor'
 
 
 @operation
-def create_container(params, daemon_client=None, **_):
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+@docker_client.leased
+def create_container(params, daemon_client=None, pull_progress_interval=10,
+                     registries=None, image_lock_timeout=None,
+                     log_verbosity=oplog.INFO, **_):
     """ cloudify.docker.container type create lifecycle operation.
         Creates a container that can then be .start() ed.
 
@@ -43,97 +67,140 @@ def create_container(params, daemon_client=None, **_):
         will pass only the dict keys as the ports parameter and
         the start function will pass the pairs as port bindings.
     :param daemon_client: optional configuration for client creation
+    :param pull_progress_interval: The minimum number of seconds between
+        image pull progress log messages.
+    :param registries: Mirrors of the default registry to pull the image
+        from, see registries.Config.
+    :param image_lock_timeout: The number of seconds to wait for another
+        operation that transfers the same image, see locks.
+    :param log_verbosity: debug, info, warning or error. see oplog.
     """
 
     daemon_client = daemon_client or {}
-    client = docker_client.get_client(daemon_client)
+    client = docker_client.get_operation_client(daemon_client)
 
     if ctx.node.properties['use_external_resource']:
         if 'name' not in ctx.node.properties:
             raise NonRecoverableError(
                 'Use external resource, but '
                 'no resource id provided.')
-        ctx.instance.runtime_properties['container_id'] = \
+        staging.runtime_properties()['container_id'] = \
             utils.get_container_id_from_name(
                 ctx.node.properties['name'], client)
         return
 
     arguments = dict()
     arguments['name'] = ctx.node.properties['name']
-    arguments['image'] = get_image(client)
+    arguments['image'] = get_image(client, pull_progress_interval,
+                                   registries, image_lock_timeout)
     arguments.update(params)
 
-    ctx.logger.info('Create container arguments: {0}'.format(arguments))
+    log = oplog.current()
+    log.debug('Create container arguments.', arguments=arguments)
 
     try:
         container = client.create_container(**arguments)
     except APIError as e:
+        if e.response is not None and e.response.status_code == 404:
+            # the image was removed after it was indexed, the retry
+            # looks it up again and pulls it if needed
+            utils.invalidate_image_index(client)
+            raise RecoverableError(
+                'Image {0} is not present any more: {1}'.format(
+                    arguments['image'], str(e)))
         raise NonRecoverableError(
             'Error while creating container: {0}'.format(str(e)))
 
-    ctx.instance.runtime_properties['container_id'] = container.get('Id')
-    ctx.logger.info('Container created: {0}.'.format(container.get('Id')))
+    staging.runtime_properties()['container_id'] = container.get('Id')
+    log.info('Container created.', container=container.get('Id'))
 
 
 @operation
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+@docker_client.leased
 def start(params, processes_to_wait_for, retry_interval,
-          daemon_client=None, **_):
+          daemon_client=None, readiness_probes=None, readiness_timeout=60,
+          log_verbosity=oplog.INFO, **_):
     """ cloudify.docker.container type start lifecycle operation.
         Any properties and runtime_properties set in the create
         lifecycle operation also available in start.
         Similar to the docker start command, but doesn't support
         attach options.
 
+    :node_property inspect_fields: The fields of the inspect output
+        stored as runtime properties, see utils.project_inspect.
+    :node_property inspect_output_dir: Where to write the whole inspect
+        output, if anywhere.
+
     :param daemon_client: optional configuration for client creation
-    :param retry_interval: The number of seconds between retries during
-        the wait_for_processes bit.
+    :param processes_to_wait_for: A list of process names that must be
+        running in the container, shorthand for process readiness probes.
+    :param readiness_probes: A list of readiness probes, see readiness.
+    :param readiness_timeout: The number of seconds to wait for all
+        readiness probes to pass before retrying the operation.
+    :param retry_interval: The number of seconds before the operation is
+        retried when the readiness probes did not pass.
+    :param log_verbosity: debug, info, warning or error. see oplog.
     """
 
     daemon_client = daemon_client or {}
-    client = docker_client.get_client(daemon_client)
+    client = docker_client.get_operation_client(daemon_client)
 
     if ctx.node.properties['use_external_resource']:
         if utils.get_container_dictionary(client) is None:
             raise NonRecoverableError('{} does not exist.'.format(
-                ctx.instance.runtime_properties.get('container_id')))
+                staging.runtime_properties().get('container_id')))
 
-    container_id = ctx.instance.runtime_properties['container_id']
+    container_id = staging.runtime_properties()['container_id']
     arguments = {'container': container_id}
     arguments.update(params)
 
-    ctx.logger.info('Start arguments: {0}'.format(arguments))
+    log = oplog.current()
+    log.debug('Start arguments.', arguments=arguments)
 
     try:
-        response = client.start(**arguments)
+        client.start(**arguments)
     except APIError as e:
         raise NonRecoverableError(
             'Failed to start container: {0}.'.format(str(e)))
 
-    ctx.logger.info('Container started: {}.'.format(response))
-
-    if params.get('processes_to_wait_for'):
-        utils.wait_for_processes(processes_to_wait_for, retry_interval,
-                                 client)
-
-    ctx.logger.info('Started container: {0}.'.format(
-        ctx.instance.runtime_properties['container_id']))
-
-    if utils.get_container_dictionary(client):
-        inspect_output = utils.inspect_container(client)
-        ctx.instance.runtime_properties['ports'] = \
-            inspect_output.get('Ports', None)
-        ctx.instance.runtime_properties['network_settings'] = \
-            inspect_output.get('NetworkSettings', None)
+    log.info('Container started.', container=container_id)
+
+    probes = [{'type': 'process', 'name': name}
+              for name in processes_to_wait_for or []]
+    probes.extend(readiness_probes or [])
+    if probes:
+        log.info('Waiting for readiness probes.',
+                 probes=[readiness.describe(probe) for probe in probes])
+        not_ready = readiness.run_probes(
+            client.uncached(), container_id, probes, readiness_timeout)
+        if not_ready:
+            raise RecoverableError(
+                'Waiting for readiness probes: {0}. Retrying...'.format(
+                    '; '.join(readiness.describe(p) for p in not_ready)),
+                retry_after=retry_interval)
+
+    inspect_output = utils.inspect_container(client)
+    utils.store_inspect(staging.runtime_properties(), ctx.node.properties,
+                        ctx.instance.id, inspect_output)
 
     top_info = utils.get_top_info(client)
 
-    ctx.logger.info('Container: {0} Forwarded ports: {1} Top: {2}.'.format(
-        ctx.instance.runtime_properties['container_id'],
-        inspect_output.get('Ports', None), top_info))
+    log.info('Container running.', container=container_id,
+             ports=staging.runtime_properties().get(utils.PORTS),
+             processes=len(top_info.splitlines()) - 1)
+    log.debug('Container processes.', container=container_id, top=top_info)
 
 
 @operation
-def stop(retry_interval, params, daemon_client=None, **_):
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+@docker_client.leased
+def stop(retry_interval, params, daemon_client=None, wait_timeout=30,
+         log_verbosity=oplog.INFO, **_):
     """ cloudify.docker.container type stop lifecycle operation.
         Stops a container. Similar to the docker stop command.
         Any properties and runtime_properties set in the create
@@ -142,19 +209,22 @@ def stop(retry_interval, params, daemon_client=None, **_):
     :param daemon_client: optional configuration for client creation
     :param timeout: Timeout in seconds to wait for the container to stop before
         sending a SIGKILL.
+    :param wait_timeout: The number of seconds to block waiting for the
+        container to exit before falling back to retrying the operation.
+    :param log_verbosity: debug, info, warning or error. see oplog.
     """
 
     daemon_client = daemon_client or {}
-    client = docker_client.get_client(daemon_client)
+    client = docker_client.get_operation_client(daemon_client)
 
-    container_id = ctx.instance.runtime_properties['container_id']
-    ctx.logger.info('Stopping container: {}'.format(container_id))
+    container_id = staging.runtime_properties()['container_id']
+    log = oplog.current()
+    log.info('Stopping container.', container=container_id)
 
-    container_id = ctx.instance.runtime_properties['container_id']
     arguments = {'container': container_id}
     arguments.update(params)
 
-    ctx.logger.info('Stop arguments: {0}'.format(arguments))
+    log.debug('Stop arguments.', arguments=arguments)
 
     try:
         client.stop(**arguments)
@@ -162,15 +232,28 @@ def stop(retry_interval, params, daemon_client=None, **_):
         raise NonRecoverableError(
             'Failed to start container: {0}.'.format(str(e)))
 
-    if 'Exited' not in utils.check_container_status(client):
-        raise RecoverableError('Container still running. Retyring.',
-                               retry_after=retry_interval)
+    exit_code = utils.wait_for_container_exit(client, wait_timeout)
+
+    if exit_code is None:
+        status = utils.check_container_status(client)
+        if status is None:
+            # removed while we waited, e.g. it was started with --rm
+            log.info('Container is gone.', container=container_id)
+            return
+        if 'Exited' not in status:
+            raise RecoverableError('Container still running. Retyring.',
+                                   retry_after=retry_interval)
 
-    ctx.logger.info('Stopped container: {}'.format(container_id))
+    log.info('Stopped container.', container=container_id)
 
 
 @operation
-def remove_container(params, daemon_client=None, **_):
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+@docker_client.leased
+def remove_container(params, daemon_client=None, log_verbosity=oplog.INFO,
+                     **_):
     """ cloudify.docker.container type delete lifecycle operation.
         Any properties and runtime_properties set in the create,
         start, and stop lifecycle operations also available in
@@ -181,18 +264,19 @@ def remove_container(params, daemon_client=None, **_):
     :param link: Remove the specified link and not the underlying container.
     :param force: force the removal of a running container (uses SIGKILL)
     :param daemon_client: optional configuration for client creation
+    :param log_verbosity: debug, info, warning or error. see oplog.
     """
     daemon_client = daemon_client or {}
-    client = docker_client.get_client(daemon_client)
+    client = docker_client.get_operation_client(daemon_client)
 
-    container_id = ctx.instance.runtime_properties['container_id']
-    ctx.logger.info('Removing container {}'.format(container_id))
+    container_id = staging.runtime_properties()['container_id']
+    log = oplog.current()
+    log.info('Removing container.', container=container_id)
 
-    container_id = ctx.instance.runtime_properties['container_id']
     arguments = {'container': container_id}
     arguments.update(params)
 
-    ctx.logger.info('Remove container arguments: {0}'.format(arguments))
+    log.debug('Remove container arguments.', arguments=arguments)
 
     try:
         client.remove_container(**arguments)
@@ -200,77 +284,336 @@ def remove_container(params, daemon_client=None, **_):
         raise NonRecoverableError(
             'Failed to start container: {0}.'.format(str(e)))
 
-    del(ctx.instance.runtime_properties['container_id'])
+    del(staging.runtime_properties()['container_id'])
+
+    log.info('Removed container.', container=container_id)
+
+
+@operation
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+def stream_logs(daemon_client=None, output=None, stdout=True, stderr=True,
+                max_lines=10000, max_line_length=16384, timeout=300,
+                log_verbosity=oplog.INFO, **_):
+    """ docker.logs interface operation.
+        Fetches the lines the container logged since the last fetch,
+        demultiplexed into stdout and stderr and with their timestamps,
+        and appends them to a file or logs them. The timestamp of the
+        last line is kept in the logs_cursor runtime property, also when
+        the fetch fails part way, so no line is written twice.
+
+    :param daemon_client: optional configuration for client creation
+    :param output: A file on the agent host to append the lines to.
+        The lines are logged if not set.
+    :param stdout: Whether to fetch the lines written to stdout.
+    :param stderr: Whether to fetch the lines written to stderr.
+    :param max_lines: The most lines to fetch at once, the next fetch
+        continues from there.
+    :param max_line_length: Longer lines are truncated.
+    :param timeout: The number of seconds the fetch may take.
+    :param log_verbosity: debug, info, warning or error. see oplog.
+    """
+
+    container_id = staging.runtime_properties()['container_id']
+    cursor = staging.runtime_properties().get(LOGS_CURSOR)
+    log = oplog.current()
+
+    if output:
+        sink = container_logs.FileSink(output)
+    else:
+        sink = container_logs.LoggerSink(ctx.logger, container_id)
+    streamer = container_logs.LogStreamer(
+        sink, cursor, max_lines=max_lines, max_line_length=max_line_length)
+    log.debug('Stream logs arguments.', container=container_id,
+              cursor=cursor, output=output)
+
+    engine = docker_engine.EngineClient(daemon_client)
+    call = engine.logs(container_id, streamer.on_data, since=streamer.since,
+                       stdout=stdout, stderr=stderr, timeout=timeout)
+    try:
+        engine.run_one(call)
+        streamer.close()
+    except docker_engine.EngineError as e:
+        # the lines written so far stay written
+        if streamer.cursor is not None:
+            ctx.instance.runtime_properties[LOGS_CURSOR] = streamer.cursor
+        raise NonRecoverableError(
+            'Failed to stream container logs: {0}.'.format(str(e)))
+    finally:
+        sink.close()
+
+    staging.runtime_properties()[LOGS_CURSOR] = streamer.cursor
+    log.info('Streamed container logs.', container=container_id,
+             lines=streamer.lines, skipped=streamer.skipped,
+             truncated=streamer.truncated, bytes=streamer.bytes,
+             cursor=streamer.cursor)
+
+
+@operation
+@oplog.logged
+@instrumentation.instrumented
+@staging.staged
+@docker_client.leased
+def prefetch_image(daemon_client=None, pull_progress_interval=10,
+                   registries=None, image_lock_timeout=None,
+                   log_verbosity=oplog.INFO, **_):
+    """ docker.images prefetch operation, the prefetch_images workflow
+        runs it for one instance per image and host. Pulls the node's
+        image on the agent host, so create_container finds it present.
+        Images that are imported, built or never pulled are skipped.
+
+    :param daemon_client: optional configuration for client creation
+    :param pull_progress_interval: The minimum number of seconds between
+        image pull progress log messages.
+    :param registries: Mirrors of the default registry to pull the image
+        from, see registries.Config.
+    :param image_lock_timeout: The number of seconds to wait for another
+        operation that transfers the same image, see locks.
+    :param log_verbosity: debug, info, warning or error. see oplog.
+    """
+
+    image = utils.pulled_image(ctx.node.properties.get('image'))
+    if image is None:
+        oplog.current().info('The image is not pulled, nothing to '
+                             'prefetch.')
+        return
 
-    ctx.logger.info('Removed container {}'.format(container_id))
+    client = docker_client.get_operation_client(daemon_client or {})
+    arguments = {'repository': image[0], 'tag': image[1]}
+    reference = '{0}:{1}'.format(*image)
+    with locks.image_lock(client, reference, image_lock_timeout) as lock:
+        _reuse_image(lock, reference) or \
+            _record_image(lock, pull(client, arguments,
+                                     pull_progress_interval, registries))
 
 
-def get_image(client):
+def get_image(client, progress_interval=10, registries=None,
+              lock_timeout=None):
     """ Depending on what you specify in the blueprint, this determines
         whether to use pull or import_image.
         If src is specified, import_image will import and image from
         a tar file.
+        If build is specified, build_image builds the directory it names,
+        unless the same build context was built on the daemon before.
         If not then the the plugin will try to pull the image from Docker
         hub.
+        The pull_policy key decides whether an image that is already
+        present, e.g. because the prefetch_images workflow pulled it,
+        is used: always pulls, imports or builds every time,
+        if_not_present only when the image is missing and never fails
+        when the image is missing. see utils.get_pull_policy for the
+        default.
+        Operations that need the same image on the same daemon at the
+        same time wait for the first one and reuse its image.
 
     :param client: The Docker client.
     :param ctx: The Cloudify Context.
+    :param progress_interval: The minimum number of seconds between
+        pull progress log messages.
+    :param registries: Mirrors of the default registry to pull from.
+    :param lock_timeout: The number of seconds to wait for an operation
+        that transfers the same image, see locks.
     :return: Returns the image_id to the create_container method.
     """
 
     arguments = dict()
-
-    if ctx.node.properties['image'].get('src', None) is None and \
-            ctx.node.properties['image'].get('repository') is None:
-        raise NonRecoverableError('You must provide a src or repository '
-                                  'or both the image dictionary. Exiting.')
-    else:
-        arguments['repository'] = \
-            ctx.node.properties['image'].get('repository', ctx.instance.id)
-        arguments['tag'] = ctx.node.properties['image'].get('tag', 'latest')
-
-    if ctx.node.properties['image'].get('src', None) is not None:
-        ctx.logger.info('src provided, importing image. If repository '
-                        'name was specified, that will be the image name, '
-                        'otherwise, the image name will be the instance id.')
-        arguments['src'] = ctx.node.properties['image']['src']
-        return import_image(client, arguments)
+    image = ctx.node.properties['image']
+
+    if image.get('src', None) is None and \
+            image.get('build', None) is None and \
+            image.get('repository') is None:
+        raise NonRecoverableError('You must provide a src, build or '
+                                  'repository in the image dictionary. '
+                                  'Exiting.')
     else:
-        return pull(client, arguments)
+        arguments['repository'] = image.get('repository', ctx.instance.id)
+        arguments['tag'] = image.get('tag') or 'latest'
+
+    pull_policy = utils.get_pull_policy(image)
+    reference = '{0}:{1}'.format(arguments['repository'], arguments['tag'])
+
+    if pull_policy != utils.ALWAYS:
+        image_id = utils.find_image_id(
+            arguments['tag'], arguments['repository'], client)
+        if image_id is not None:
+            oplog.current().info('Image is already present.',
+                                 image=reference, image_id=image_id)
+            staging.runtime_properties()['image_id'] = image_id
+            return image_id
+        if pull_policy == utils.NEVER:
+            raise NonRecoverableError(
+                'Image {0} is not present and pull_policy is {1}.'.format(
+                    reference, utils.NEVER))
+
+    # with pull_policy always the build cache knows whether the image is
+    # up to date, the tag does not
+    if image.get('build', None) is not None:
+        arguments['path'] = image['build']
+        arguments['dockerfile'] = image.get('dockerfile')
+        arguments['params'] = image.get('build_params') or {}
+        with locks.image_lock(
+                client, '{0}|{1}'.format(arguments['path'], reference),
+                lock_timeout) as lock:
+            return _reuse_image(lock, reference) or \
+                _record_image(lock, build_image(client, arguments))
+
+    if image.get('src', None) is not None:
+        oplog.current().info('src provided, importing image.',
+                             image=reference)
+        arguments['src'] = image['src']
+        with locks.image_lock(
+                client, '{0}|{1}'.format(arguments['src'], reference),
+                lock_timeout) as lock:
+            return _reuse_image(lock, reference) or \
+                _record_image(lock, import_image(client, arguments))
+
+    with locks.image_lock(client, reference, lock_timeout) as lock:
+        return _reuse_image(lock, reference) or \
+            _record_image(lock, pull(client, arguments, progress_interval,
+                                     registries))
+
+
+def _reuse_image(lock, reference):
+    image_id = lock.result()
+    if image_id is not None:
+        oplog.current().info('Reusing image transferred by another '
+                             'operation.', image=reference,
+                             image_id=image_id)
+        staging.runtime_properties()['image_id'] = image_id
+    return image_id
+
+
+def _record_image(lock, image_id):
+    lock.record(image_id)
+    return image_id
 
 
-def pull(client, arguments):
+def pull(client, arguments, progress_interval=10, registries=None):
     """ cloudify.docker.Image type create lifecycle operation.
         Identical to the docker pull command.
 
     :node_property params: (Optional) Use any other parameter allowed
         by the docker API to Docker PY.
     :param daemon_client: optional configuration for client creation
+    :param progress_interval: The minimum number of seconds between
+        pull progress log messages.
+    :param registries: Mirrors of the default registry to pull from,
+        fastest first, see registries.Config.
     """
 
     arguments.update({'stream': True})
-    ctx.logger.info('Pull arguments: {0}'.format(arguments))
+    log = oplog.current()
+    log.debug('Pull arguments.', arguments=arguments)
+
+    repository = arguments.get('repository')
+    try:
+        config = registry_mirrors.Config(registries)
+    except ValueError as e:
+        raise NonRecoverableError(str(e))
+
+    progress = None
+    mirrored = config.applies(repository)
+    if mirrored:
+        progress = _pull_from_mirrors(client, arguments, progress_interval,
+                                      config)
+    if progress is None:
+        # the mirrors only replace the default registry
+        if mirrored and not config.fallback:
+            raise NonRecoverableError(
+                'Unabled to pull image: {0}. Error: no mirror has it and '
+                'fallback is disabled.'.format(arguments))
+        try:
+            progress = _pull(client, arguments, progress_interval)
+        except (APIError, streams.StreamError, ValueError) as e:
+            raise NonRecoverableError(
+                'Unabled to pull image: {0}. Error: {1}.'
+                .format(arguments, str(e)))
+
+    staging.runtime_properties()['pull_bytes'] = progress.total_bytes
+    staging.runtime_properties()['pull_duration'] = progress.duration
+
+    utils.invalidate_image_index(client, repository)
+    image_id = utils.get_image_id(arguments.get('tag'), repository, client)
+
+    staging.runtime_properties()['image_id'] = image_id
+    log.info('Pulled image.', image_id=image_id)
+    return image_id
+
+
+def _pull(client, arguments, progress_interval):
+    progress = streams.PullProgress(
+        oplog.current(),
+        '{0}:{1}'.format(arguments.get('repository'), arguments.get('tag')),
+        progress_interval)
+    for message in streams.decode_json_stream(client.pull(**arguments)):
+        progress.update(message)
+    progress.finish()
+    return progress
+
+
+def _pull_from_mirrors(client, arguments, progress_interval, config):
+    """ Pulls from the mirrors, fastest first, and tags the image with
+        its name on the default registry. Returns the PullProgress, or
+        None when no mirror had the image.
+    """
+
+    log = oplog.current()
+    ranking = registry_mirrors.Ranking()
+    for mirror in ranking.rank(config):
+        mirror_arguments = dict(
+            arguments, repository=mirror.repository(arguments['repository']))
+        try:
+            progress = _pull(client, mirror_arguments, progress_interval)
+            client.tag('{0}:{1}'.format(mirror_arguments['repository'],
+                                        arguments['tag']),
+                       arguments['repository'], tag=arguments['tag'],
+                       force=True)
+        except (APIError, streams.StreamError, ValueError) as e:
+            ranking.record_failure(mirror)
+            log.warning('Pull from mirror failed.', mirror=mirror.host,
+                        error=str(e))
+            continue
+        ranking.record_pull(mirror, progress.total_bytes, progress.duration)
+        staging.runtime_properties()['pull_mirror'] = mirror.host
+        log.info('Pulled from mirror.', mirror=mirror.host)
+        return progress
+    return None
+
+
+def build_image(client, arguments):
+    """ Builds an image from a local directory, identical to the docker
+        build command.
+
+    :node_property build: Path of a local directory with a Dockerfile.
+        It is sent without the files its .dockerignore excludes and not
+        built again if the daemon already has an image built from the
+        same context, see builds.
+    :node_property dockerfile: (Optional) The name of the Dockerfile.
+    :node_property build_params: (Optional) Use any other parameter
+        allowed by the docker API to Docker PY's build, except those in
+        builds.RESERVED_PARAMS. Unlike Docker PY, pull defaults to false.
+    """
 
-    image_id = None
+    log = oplog.current()
+    log.debug('Build image arguments.', arguments=arguments)
 
     try:
-        for stream in client.pull(**arguments):
-            stream_dict = json.loads(stream)
-            if 'id' in stream_dict:
-                image_id = stream_dict.get('id')
-            if 'Complete' in stream_dict.get('status', ''):
-                ctx.logger.info('docker_plugin.tasks.pull: {0}.'.format(
-                    stream_dict))
-    except APIError as e:
+        image_id = builds.build_image(
+            client, arguments['path'], arguments['repository'],
+            arguments['tag'], log, dockerfile=arguments.get('dockerfile'),
+            params=arguments.get('params'))
+    except (APIError, streams.StreamError, ValueError, IOError,
+            OSError) as e:
         raise NonRecoverableError(
-            'Unabled to pull image: {0}. Error: {1}.'
-            .format(arguments, str(e)))
+            'Failed to build image: {0}.'.format(str(e)))
 
-    image_id = utils.get_image_id(
-        arguments.get('tag'), arguments.get('repository'), client)
-
-    ctx.instance.runtime_properties['image_id'] = image_id
-    ctx.logger.info('Pulled image, image_id: {0}'.format(image_id))
+    if image_id is None:
+        raise NonRecoverableError(
+            'Failed to build image: the build output has no image id.')
+    utils.invalidate_image_index(client, arguments.get('repository'))
+    staging.runtime_properties()['image_id'] = image_id
+    log.info('Built image.', image_id=image_id)
     return image_id
 
 
@@ -279,26 +622,35 @@ def import_image(client, arguments):
         Derives some definition from parent type cloudify.docker.Image.
         Identical to the docker import command.
 
-    :node_property src: Path to tarfile or URL.
+    :node_property src: Path to tarfile or URL. Local tarfiles are
+        streamed and not imported again if the daemon already has an
+        image imported from the same content, see imports.
     :node_property params: (Optional) Use any other parameter allowed
         by the docker API to Docker PY.
     :param daemon_client: optional configuration for client creation
     """
 
-    ctx.logger.info('Import image arguments {}'.format(arguments))
+    log = oplog.current()
+    log.debug('Import image arguments.', arguments=arguments)
 
     try:
-        output = client.import_image(**arguments)
-    except APIError as e:
+        if os.path.isfile(arguments['src']):
+            image_id = imports.import_tarball(
+                client, arguments['src'], arguments.get('repository'),
+                arguments.get('tag'), log)
+        else:
+            output = client.import_image(**arguments)
+            log.debug('Import image output.', output=output)
+            image_id = None
+    except (APIError, requests.RequestException, streams.StreamError) as e:
         raise NonRecoverableError(
-            'Failed to start container: {0}.'.format(str(e)))
-
-    ctx.logger.info('output: {}'.format(output))
-    image_id = json.loads(output).get('status')
+            'Failed to import image: {0}.'.format(str(e)))
 
-    image_id = utils.get_image_id(
-        arguments.get('tag'), arguments.get('repository'), client)
+    utils.invalidate_image_index(client, arguments.get('repository'))
+    if image_id is None:
+        image_id = utils.get_image_id(
+            arguments.get('tag'), arguments.get('repository'), client)
 
-    ctx.instance.runtime_properties['image_id'] = image_id
-    ctx.logger.info('Imported image, image_id {0}'.format(image_id))
+    staging.runtime_properties()['image_id'] = image_id
+    log.info('Imported image.', image_id=image_id)
     return image_id
@@ -0,0 +1,217 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Micro benchmarks of the plugin operations against a StubDaemon.
+
+Each iteration runs the lifecycle of one container instance, create,
+start, stop and remove, under a MockCloudifyContext, plus get_image_id
+and get_container_dictionary lookups, and measures every step, the
+requests it sends to the daemon and the response bytes it receives.
+The daemon can be filled with unrelated containers and images and delay
+every response, so steps whose cost grows with the size of the daemon
+stand out.
+
+    python -m docker_plugin.tests.benchmark --containers 1000 \\
+        --images 200 --latency 0.002 --iterations 50
+"""
+
+# Built-in Imports
+import argparse
+import collections
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import time
+
+# Cloudify Imports
+import docker_plugin
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import docker_client
+from docker_plugin import tasks
+from docker_plugin import utils
+from docker_plugin.tests.stub_daemon import StubDaemon
+
+IMAGE = 'benchmark'
+STEPS = ('create_container', 'start', 'get_container_dictionary',
+         'get_image_id', 'stop', 'remove_container')
+
+# Loaded by every worker before it runs an operation of the plugin.
+PRELOADED = ('cloudify.decorators', 'cloudify.manager', 'docker.client')
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of values.
+    """
+
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class Step(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.requests = collections.Counter()
+        self.bytes = 0
+
+    @property
+    def requests_per_call(self):
+        return float(sum(self.requests.values())) / len(self.durations)
+
+    @property
+    def bytes_per_call(self):
+        return float(self.bytes) / len(self.durations)
+
+    def summary(self):
+        return {
+            'iterations': len(self.durations),
+            'p50': percentile(self.durations, 50),
+            'p90': percentile(self.durations, 90),
+            'p99': percentile(self.durations, 99),
+            'max': max(self.durations),
+            'requests_per_call': self.requests_per_call,
+            'requests': dict(self.requests),
+            'bytes_per_call': self.bytes_per_call,
+        }
+
+
+def _steps(daemon_client):
+    def client():
+        return docker_client.get_operation_client(daemon_client)
+
+    return [
+        ('create_container', lambda ctx: tasks.create_container(
+            {}, daemon_client=daemon_client, ctx=ctx)),
+        ('start', lambda ctx: tasks.start(
+            {}, [], 1, daemon_client=daemon_client, ctx=ctx)),
+        ('get_container_dictionary',
+         lambda ctx: utils.get_container_dictionary(client())),
+        ('get_image_id',
+         lambda ctx: utils.get_image_id('latest', IMAGE, client())),
+        ('stop', lambda ctx: tasks.stop(
+            1, {}, daemon_client=daemon_client, ctx=ctx)),
+        ('remove_container', lambda ctx: tasks.remove_container(
+            {}, daemon_client=daemon_client, ctx=ctx)),
+    ]
+
+
+def run(containers=0, images=0, latency=0, iterations=20):
+    """ Runs the benchmark against a new StubDaemon.
+
+    :param containers: unrelated containers on the daemon.
+    :param images: unrelated images on the daemon.
+    :param latency: seconds the daemon waits before each response.
+    :return: a dict of step name to its summary.
+    """
+
+    daemon = StubDaemon(containers=containers, images=images,
+                        latency=latency).start()
+    daemon.add_image('{0}:latest'.format(IMAGE))
+    logging.disable(logging.INFO)
+    steps = collections.OrderedDict((name, Step(name)) for name in STEPS)
+    try:
+        for i in range(iterations):
+            ctx = MockCloudifyContext(
+                node_id='benchmark_{0}'.format(i),
+                properties={'name': 'benchmark_{0}'.format(i),
+                            'image': {'repository': IMAGE,
+                                      'pull_policy': 'if_not_present'},
+                            'use_external_resource': False})
+            for name, function in _steps(daemon.daemon_client):
+                # operations clear the current context when they return
+                current_ctx.set(ctx=ctx)
+                before = daemon.requests.copy()
+                bytes_before = daemon.bytes_sent
+                started = time.time()
+                function(ctx)
+                steps[name].durations.append(time.time() - started)
+                steps[name].requests.update(daemon.requests - before)
+                steps[name].bytes += daemon.bytes_sent - bytes_before
+    finally:
+        current_ctx.clear()
+        logging.disable(logging.NOTSET)
+        docker_client.close_clients()
+        daemon.stop()
+    return collections.OrderedDict(
+        (name, step.summary()) for name, step in steps.items())
+
+
+def import_time(module, preload=PRELOADED):
+    """ Imports module in a fresh interpreter that already imported
+        preload.
+
+    :return: the seconds the import took and the modules it loaded.
+    """
+
+    code = '\n'.join([
+        'import json, sys, time',
+        'for name in {0!r}: __import__(name)'.format(tuple(preload)),
+        'before = set(k for k in sys.modules if sys.modules[k])',
+        'started = time.time()',
+        '__import__({0!r})'.format(module),
+        'print(json.dumps([time.time() - started, sorted(',
+        '    set(k for k in sys.modules if sys.modules[k]) - before)]))',
+    ])
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(docker_plugin.__file__))))
+    seconds, modules = json.loads(subprocess.check_output(
+        [sys.executable, '-c', code], env=env).splitlines()[-1])
+    return seconds, modules
+
+
+def report(results):
+    lines = ['{0:<26}{1:>9}{2:>9}{3:>9}{4:>9}{5:>10}{6:>10}'.format(
+        'step', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'requests',
+        'bytes')]
+    for name, summary in results.items():
+        lines.append(
+            '{0:<26}{1:>9.2f}{2:>9.2f}{3:>9.2f}{4:>9.2f}{5:>10.1f}{6:>10.0f}'
+            .format(name, summary['p50'] * 1000, summary['p90'] * 1000,
+                    summary['p99'] * 1000, summary['max'] * 1000,
+                    summary['requests_per_call'],
+                    summary['bytes_per_call']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--containers', type=int, default=0,
+                        help='unrelated containers on the daemon')
+    parser.add_argument('--images', type=int, default=0,
+                        help='unrelated images on the daemon')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the daemon waits before responding')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--import-time', action='store_true',
+                        help='measure the import of the operation modules')
+    args = parser.parse_args()
+    if args.import_time:
+        for module in ('docker_plugin.tasks', 'docker_plugin.workflows'):
+            seconds, modules = import_time(module)
+            print('{0:<26}{1:>9.2f} ms{2:>5} modules'.format(
+                module, seconds * 1000, len(modules)))
+        return
+    print(report(run(args.containers, args.images, args.latency,
+                     args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
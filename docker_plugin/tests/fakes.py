@@ -0,0 +1,348 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""In memory stand-in for docker.Client used by tests that must not
+depend on a running Docker daemon, and a TestCase running operations
+against it."""
+
+# Built-in Imports
+import collections
+import gzip
+import io
+import itertools
+import json
+import tarfile
+
+# Third Party Imports
+import docker.errors
+import requests
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import docker_client
+
+
+def not_found():
+    response = requests.Response()
+    response.status_code = 404
+    response._content = 'Not Found'
+    return docker.errors.APIError('404 Client Error: Not Found', response)
+
+
+def server_error(message):
+    response = requests.Response()
+    response.status_code = 500
+    response._content = message
+    return docker.errors.APIError('500 Server Error', response)
+
+
+class FakeDockerClient(object):
+
+    # the size of the layer in the archives get_image returns
+    layer_size = 1024
+
+    def __init__(self):
+        self.containers_by_id = collections.OrderedDict()
+        self.images_by_id = collections.OrderedDict()
+        self.calls = collections.Counter()
+        self.payload_bytes = 0
+        self.uploaded_chunks = []
+        self.post_timeouts = []
+        # the archives get_image returned
+        self.saved = []
+        self.build_contexts = []
+        self.pulled = []
+        self.loaded_bytes = 0
+        # load_image fails after reading this many chunks
+        self.load_fails_after = None
+        # pulls of repositories starting with one of these fail
+        self.unavailable = set()
+        self.container_ids = itertools.count(1)
+
+    def _record(self, name, result):
+        self.calls[name] += 1
+        self.payload_bytes += len(json.dumps(result))
+        return result
+
+    def add_container(self, container_id, name, status='Exited (0)',
+                      labels=None, image=None):
+        self.containers_by_id[container_id] = {
+            'Id': container_id,
+            'Names': ['/{0}'.format(name)],
+            'Image': image,
+            'Status': status,
+            'Labels': labels or {},
+            'StopHangs': False,
+            'Processes': [],
+            'NetworkSettings': {'IPAddress': '127.0.0.1'},
+            'ExitCodes': {},
+        }
+
+    def add_image(self, image_id, repo_tags=None, repo_digests=None):
+        self.images_by_id[image_id] = {
+            'Id': image_id,
+            'RepoTags': repo_tags,
+            'RepoDigests': repo_digests,
+        }
+
+    def images(self, name=None, **_):
+        result = []
+        for image in self.images_by_id.values():
+            references = (image['RepoTags'] or []) + \
+                (image['RepoDigests'] or [])
+            if name and not any(r.split('@')[0].rsplit(':', 1)[0] == name
+                                for r in references):
+                continue
+            result.append(image)
+        return self._record('images', result)
+
+    def containers(self, all=False, filters=None, **_):
+        filters = filters or {}
+        result = []
+        for container in self.containers_by_id.values():
+            if 'id' in filters and \
+                    not container['Id'].startswith(filters['id']):
+                continue
+            if 'name' in filters and \
+                    not any(filters['name'] in n for n in container['Names']):
+                continue
+            if 'label' in filters:
+                key, _, value = filters['label'].partition('=')
+                if container['Labels'].get(key, None) is None or \
+                        (value and container['Labels'][key] != value):
+                    continue
+            result.append(container)
+        return self._record('containers', result)
+
+    def _container(self, container_id):
+        if container_id not in self.containers_by_id:
+            raise not_found()
+        return self.containers_by_id[container_id]
+
+    def start(self, container, **_):
+        self.calls['start'] += 1
+        self.containers_by_id[container]['Status'] = 'Up 1 second'
+
+    def stop(self, container, **_):
+        self.calls['stop'] += 1
+        if not self.containers_by_id[container]['StopHangs']:
+            self.containers_by_id[container]['Status'] = 'Exited (0)'
+
+    def wait(self, container, timeout=None):
+        self.calls['wait'] += 1
+        if not self.containers_by_id[container]['Status'].startswith(
+                'Exited'):
+            raise requests.exceptions.ReadTimeout('Read timed out.')
+        return 0
+
+    def top(self, container):
+        return self._record('top', {
+            'Titles': ['PID', 'COMMAND'],
+            'Processes': self.containers_by_id[container]['Processes'],
+        })
+
+    def inspect_container(self, container):
+        container = self._container(container)
+        return self._record('inspect_container', {
+            'Id': container['Id'],
+            'Image': container['Image'],
+            'State': {'Running': container['Status'].startswith('Up')},
+            'NetworkSettings': container['NetworkSettings'],
+        })
+
+    def exec_create(self, container, cmd, **_):
+        self.calls['exec_create'] += 1
+        return {'Id': '{0}/{1}'.format(container, cmd)}
+
+    def exec_start(self, exec_id, **_):
+        self.calls['exec_start'] += 1
+        return ''
+
+    def exec_inspect(self, exec_id):
+        container, _, cmd = exec_id['Id'].partition('/')
+        return self._record('exec_inspect', {
+            'ExitCode':
+                self.containers_by_id[container]['ExitCodes'].get(cmd, 1),
+        })
+
+    def create_container(self, name=None, image=None, **_):
+        self.calls['create_container'] += 1
+        container_id = '{0:064x}'.format(next(self.container_ids))
+        self.add_container(container_id, name, image=image)
+        return {'Id': container_id, 'Warnings': None}
+
+    def remove_container(self, container, **_):
+        self.calls['remove_container'] += 1
+        del self.containers_by_id[self._container(container)['Id']]
+
+    def pull(self, repository, tag=None, stream=False, **_):
+        self.calls['pull'] += 1
+        self.pulled.append('{0}:{1}'.format(repository, tag))
+        if any(repository.startswith(u) for u in self.unavailable):
+            return iter([json.dumps({
+                'errorDetail': {'message': 'connection refused'},
+                'error': 'connection refused'})])
+        image_id = '{0}_{1}_id'.format(repository, tag)
+        self.add_image(image_id, repo_tags=['{0}:{1}'.format(repository, tag)])
+        return iter([
+            json.dumps({'status': 'Pulling from {0}'.format(repository),
+                        'id': tag}),
+            json.dumps({'status': 'Download complete', 'id': 'layer'}),
+            json.dumps({'status': 'Status: Downloaded newer image'}),
+        ])
+
+    def _url(self, path):
+        return path
+
+    def _result(self, response):
+        return response
+
+    def _raise_for_status(self, response):
+        pass
+
+    def _post(self, url, data=None, params=None, headers=None, timeout=60):
+        self.post_timeouts.append(timeout)
+        if url == '/images/create' and params.get('fromSrc') == '-':
+            return self.import_image_from_stream(
+                data, repository=params.get('repo'), tag=params.get('tag'))
+        if url == '/images/load':
+            return self.load_image(data)
+        raise NotImplementedError(url)
+
+    def import_image_from_stream(self, stream, repository=None, tag=None):
+        self.calls['import_image_from_stream'] += 1
+        size = 0
+        for chunk in stream:
+            self.uploaded_chunks.append(len(chunk))
+            size += len(chunk)
+        image_id = 'imported_{0}'.format(
+            self.calls['import_image_from_stream'])
+        self.add_image(image_id, repo_tags=['{0}:{1}'.format(repository, tag)])
+        return json.dumps({'status': image_id}) + '\r\n'
+
+    def build(self, fileobj=None, tag=None, custom_context=False,
+              stream=False, dockerfile=None, **_):
+        self.calls['build'] += 1
+        data = b''
+        for chunk in fileobj:
+            self.uploaded_chunks.append(len(chunk))
+            data += chunk
+        with tarfile.open(fileobj=io.BytesIO(data)) as context:
+            files = dict(
+                (info.name, context.extractfile(info).read()
+                 if info.isreg() else None)
+                for info in context.getmembers())
+        self.build_contexts.append(files)
+        if 'FAIL' in files[dockerfile or 'Dockerfile']:
+            return iter([json.dumps({'stream': 'Step 0 : FROM stub\n'}),
+                         json.dumps({'errorDetail': {'message': 'failed'},
+                                     'error': 'failed'})])
+        image_id = 'b1d{0:09x}'.format(self.calls['build'])
+        self.add_image(image_id, repo_tags=[tag])
+        return iter([
+            json.dumps({'stream': 'Step 0 : FROM stub\n'}),
+            json.dumps({'stream': ' ---> 0123456789ab\n'}),
+            json.dumps({'stream': 'Successfully built {0}\n'.format(
+                image_id)}),
+        ])
+
+    def get_image(self, image):
+        """ Returns a docker save archive of image.
+        """
+
+        self.calls['get_image'] += 1
+        image_id = self._image_id(image)
+        if image_id is None:
+            raise not_found()
+        repository, tag = image.rsplit(':', 1)
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as archive:
+            files = [
+                ('repositories', json.dumps({repository: {tag: image_id}})),
+                ('{0}/layer.tar'.format(image_id),
+                 (image_id * self.layer_size)[:self.layer_size]),
+            ]
+            for name, content in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        data.seek(0)
+        self.saved.append(data)
+        return data
+
+    def load_image(self, data):
+        self.calls['load_image'] += 1
+        archive = b''
+        for i, chunk in enumerate(data):
+            if self.load_fails_after == i:
+                raise server_error('load failed')
+            archive += chunk
+        self.loaded_bytes += len(archive)
+        if archive[:2] == b'\x1f\x8b':
+            archive = gzip.GzipFile(fileobj=io.BytesIO(archive)).read()
+        with tarfile.open(fileobj=io.BytesIO(archive)) as loaded:
+            repositories = json.loads(
+                loaded.extractfile('repositories').read())
+        for repository, tags in repositories.items():
+            for tag, image_id in tags.items():
+                self.add_image(image_id, repo_tags=['{0}:{1}'.format(
+                    repository, tag)])
+
+    def _image_id(self, image):
+        for image_id, other in self.images_by_id.items():
+            if image == image_id or image in (other['RepoTags'] or []):
+                return image_id
+        return None
+
+    def inspect_image(self, image):
+        image_id = self._image_id(image)
+        if image_id is None:
+            raise not_found()
+        return self._record('inspect_image', self.images_by_id[image_id])
+
+    def tag(self, image, repository, tag=None, force=False):
+        self.calls['tag'] += 1
+        image = self._image_id(image)
+        reference = '{0}:{1}'.format(repository, tag)
+        for other in self.images_by_id.values():
+            if other['RepoTags'] and reference in other['RepoTags']:
+                other['RepoTags'].remove(reference)
+        self.images_by_id[image]['RepoTags'] = \
+            (self.images_by_id[image]['RepoTags'] or []) + [reference]
+        return True
+
+
+class FakeDaemonTestCase(testtools.TestCase):
+    """ Operations get self.client, a FakeDockerClient, whatever their
+        daemon_client.
+    """
+
+    def setUp(self):
+        super(FakeDaemonTestCase, self).setUp()
+        self.client = FakeDockerClient()
+        self.patch(docker_client, 'get_client',
+                   lambda daemon_client: self.client)
+
+    def set_context(self, node_id, properties=None, runtime_properties=None):
+        """ Makes a MockCloudifyContext the current context and self.ctx.
+        """
+
+        self.ctx = MockCloudifyContext(
+            node_id=node_id, properties=properties,
+            runtime_properties=runtime_properties)
+        current_ctx.set(ctx=self.ctx)
+        return self.ctx
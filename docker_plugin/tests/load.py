@@ -0,0 +1,258 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""End to end install/uninstall load harness on local workflows.
+
+Generates a blueprint with N cloudify.docker.Container instances whose
+operations talk to a StubDaemon, runs install and uninstall with
+cloudify.workflows.local and reports the wall time of each, the task
+retries and failed task attempts, and the daemon requests per instance.
+Nothing but the stub daemon is needed, the blueprint defines the few
+base types it uses instead of importing them from the network.
+
+    python -m docker_plugin.tests.load --instances 10 100 1000 \\
+        --threads 8 --latency 0.002
+"""
+
+# Built-in Imports
+import argparse
+import collections
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+# Third Party Imports
+import yaml
+
+# Cloudify Imports
+from cloudify import logs
+from cloudify.workflows import local
+from docker_plugin import docker_client
+from docker_plugin.tests.stub_daemon import StubDaemon
+
+IMAGE = 'load'
+PLUGIN_YAML = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, 'plugin.yaml')
+
+IGNORED_LOCAL_WORKFLOW_MODULES = (
+    'worker_installer.tasks',
+    'plugin_installer.tasks',
+    'cloudify_agent.operations',
+    'cloudify_agent.installer.operations',
+)
+
+RELATIONSHIP_INTERFACES = {
+    'cloudify.interfaces.relationship_lifecycle': dict(
+        (name, {}) for name in
+        ('preconfigure', 'postconfigure', 'establish', 'unlink')),
+}
+
+# The parts of cloudify's types.yaml the generated blueprint needs. The
+# docker plugin runs on a host agent, so containers are contained in a
+# host, which does not install an agent.
+BASE_TYPES = {
+    'plugins': {
+        'default_workflows': {
+            'executor': 'central_deployment_agent',
+            'install': False,
+        },
+    },
+    'workflows': {
+        'install': 'default_workflows.cloudify.plugins.workflows.install',
+        'uninstall':
+            'default_workflows.cloudify.plugins.workflows.uninstall',
+    },
+    'node_types': {
+        'cloudify.nodes.Root': {
+            'interfaces': {
+                'cloudify.interfaces.lifecycle': dict(
+                    (name, {}) for name in
+                    ('create', 'configure', 'start', 'stop', 'delete')),
+                'cloudify.interfaces.validation': {
+                    'creation': {}, 'deletion': {}},
+                'cloudify.interfaces.monitoring': {'start': {}, 'stop': {}},
+            },
+        },
+        'cloudify.nodes.Compute': {
+            'derived_from': 'cloudify.nodes.Root',
+            'properties': {
+                'ip': {'default': ''},
+                'install_agent': {'default': False},
+            },
+            'interfaces': {
+                'cloudify.interfaces.host': {'get_state': {}},
+                'cloudify.interfaces.monitoring_agent': dict(
+                    (name, {}) for name in
+                    ('install', 'start', 'stop', 'uninstall')),
+                'cloudify.interfaces.cloudify_agent': dict(
+                    (name, {}) for name in
+                    ('create', 'configure', 'start', 'stop', 'delete',
+                     'restart', 'install_plugins')),
+            },
+        },
+    },
+    'relationships': {
+        'cloudify.relationships.depends_on': {
+            'properties': {'connection_type': {'default': 'all_to_all'}},
+            'source_interfaces': RELATIONSHIP_INTERFACES,
+            'target_interfaces': RELATIONSHIP_INTERFACES,
+        },
+        'cloudify.relationships.contained_in': {
+            'derived_from': 'cloudify.relationships.depends_on',
+        },
+    },
+}
+
+
+def blueprint(instances, daemon_client):
+    """ Returns a blueprint with instances containers on daemon_client.
+    """
+
+    operations = dict(
+        (name, {'implementation': 'docker.docker_plugin.tasks.' + task,
+                'inputs': {'daemon_client': daemon_client}})
+        for name, task in [('create', 'create_container'),
+                           ('start', 'start'), ('stop', 'stop'),
+                           ('delete', 'remove_container')])
+    return dict(BASE_TYPES, **{
+        'tosca_definitions_version': 'cloudify_dsl_1_0',
+        'imports': [os.path.abspath(PLUGIN_YAML)],
+        'node_templates': {
+            'host': {
+                'type': 'cloudify.nodes.Compute',
+                'properties': {'ip': 'localhost'},
+            },
+            'container': {
+                'type': 'cloudify.docker.Container',
+                'instances': {'deploy': instances},
+                'properties': {'image': {'repository': IMAGE,
+                                         'pull_policy': 'if_not_present'}},
+                'interfaces': {'cloudify.interfaces.lifecycle': operations},
+                'relationships': [{
+                    'type': 'cloudify.relationships.contained_in',
+                    'target': 'host',
+                }],
+            },
+        },
+    })
+
+
+@contextlib.contextmanager
+def count_events(events, verbose=False):
+    """ Counts the local workflow events by type instead of printing
+        them, and drops operation logs unless verbose.
+    """
+
+    event_out = logs.stdout_event_out
+    log_out = logs.stdout_log_out
+
+    def count(event, ctx=None):
+        events[event['event_type']] += 1
+        if verbose:
+            event_out(event, ctx)
+
+    logs.stdout_event_out = count
+    if not verbose:
+        logs.stdout_log_out = lambda log, ctx=None: None
+    try:
+        yield events
+    finally:
+        logs.stdout_event_out = event_out
+        logs.stdout_log_out = log_out
+
+
+def run(instances, latency=0, threads=1, containers=0, verbose=False):
+    """ Installs and uninstalls a deployment of instances containers.
+
+    :param latency: seconds the daemon waits before each response.
+    :param threads: the local workflow task thread pool size.
+    :param containers: unrelated containers on the daemon.
+    :return: a dict of measurements.
+    """
+
+    daemon = StubDaemon(containers=containers, latency=latency).start()
+    daemon.add_image('{0}:latest'.format(IMAGE))
+    tmp = tempfile.mkdtemp()
+    events = collections.Counter()
+    result = {'instances': instances, 'threads': threads}
+    try:
+        path = os.path.join(tmp, 'blueprint.yaml')
+        with open(path, 'w') as f:
+            yaml.safe_dump(blueprint(instances, daemon.daemon_client), f)
+        env = local.init_env(
+            path, name='load_{0}'.format(instances),
+            ignored_modules=IGNORED_LOCAL_WORKFLOW_MODULES)
+
+        with count_events(events, verbose):
+            for workflow in ('install', 'uninstall'):
+                started = time.time()
+                env.execute(workflow, task_retries=10,
+                            task_retry_interval=0,
+                            task_thread_pool_size=threads)
+                result[workflow] = time.time() - started
+                if workflow == 'install':
+                    result['containers_after_install'] = \
+                        len(daemon.containers) - containers
+    finally:
+        docker_client.close_clients()
+        daemon.stop()
+        shutil.rmtree(tmp)
+
+    requests = sum(daemon.requests.values())
+    result.update({
+        'retries': events['task_rescheduled'],
+        'failed_attempts': events['task_failed'],
+        'requests': dict(daemon.requests),
+        'requests_per_instance': float(requests) / instances,
+        'containers_after_uninstall': len(daemon.containers) - containers,
+    })
+    return result
+
+
+def report(results):
+    lines = ['{0:>10}{1:>8}{2:>12}{3:>12}{4:>9}{5:>10}{6:>14}'.format(
+        'instances', 'threads', 'install s', 'uninstall s', 'retries',
+        'failures', 'requests/inst')]
+    for result in results:
+        lines.append(
+            '{0:>10}{1:>8}{2:>12.2f}{3:>12.2f}{4:>9}{5:>10}{6:>14.1f}'.format(
+                result['instances'], result['threads'], result['install'],
+                result['uninstall'], result['retries'],
+                result['failed_attempts'], result['requests_per_instance']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--instances', type=int, nargs='+',
+                        default=[10, 100])
+    parser.add_argument('--threads', type=int, default=1,
+                        help='local workflow task thread pool size')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the daemon waits before responding')
+    parser.add_argument('--containers', type=int, default=0,
+                        help='unrelated containers on the daemon')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print workflow events and logs')
+    args = parser.parse_args()
+    print(report([run(instances, args.latency, args.threads,
+                      args.containers, args.verbose)
+                  for instances in args.instances]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""A stub Docker Engine API server on a unix socket, for tests that must
+talk HTTP to a daemon without depending on a running Docker daemon.
+
+It keeps containers and images in memory, understands the endpoints the
+plugin uses, counts requests per endpoint and response body bytes, and
+can delay every response by a fixed latency. Container stats are streamed
+every stats_interval seconds with synthetic counters that advance by one
+second of daemon time per message. Container logs are sent as the
+daemon sends them, multiplexed into frames unless the container has a
+TTY, split into chunks that do not line up with the frames.
+"""
+
+# Built-in Imports
+import BaseHTTPServer
+import collections
+import itertools
+import json
+import os
+import re
+import shutil
+import SocketServer
+import struct
+import tempfile
+import threading
+import time
+import urlparse
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    # the default of 5 refuses bursts of connections that dockerd accepts
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients that time out close their connection mid response
+        pass
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'stub'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        self.server.stub.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.stub.handle(self, 'POST')
+
+    def do_DELETE(self):
+        self.server.stub.handle(self, 'DELETE')
+
+    def send_json(self, status, body):
+        data = json.dumps(body) if body is not None else ''
+        self.server.stub.bytes_sent += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunked(self, status, chunks):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            self.server.stub.bytes_sent += len(chunk)
+            self.wfile.write('{0:x}\r\n{1}\r\n'.format(len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write('0\r\n\r\n')
+
+
+class StubDaemon(object):
+
+    ROUTES = [
+        ('GET', r'/_ping$', 'ping'),
+        ('GET', r'/version$', 'version'),
+        ('GET', r'/containers/json$', 'list_containers'),
+        ('POST', r'/containers/create$', 'create_container'),
+        ('GET', r'/containers/(?P<id>[^/]+)/json$', 'inspect_container'),
+        ('GET', r'/containers/(?P<id>[^/]+)/top$', 'top'),
+        ('GET', r'/containers/(?P<id>[^/]+)/stats$', 'stats'),
+        ('GET', r'/containers/(?P<id>[^/]+)/logs$', 'logs'),
+        ('POST', r'/containers/(?P<id>[^/]+)/start$', 'start_container'),
+        ('POST', r'/containers/(?P<id>[^/]+)/stop$', 'stop_container'),
+        ('POST', r'/containers/(?P<id>[^/]+)/wait$', 'wait_container'),
+        ('DELETE', r'/containers/(?P<id>[^/]+)$', 'remove_container'),
+        ('GET', r'/images/json$', 'list_images'),
+        ('POST', r'/images/create$', 'pull'),
+        ('GET', r'/images/(?P<id>.+)/json$', 'inspect_image'),
+    ]
+
+    LOG_CHUNK_SIZE = 1000
+
+    def __init__(self, containers=0, images=0, latency=0,
+                 stats_interval=1.0):
+        self.latency = latency
+        self.stats_interval = stats_interval
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        self.containers = collections.OrderedDict()
+        self.images = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        for i in range(containers):
+            self.add_container('other_{0}'.format(i))
+        for i in range(images):
+            self.add_image('other/{0}:latest'.format(i))
+        self.tmp = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp, 'docker.sock')
+        self.server = _Server(self.socket_path, _Handler)
+        self.server.stub = self
+        self._thread = None
+
+    @property
+    def daemon_client(self):
+        return {'base_url': 'unix://{0}'.format(self.socket_path)}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def _new_id(self):
+        return '{0:064x}'.format(next(self._ids))
+
+    def add_container(self, name, image='stub:latest', running=False,
+                      tty=False):
+        container_id = self._new_id()
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Name': '/{0}'.format(name),
+            'Image': image,
+            'Running': running,
+            'Labels': {},
+            'Tty': tty,
+            'Logs': [],
+        }
+        return container_id
+
+    def add_log(self, container_id, line, stream=1, seconds=1430000000,
+                nanoseconds=0):
+        """ Logs a line of container_id, stream 1 is stdout and 2 is
+            stderr.
+        """
+
+        self.containers[container_id]['Logs'].append(
+            (stream, seconds, nanoseconds, line))
+
+    def add_image(self, reference):
+        image_id = self._new_id()
+        self.images[image_id] = {
+            'Id': image_id,
+            'RepoTags': [reference],
+            'RepoDigests': [],
+        }
+        return image_id
+
+    def handle(self, handler, method):
+        url = urlparse.urlparse(handler.path)
+        path = re.sub(r'^/v[0-9.]+/', '/', url.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else ''
+        if self.latency:
+            time.sleep(self.latency)
+        for route_method, pattern, name in self.ROUTES:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                with self._lock:
+                    self.requests[name] += 1
+                    stream = getattr(self, name)(
+                        handler, query, body, **match.groupdict())
+                # endless streams are sent without holding the lock
+                if stream is not None:
+                    handler.send_chunked(200, stream)
+                return
+        handler.send_json(404, {'message': 'page not found'})
+
+    def _find(self, container_id):
+        for key in self.containers:
+            if key.startswith(container_id) or \
+                    self.containers[key]['Name'] == '/' + container_id:
+                return self.containers[key]
+        return None
+
+    def _summary(self, container):
+        return {
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Image'],
+            'Labels': container['Labels'],
+            'Status': 'Up 1 second' if container['Running']
+            else 'Exited (0) 1 second ago',
+        }
+
+    def ping(self, handler, query, body):
+        handler.send_json(200, 'OK')
+
+    def version(self, handler, query, body):
+        handler.send_json(200, {'ApiVersion': '1.18', 'Version': 'stub'})
+
+    def list_containers(self, handler, query, body):
+        filters = json.loads(query.get('filters') or '{}')
+        result = []
+        for container in self.containers.values():
+            if not container['Running'] and query.get('all') in (None, '0'):
+                continue
+            if 'id' in filters and not any(
+                    container['Id'].startswith(i) for i in filters['id']):
+                continue
+            if 'name' in filters and not any(
+                    n in container['Name'] for n in filters['name']):
+                continue
+            result.append(self._summary(container))
+        handler.send_json(200, result)
+
+    def create_container(self, handler, query, body):
+        config = json.loads(body or '{}')
+        if not any(config.get('Image') in (i['Id'], r)
+                   for i in self.images.values() for r in i['RepoTags']):
+            return handler.send_json(
+                404, {'message': 'No such image: {0}'.format(
+                    config.get('Image'))})
+        container_id = self.add_container(
+            query.get('name') or self._new_id()[-12:], config['Image'])
+        handler.send_json(201, {'Id': container_id, 'Warnings': None})
+
+    def _with_container(self, handler, container_id):
+        container = self._find(container_id)
+        if container is None:
+            handler.send_json(
+                404, {'message': 'No such container: {0}'.format(
+                    container_id)})
+        return container
+
+    def inspect_container(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            handler.send_json(200, {
+                'Id': container['Id'],
+                'Name': container['Name'],
+                'Image': container['Image'],
+                'State': {'Running': container['Running'], 'ExitCode': 0},
+                'NetworkSettings': {
+                    'IPAddress': '172.17.0.2',
+                    'Gateway': '172.17.42.1',
+                    'Ports': {'80/tcp': [
+                        {'HostIp': '0.0.0.0', 'HostPort': '8080'}]},
+                },
+            })
+
+    def top(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            handler.send_json(200, {
+                'Titles': ['PID', 'COMMAND'],
+                'Processes': [['1', '/bin/sh']] if container['Running']
+                else [],
+            })
+
+    def stats(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            return self._stats_stream(container['Id'])
+
+    def _stats_stream(self, container_id):
+        # Docker's stats timestamps have nanoseconds.
+        started = 1430000000
+        for tick in itertools.count():
+            if tick:
+                time.sleep(self.stats_interval)
+            if container_id not in self.containers:
+                return
+            read = time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.gmtime(started + tick))
+            yield json.dumps({
+                'read': '{0}.123456789Z'.format(read),
+                'cpu_stats': {
+                    'cpu_usage': {'total_usage': tick * 10 ** 8,
+                                  'percpu_usage': [0, 0]},
+                    'system_cpu_usage': tick * 2 * 10 ** 9,
+                },
+                'memory_stats': {'usage': (64 + tick % 2) * 2 ** 20,
+                                 'limit': 2 ** 30},
+                'networks': {'eth0': {'rx_bytes': tick * 1000,
+                                      'tx_bytes': tick * 500}},
+                'blkio_stats': {'io_service_bytes_recursive': [
+                    {'op': 'Read', 'value': tick * 4096},
+                    {'op': 'Write', 'value': tick * 8192},
+                    {'op': 'Total', 'value': tick * 12288},
+                ]},
+            }) + '\n'
+
+    def logs(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            return self._log_chunks(container, query)
+
+    def _log_chunks(self, container, query):
+        since = int(query.get('since') or 0)
+        wanted = set()
+        if query.get('stdout') == '1':
+            wanted.add(1)
+        if query.get('stderr') == '1':
+            wanted.add(2)
+        data = ''
+        for stream, seconds, nanoseconds, line in list(container['Logs']):
+            if stream not in wanted or seconds < since:
+                continue
+            if query.get('timestamps') == '1':
+                # RFC 3339 with nanoseconds, trailing zeros dropped
+                fraction = '.{0:09d}'.format(nanoseconds).rstrip('0')
+                line = '{0}{1}Z {2}'.format(time.strftime(
+                    '%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)),
+                    fraction.rstrip('.'), line)
+            line += '\n'
+            if not container['Tty']:
+                line = struct.pack('>BxxxL', stream, len(line)) + line
+            data += line
+            while len(data) >= self.LOG_CHUNK_SIZE:
+                yield data[:self.LOG_CHUNK_SIZE]
+                data = data[self.LOG_CHUNK_SIZE:]
+        if data:
+            yield data
+
+    def start_container(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            container['Running'] = True
+            handler.send_json(204, None)
+
+    def stop_container(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            container['Running'] = False
+            handler.send_json(204, None)
+
+    def wait_container(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            handler.send_json(200, {'StatusCode': 0})
+
+    def remove_container(self, handler, query, body, id):
+        container = self._with_container(handler, id)
+        if container is not None:
+            del self.containers[container['Id']]
+            handler.send_json(204, None)
+
+    def list_images(self, handler, query, body):
+        name = query.get('filter')
+        handler.send_json(200, [
+            image for image in self.images.values()
+            if not name or any(r.rsplit(':', 1)[0] == name
+                               for r in image['RepoTags'])])
+
+    def inspect_image(self, handler, query, body, id):
+        for image in self.images.values():
+            if id == image['Id'] or id in image['RepoTags']:
+                return handler.send_json(200, image)
+        handler.send_json(404, {'message': 'No such image: {0}'.format(id)})
+
+    def pull(self, handler, query, body):
+        repository = query['fromImage']
+        tag = query.get('tag') or 'latest'
+        if repository.startswith('missing'):
+            return handler.send_chunked(200, [json.dumps({
+                'error': 'image {0} not found'.format(repository),
+                'errorDetail': {'message': 'image not found'}})])
+        reference = '{0}:{1}'.format(repository, tag)
+        if not any(reference in i['RepoTags'] for i in self.images.values()):
+            self.add_image(reference)
+        messages = [
+            {'status': 'Pulling from {0}'.format(repository), 'id': tag},
+            {'status': 'Downloading', 'id': 'layer',
+             'progressDetail': {'current': 512, 'total': 1024}},
+            {'status': 'Downloading', 'id': 'layer',
+             'progressDetail': {'current': 1024, 'total': 1024}},
+            {'status': 'Download complete', 'id': 'layer'},
+            {'status': 'Status: Downloaded newer image for {0}'.format(
+                reference)},
+        ]
+        # two messages per chunk, the last one split across chunks
+        data = ''.join(json.dumps(m) + '\r\n' for m in messages)
+        handler.send_chunked(200, [data[:len(data) // 3],
+                                   data[len(data) // 3:-10], data[-10:]])
@@ -0,0 +1,56 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from docker_plugin.tests import benchmark
+
+
+class TestBenchmark(testtools.TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, benchmark.percentile(values, 50))
+        self.assertEqual(99, benchmark.percentile(values, 99))
+        self.assertEqual(7, benchmark.percentile([7], 90))
+
+    def test_requests_per_step(self):
+        results = benchmark.run(iterations=3)
+
+        self.assertEqual(list(benchmark.STEPS), list(results))
+        self.assertEqual({'list_images': 1, 'create_container': 3},
+                         results['create_container']['requests'])
+        self.assertEqual(
+            {'start_container': 3, 'inspect_container': 3, 'top': 3},
+            results['start']['requests'])
+        self.assertEqual({'list_containers': 3},
+                         results['get_container_dictionary']['requests'])
+        self.assertEqual({}, results['get_image_id']['requests'])
+        self.assertEqual({'stop_container': 3, 'wait_container': 3},
+                         results['stop']['requests'])
+        self.assertEqual({'remove_container': 3},
+                         results['remove_container']['requests'])
+
+    def test_cost_does_not_grow_with_daemon_size(self):
+        empty = benchmark.run(iterations=3)
+        full = benchmark.run(containers=300, images=100, iterations=3)
+
+        for step in benchmark.STEPS:
+            self.assertEqual(empty[step]['requests'],
+                             full[step]['requests'], step)
+            self.assertEqual(empty[step]['bytes_per_call'],
+                             full[step]['bytes_per_call'], step)
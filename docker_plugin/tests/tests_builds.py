@@ -0,0 +1,208 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import logging
+import os
+import shutil
+import tempfile
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import builds
+from docker_plugin import locks
+from docker_plugin import oplog
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDaemonTestCase, FakeDockerClient
+
+
+class TestBuildImage(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBuildImage, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.patch(locks, 'LOCK_DIR', os.path.join(self.tmp, 'locks'))
+        self.patch(builds, 'CHUNK_SIZE', 1024)
+        self.client = FakeDockerClient()
+        self.log = oplog.OperationLogger(
+            logging.getLogger('test_build_image'))
+        self.context = self.write_context('context', {
+            'Dockerfile': 'FROM stub\nCOPY . /app\n',
+            '.dockerignore': '# comment\n*.log\nbuild\n!build/keep\n',
+            'app.py': 'print 1\n',
+            'big.bin': os.urandom(10 * 1024 + 10),
+            'debug.log': 'x',
+            'build/output': 'x',
+            'build/keep': 'kept',
+            'lib/util.py': '',
+        })
+
+    def write_context(self, name, files):
+        path = os.path.join(self.tmp, name)
+        for name, data in files.items():
+            full_path = os.path.join(path, name)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            with open(full_path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def build_image(self, path=None, tag='latest', **kwargs):
+        return builds.build_image(
+            self.client, path or self.context, 'repo', tag, self.log,
+            **kwargs)
+
+    def test_dockerignore(self):
+        # the excluded build directory is not sent, the exception in it is
+        self.assertEqual(
+            ['.dockerignore', 'Dockerfile', 'app.py', 'big.bin',
+             'build/keep', 'lib', 'lib/util.py'],
+            builds.context_files(self.context))
+
+    def test_dockerignore_wildcards_match_one_segment(self):
+        patterns = [('*.pyc', True), ('docs/*/tmp', True),
+                    ('**/cache', True)]
+        self.assertTrue(builds.is_excluded('a.pyc', patterns))
+        self.assertFalse(builds.is_excluded('a/b.pyc', patterns))
+        self.assertTrue(builds.is_excluded('docs/en/tmp/x', patterns))
+        self.assertFalse(builds.is_excluded('docs/en/us/tmp', patterns))
+        self.assertTrue(builds.is_excluded('cache', patterns))
+        self.assertTrue(builds.is_excluded('a/b/cache/c', patterns))
+
+    def test_context_is_streamed(self):
+        image_id = self.build_image()
+        self.assertEqual(image_id, self.client.images_by_id.keys()[0])
+        self.assertEqual(['repo:latest'],
+                         self.client.images_by_id[image_id]['RepoTags'])
+
+        sent = self.client.build_contexts[0]
+        self.assertEqual(builds.context_files(self.context), sorted(sent))
+        with open(os.path.join(self.context, 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), sent['big.bin'])
+        self.assertEqual(1024, max(self.client.uploaded_chunks))
+
+    def test_same_context_is_built_once(self):
+        first = self.build_image()
+        second = self.build_image(tag='2')
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.client.calls['build'])
+        self.assertEqual(['repo:latest', 'repo:2'],
+                         self.client.images_by_id[first]['RepoTags'])
+
+    def test_same_context_at_another_path_is_built_once(self):
+        first = self.build_image()
+        copy = os.path.join(self.tmp, 'copy')
+        shutil.copytree(self.context, copy)
+        self.assertEqual(first, self.build_image(copy))
+        self.assertEqual(1, self.client.calls['build'])
+
+    def test_changes_are_built_again(self):
+        first = self.build_image()
+
+        # an excluded file does not change the context
+        with open(os.path.join(self.context, 'debug.log'), 'w') as f:
+            f.write('more')
+        self.assertEqual(first, self.build_image())
+
+        with open(os.path.join(self.context, 'app.py'), 'w') as f:
+            f.write('print 2\n')
+        second = self.build_image()
+        self.assertNotEqual(first, second)
+
+        self.assertNotEqual(second, self.build_image(params={'nocache': 1}))
+        self.assertEqual(3, self.client.calls['build'])
+
+    def test_removed_image_is_built_again(self):
+        first = self.build_image()
+        del self.client.images_by_id[first]
+        self.assertNotEqual(first, self.build_image())
+        self.assertEqual(2, self.client.calls['build'])
+
+    def test_missing_dockerfile(self):
+        path = self.write_context('empty', {'app.py': ''})
+        self.assertRaises(IOError, self.build_image, path)
+
+
+class TestBuildImageTask(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestBuildImageTask, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.patch(locks, 'LOCK_DIR', os.path.join(self.tmp, 'locks'))
+        self.context = os.path.join(self.tmp, 'context')
+        os.makedirs(self.context)
+
+    def create_container(self, dockerfile, build_params=None,
+                         pull_policy=None):
+        with open(os.path.join(self.context, 'Dockerfile'), 'w') as f:
+            f.write(dockerfile)
+        ctx = self.set_context(
+            'test_build',
+            properties={
+                'use_external_resource': False,
+                'name': 'test_build',
+                'image': {'repository': 'built', 'build': self.context,
+                          'build_params': build_params,
+                          'pull_policy': pull_policy},
+            })
+        tasks.create_container({}, ctx=ctx)
+        return ctx.instance.runtime_properties
+
+    def test_create_container_builds_once(self):
+        first = self.create_container('FROM stub\n')
+        second = self.create_container('FROM stub\n')
+        self.assertEqual(first['image_id'], second['image_id'])
+        self.assertEqual(1, self.client.calls['build'])
+        self.assertEqual(0, self.client.calls['pull'])
+        self.assertEqual(2, self.client.calls['create_container'])
+
+    def test_failed_build(self):
+        ex = self.assertRaises(NonRecoverableError, self.create_container,
+                               'FAIL\n')
+        self.assertIn('Failed to build image: failed', str(ex))
+        self.assertEqual(0, self.client.calls['create_container'])
+
+    def test_context_file_removed_while_building(self):
+        context_files = builds.context_files
+        self.patch(builds, 'context_files', lambda *args: sorted(
+            context_files(*args) + ['removed.py']))
+        ex = self.assertRaises(NonRecoverableError, self.create_container,
+                               'FROM stub\n')
+        self.assertIn('Failed to build image', str(ex))
+        self.assertIn('removed.py', str(ex))
+
+    def test_reserved_build_params(self):
+        ex = self.assertRaises(
+            NonRecoverableError, self.create_container, 'FROM stub\n',
+            {'tag': 'other:latest', 'stream': False, 'nocache': True})
+        self.assertIn('build_params may not set stream, tag', str(ex))
+        self.assertEqual(0, self.client.calls['build'])
+
+    def test_pull_policy_applies_to_built_images(self):
+        ex = self.assertRaises(
+            NonRecoverableError, self.create_container, 'FROM stub\n',
+            pull_policy='never')
+        self.assertIn('is not present and pull_policy is never', str(ex))
+
+        self.client.add_image('present_id', repo_tags=['built:latest'])
+        properties = self.create_container('FROM stub\n',
+                                           pull_policy='if_not_present')
+        self.assertEqual('present_id', properties['image_id'])
+        self.assertEqual(0, self.client.calls['build'])
@@ -0,0 +1,234 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import collections
+import logging
+
+# Third Party Imports
+import requests
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import bulk
+from docker_plugin import workflows
+from docker_plugin.tests.fakes import FakeDaemonTestCase
+
+StoredInstance = collections.namedtuple(
+    'StoredInstance', 'runtime_properties version')
+Instance = collections.namedtuple('Instance', 'id')
+
+
+class FakeNode(object):
+
+    def __init__(self, node_id, count, image, start_inputs=None,
+                 use_external_resource=False):
+        self.properties = {'image': image, 'name': '',
+                           'use_external_resource': use_external_resource}
+        self.operations = {
+            workflows.START_OPERATION: {'inputs': start_inputs or {}}}
+        self.instances = [Instance('{0}_{1}'.format(node_id, i))
+                          for i in range(count)]
+
+
+class FakeStore(object):
+
+    def __init__(self):
+        self.instances = collections.defaultdict(
+            lambda: StoredInstance({}, 1))
+        self.updates = collections.Counter()
+
+    def get(self, instance_id):
+        return self.instances[instance_id]
+
+    def update(self, instance_id, runtime_properties, version):
+        assert self.instances[instance_id].version == version
+        self.instances[instance_id] = StoredInstance(
+            runtime_properties, version + 1)
+        self.updates[instance_id] += 1
+
+
+class TestBulkLifecycle(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestBulkLifecycle, self).setUp()
+        self.store = FakeStore()
+        self.nodes = [FakeNode('web', 20, {'repository': 'nginx'}),
+                      FakeNode('db', 5, {'repository': 'redis'})]
+        self.logger = logging.getLogger('test_bulk_lifecycle')
+
+    def run_bulk(self, operation, params=None):
+        workflows.run_bulk(self.nodes, self.store, operation, params or {},
+                           {}, 4, self.logger)
+
+    def test_lifecycle(self):
+        self.run_bulk(bulk.CREATE)
+        self.assertEquals(2, self.client.calls['pull'])
+        self.assertEquals(25, self.client.calls['create_container'])
+        self.assertEquals(25, len(self.client.containers_by_id))
+        container_ids = set(
+            i.runtime_properties['container_id']
+            for i in self.store.instances.values())
+        self.assertEquals(25, len(container_ids))
+
+        self.run_bulk(bulk.START)
+        self.assertEquals(25, self.client.calls['start'])
+        self.assertEqual(
+            '127.0.0.1',
+            self.store.get('web_0').runtime_properties['ip_address'])
+
+        self.run_bulk(bulk.STOP, {'timeout': 1})
+        self.assertEquals(25, self.client.calls['wait'])
+
+        self.run_bulk(bulk.DELETE)
+        self.assertEquals({}, self.client.containers_by_id)
+        self.assertNotIn('container_id',
+                         self.store.get('db_4').runtime_properties)
+        self.assertEquals(4, self.store.updates['web_0'])
+
+    def test_per_item_errors(self):
+        self.run_bulk(bulk.CREATE)
+        del self.client.containers_by_id[
+            self.store.get('db_2').runtime_properties['container_id']]
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.DELETE)
+        self.assertIn('db_2 (APIError', ex.message)
+        self.assertEquals(25, self.client.calls['remove_container'])
+        self.assertIn('container_id',
+                      self.store.get('db_2').runtime_properties)
+        self.assertNotIn('container_id',
+                         self.store.get('db_1').runtime_properties)
+
+    def test_unknown_operation(self):
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, 'restart')
+        self.assertIn('Unknown bulk operation', ex.message)
+
+    def test_src_and_built_images_fail_per_item(self):
+        self.nodes = [
+            FakeNode('imported', 1, {'repository': 'imported',
+                                     'src': '/tmp/image.tar'}),
+            FakeNode('built', 1, {'repository': 'built', 'build': '/tmp'}),
+            FakeNode('web', 2, {'repository': 'nginx'})]
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.CREATE)
+        self.assertIn('imported_0 (NonRecoverableError: bulk create needs '
+                      'an image repository', ex.message)
+        self.assertIn('built_0 (NonRecoverableError', ex.message)
+        self.assertEquals(['nginx:latest'], self.client.pulled)
+        self.assertEquals(2, self.client.calls['create_container'])
+
+    def test_external_resources_fail_per_item(self):
+        self.nodes.append(FakeNode('external', 1, {'repository': 'nginx'},
+                                   use_external_resource=True))
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.CREATE)
+        self.assertIn('external_0 (NonRecoverableError: instances with '
+                      'use_external_resource', ex.message)
+        self.assertEquals(25, self.client.calls['create_container'])
+
+    def test_pull_policy(self):
+        self.client.add_image('nginx_id', repo_tags=['nginx:1.0'])
+        self.nodes = [
+            FakeNode('web', 2, {'repository': 'nginx', 'tag': '1.0'}),
+            FakeNode('db', 2, {'repository': 'redis', 'tag': '3.0',
+                               'pull_policy': 'never'}),
+            FakeNode('cache', 2, {'repository': 'memcached'})]
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.CREATE)
+        self.assertIn('db_1 (NonRecoverableError: Image redis:3.0 is not '
+                      'present and pull_policy is never.)', ex.message)
+        self.assertEquals(['memcached:latest'], self.client.pulled)
+        self.assertEquals(4, self.client.calls['create_container'])
+
+    def test_start_waits_for_readiness_probes(self):
+        self.nodes = [FakeNode('web', 3, {'repository': 'nginx'},
+                               {'processes_to_wait_for': ['nginx'],
+                                'readiness_timeout': 0.2})]
+        self.run_bulk(bulk.CREATE)
+        ready = self.store.get('web_1').runtime_properties['container_id']
+        self.client.containers_by_id[ready]['Processes'] = [['1', 'nginx']]
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.START)
+        self.assertIn('web_0 (NonRecoverableError: Readiness probes did not '
+                      'pass: name=nginx type=process.)', ex.message)
+        self.assertNotIn('web_1', ex.message)
+        self.assertIn('ip_address',
+                      self.store.get('web_1').runtime_properties)
+
+    def fail_create(self, name, error):
+        create_container = self.client.create_container
+
+        def fail(**arguments):
+            if arguments['name'] == name:
+                raise error
+            return create_container(**arguments)
+        self.client.create_container = fail
+
+    def test_connection_errors_are_per_item(self):
+        self.fail_create('db_3', requests.exceptions.ConnectionError(
+            'connection aborted'))
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.CREATE)
+        self.assertIn('db_3 (ConnectionError: connection aborted)',
+                      ex.message)
+        self.assertEquals(24, len(self.client.containers_by_id))
+        self.assertNotIn('container_id',
+                         self.store.get('db_3').runtime_properties)
+        self.assertIn('container_id',
+                      self.store.get('db_4').runtime_properties)
+
+    def test_succeeded_items_are_stored_when_an_item_raises(self):
+        self.fail_create('db_3', RuntimeError('unexpected'))
+        self.assertRaises(RuntimeError, self.run_bulk, bulk.CREATE)
+        self.assertEquals(24, len([
+            instance for instance in self.store.instances.values()
+            if 'container_id' in instance.runtime_properties]))
+
+    def test_failed_pull_fails_the_items_of_the_image(self):
+        def pull(repository, **_):
+            if repository == 'redis':
+                raise requests.exceptions.ReadTimeout('read timed out')
+            return iter([])
+        self.client.pull = pull
+        self.client.add_image('nginx_id', repo_tags=['nginx:latest'])
+        ex = self.assertRaises(
+            NonRecoverableError, self.run_bulk, bulk.CREATE)
+        self.assertIn('db_0 (ReadTimeout: read timed out)', ex.message)
+        self.assertEquals(20, self.client.calls['create_container'])
+        self.assertIn('container_id',
+                      self.store.get('web_19').runtime_properties)
+
+
+class FakeWorkflowContext(object):
+
+    def __init__(self, local):
+        self.local = local
+
+
+class TestCheckRemoteDaemon(testtools.TestCase):
+
+    def test_manager_needs_a_remote_daemon(self):
+        for daemon_client in ({}, {'base_url': 'unix://var/run/docker.sock'}):
+            ex = self.assertRaises(
+                NonRecoverableError, workflows.check_remote_daemon,
+                FakeWorkflowContext(local=False), daemon_client)
+            self.assertIn('runs on the manager', ex.message)
+        workflows.check_remote_daemon(
+            FakeWorkflowContext(local=False), {'base_url': 'tcp://a:2376'})
+
+    def test_local_workflows_may_use_the_local_socket(self):
+        workflows.check_remote_daemon(FakeWorkflowContext(local=True), {})
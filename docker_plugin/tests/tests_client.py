@@ -14,6 +14,8 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import threading
+
 import testtools
 
 # Third Party Imports
@@ -21,6 +23,7 @@ import testtools
 # Cloudify Imports is imported and used in operations
 from cloudify.exceptions import NonRecoverableError
 from docker_plugin import docker_client
+from docker_plugin.tests.fakes import FakeDockerClient
 
 
 class TestClient(testtools.TestCase):
@@ -32,3 +35,165 @@ class TestClient(testtools.TestCase):
         ex = self.assertRaises(
             NonRecoverableError, docker_client.get_client, daemon_client)
         self.assertIn('Error while getting client', ex.message)
+
+
+class FakeClient(object):
+
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = False
+        self.healthy = True
+        self.ping_started = threading.Event()
+        self.answer = None
+        self.hooks = {'response': []}
+        FakeClient.instances.append(self)
+
+    def ping(self):
+        self.ping_started.set()
+        if self.answer is not None:
+            self.answer.wait()
+        if not self.healthy:
+            raise IOError('daemon went away')
+        return 'OK'
+
+    def close(self):
+        self.closed = True
+
+
+class TestClientPool(testtools.TestCase):
+
+    def setUp(self):
+        super(TestClientPool, self).setUp()
+        FakeClient.instances = []
+        self.patch(docker_client, 'Client', FakeClient)
+        docker_client.close_clients()
+        self.addCleanup(docker_client.close_clients)
+
+    def test_same_config_reuses_client(self):
+        first = docker_client.get_client(
+            {'base_url': 'unix://var/run/docker.sock', 'version': '1.12'})
+        second = docker_client.get_client(
+            {'version': '1.12', 'base_url': 'unix://var/run/docker.sock'})
+        self.assertIs(first, second)
+        self.assertEqual(1, len(FakeClient.instances))
+
+    def test_none_and_empty_config_share_client(self):
+        self.assertIs(docker_client.get_client(None),
+                      docker_client.get_client({}))
+
+    def test_different_config_gets_different_client(self):
+        first = docker_client.get_client({'base_url': 'tcp://a:2375'})
+        second = docker_client.get_client({'base_url': 'tcp://b:2375'})
+        self.assertIsNot(first, second)
+
+    def test_idle_client_is_evicted(self):
+        first = docker_client.get_client({})
+        self.patch(docker_client, 'IDLE_TIMEOUT', -1)
+        second = docker_client.get_client({})
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_client_in_use_is_not_evicted(self):
+        self.patch(docker_client, 'IDLE_TIMEOUT', -1)
+
+        @docker_client.leased
+        def long_pull():
+            client = docker_client.get_client({'base_url': 'tcp://a:2375'})
+            # another operation's checkout while the pull runs
+            docker_client.get_client({'base_url': 'tcp://b:2375'})
+            self.assertFalse(client.closed)
+            return client
+
+        client = long_pull()
+        self.assertFalse(client.closed)
+        docker_client.get_client({'base_url': 'tcp://b:2375'})
+        self.assertTrue(client.closed)
+
+    def test_client_in_use_is_not_health_checked(self):
+        @docker_client.leased
+        def operation():
+            first = docker_client.get_client({})
+            first.healthy = False
+            self.patch(docker_client, 'HEALTH_CHECK_INTERVAL', -1)
+            self.assertIs(first, docker_client.get_client({}))
+            self.assertFalse(first.closed)
+        operation()
+
+    def test_unhealthy_client_is_replaced(self):
+        first = docker_client.get_client({})
+        first.healthy = False
+        self.patch(docker_client, 'HEALTH_CHECK_INTERVAL', -1)
+        second = docker_client.get_client({})
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_health_check_does_not_hold_the_pool(self):
+        unreachable = docker_client.get_client({'base_url': 'tcp://a:2375'})
+        unreachable.answer = threading.Event()
+        self.addCleanup(unreachable.answer.set)
+        self.patch(docker_client, 'HEALTH_CHECK_INTERVAL', -1)
+        thread = threading.Thread(target=docker_client.get_client,
+                                  args=({'base_url': 'tcp://a:2375'}, ))
+        thread.start()
+        unreachable.ping_started.wait(5)
+
+        # does not wait for the hanging ping of another daemon's client
+        self.patch(docker_client, 'HEALTH_CHECK_INTERVAL', 30)
+        other = docker_client.get_client({'base_url': 'tcp://b:2375'})
+        self.assertIsNot(unreachable, other)
+
+        unreachable.answer.set()
+        thread.join()
+        self.assertFalse(unreachable.closed)
+        self.assertIs(unreachable,
+                      docker_client.get_client({'base_url': 'tcp://a:2375'}))
+
+    def test_close_clients(self):
+        client = docker_client.get_client({})
+        docker_client.close_clients()
+        self.assertTrue(client.closed)
+        self.assertIsNot(client, docker_client.get_client({}))
+
+
+class TestOperationClient(testtools.TestCase):
+
+    def setUp(self):
+        super(TestOperationClient, self).setUp()
+        self.docker = FakeDockerClient()
+        self.docker.add_container('c' * 64, 'test_operation_client')
+        self.client = docker_client.OperationClient(self.docker)
+
+    def test_reads_are_memoized(self):
+        for _ in range(3):
+            self.client.inspect_container('c' * 64)
+            self.client.top('c' * 64)
+            self.client.containers(all=True, filters={'id': 'c' * 64})
+        self.assertEqual(
+            {'inspect_container': 1, 'top': 1, 'containers': 1},
+            dict(self.client.calls))
+        self.assertEqual(6, self.client.cache_hits)
+
+    def test_mutating_call_invalidates(self):
+        self.client.inspect_container('c' * 64)
+        self.client.start('c' * 64)
+        self.client.inspect_container('c' * 64)
+        self.assertEqual(2, self.client.calls['inspect_container'])
+        self.assertEqual(1, self.client.calls['start'])
+
+    def test_cached_results_are_copies(self):
+        self.client.inspect_container('c' * 64)['NetworkSettings'] = None
+        self.assertIsNotNone(
+            self.client.inspect_container('c' * 64)['NetworkSettings'])
+
+    def test_uncached_view_shares_counters(self):
+        view = self.client.uncached()
+        view.top('c' * 64)
+        view.top('c' * 64)
+        self.assertEqual(2, self.client.calls['top'])
+
+    def test_attributes_pass_through(self):
+        self.assertIs(self.docker.containers_by_id,
+                      self.client.containers_by_id)
+        self.assertIs(self.docker, docker_client.unwrap(self.client))
@@ -0,0 +1,153 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import gzip
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import distribution
+from docker_plugin import docker_client
+from docker_plugin import workflows
+from docker_plugin.tests.fakes import FakeDockerClient
+
+
+class TestFanOut(testtools.TestCase):
+
+    def test_every_target_gets_every_chunk(self):
+        received = {}
+
+        def loader(name, delay):
+            def load(chunks):
+                received[name] = []
+                for chunk in chunks:
+                    time.sleep(delay)
+                    received[name].append(chunk)
+            return load
+
+        chunks = ['chunk {0}'.format(i) for i in range(50)]
+        targets = [distribution.Target('fast', loader('fast', 0), 2),
+                   distribution.Target('slow', loader('slow', 0.001), 2)]
+        size = distribution.fan_out(iter(chunks), targets)
+
+        self.assertEqual(sum(len(c) for c in chunks), size)
+        self.assertEqual({'fast': chunks, 'slow': chunks}, received)
+        self.assertEqual([size, size], [t.bytes for t in targets])
+
+    def test_failed_target_is_dropped(self):
+        received = []
+
+        def fail(chunks):
+            next(chunks)
+            raise IOError('disk full')
+
+        targets = [distribution.Target('failed', fail, 1),
+                   distribution.Target('ok', lambda chunks: received.extend(
+                       chunks), 1)]
+        distribution.fan_out(iter(['a'] * 100), targets)
+
+        self.assertEqual('IOError: disk full', targets[0].error)
+        self.assertIsNone(targets[1].error)
+        self.assertEqual(100, len(received))
+
+    def test_read_chunks(self):
+        data = os.urandom(10 * 1024) * 4
+        chunks = list(distribution.read_chunks(io.BytesIO(data), 1024))
+        self.assertEqual(40, len(chunks))
+
+        compressed = b''.join(distribution.read_chunks(
+            io.BytesIO(data), 1024, compress=True))
+        self.assertLess(len(compressed), len(data) / 2)
+        self.assertEqual(
+            data, gzip.GzipFile(fileobj=io.BytesIO(compressed)).read())
+
+
+class TestDistributeImage(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDistributeImage, self).setUp()
+        self.clients = {}
+        self.patch(docker_client, 'get_client', self.get_client)
+        self.source = self.get_client({'base_url': 'source'})
+        self.source.layer_size = 1024 ** 2
+        self.source.add_image('image_id', repo_tags=['repo:1.0'])
+        self.targets = [{'base_url': 'target_{0}'.format(i)}
+                        for i in range(10)]
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.logger = logging.getLogger('test_distribute_image')
+
+    def get_client(self, daemon_client):
+        return self.clients.setdefault(daemon_client['base_url'],
+                                       FakeDockerClient())
+
+    def distribute(self, compress=False, output=None):
+        return workflows.run_distribute(
+            'repo:1.0', {'base_url': 'source'}, self.targets, compress,
+            output, 4, self.logger)
+
+    def test_loaded_into_every_target(self):
+        output = os.path.join(self.tmp, 'image.tar.gz')
+        result = self.distribute(compress=True, output=output)
+
+        self.assertEqual(1, self.source.calls['get_image'])
+        for target in self.targets:
+            client = self.clients[target['base_url']]
+            self.assertEqual(1, client.calls['load_image'])
+            self.assertEqual(['repo:1.0'],
+                             client.images_by_id['image_id']['RepoTags'])
+            self.assertEqual(result['bytes'], client.loaded_bytes)
+            self.assertEqual([None], client.post_timeouts)
+        # the layer repeats the image id, it compresses well
+        self.assertLess(result['bytes'], 100 * 1024)
+        self.assertEqual(result['bytes'], os.path.getsize(output))
+        self.assertEqual(11, len(result['targets']))
+
+    def test_failed_target(self):
+        self.get_client(self.targets[3]).load_fails_after = 0
+        ex = self.assertRaises(NonRecoverableError, self.distribute)
+        self.assertIn('target_3 (APIError: 500 Server Error', str(ex))
+        self.assertNotIn('target_4', str(ex))
+        self.assertIn('image_id', self.clients['target_9'].images_by_id)
+
+    def test_targets_are_keyed_on_the_whole_configuration(self):
+        self.targets = [{'base_url': 'source'}, {'base_url': 'target_0'},
+                        {'base_url': 'target_0', 'version': '1.19'},
+                        {'version': '1.19', 'base_url': 'target_0'}]
+        result = self.distribute()
+        self.assertEqual(['target_0', 'target_0 (2)'],
+                         sorted(result['targets']))
+        self.assertEqual(0, self.source.calls['load_image'])
+        self.assertEqual(2, self.clients['target_0'].calls['load_image'])
+
+    def test_source_is_closed_when_every_target_failed(self):
+        for target in self.targets:
+            self.get_client(target).load_fails_after = 0
+        self.assertRaises(NonRecoverableError, self.distribute)
+        self.assertTrue(self.source.saved[0].closed)
+
+    def test_missing_image(self):
+        self.source.images_by_id.clear()
+        ex = self.assertRaises(NonRecoverableError, self.distribute)
+        self.assertIn('Failed to save image repo:1.0', str(ex))
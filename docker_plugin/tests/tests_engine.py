@@ -0,0 +1,222 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import logging
+import os
+import time
+
+# Third Party Imports
+import testtools
+from docker.client import Client
+
+# Cloudify Imports is imported and used in operations
+from docker_plugin import bulk
+from docker_plugin import engine
+from docker_plugin import streams
+from docker_plugin.tests.stub_daemon import StubDaemon
+
+
+class TestResponseParser(testtools.TestCase):
+
+    def parse(self, response, method='GET'):
+        call = engine.Call(method, '/test')
+        parser = engine._ResponseParser(call)
+        for i in range(len(response)):
+            parser.feed(response[i:i + 1])
+        if not parser.done:
+            parser.eof()
+        call._on_complete()
+        return call
+
+    def test_content_length(self):
+        call = self.parse(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n{"a": [1]}\n')
+        self.assertEqual(200, call.status)
+        self.assertEqual({'a': [1]}, call.get())
+
+    def test_chunked(self):
+        call = self.parse(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'4\r\n{"a"\r\n6;ext=1\r\n: [1]}\r\n0\r\n\r\n')
+        self.assertEqual({'a': [1]}, call.get())
+
+    def test_close_delimited(self):
+        call = self.parse(b'HTTP/1.0 200 OK\r\n\r\n"text"')
+        self.assertEqual('text', call.get())
+
+    def test_no_content(self):
+        call = self.parse(b'HTTP/1.1 204 No Content\r\n\r\n', 'POST')
+        self.assertIsNone(call.get())
+
+    def test_truncated(self):
+        call = engine.Call('GET', '/test')
+        parser = engine._ResponseParser(call)
+        parser.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n{}')
+        self.assertRaises(engine.EngineError, parser.eof)
+
+
+class TestEngineClient(testtools.TestCase):
+
+    def setUp(self):
+        super(TestEngineClient, self).setUp()
+        self.daemon = StubDaemon().start()
+        self.addCleanup(self.daemon.stop)
+        self.daemon.add_image('busybox:latest')
+        self.engine = engine.EngineClient(self.daemon.daemon_client)
+
+    def test_lifecycle(self):
+        created = self.engine.run_one(
+            self.engine.create_container('busybox:latest', 'sleep 100',
+                                         name='test'))
+        self.engine.run_one(self.engine.start(created['Id']))
+        inspected = self.engine.run_one(
+            self.engine.inspect_container(created['Id']))
+        self.assertTrue(inspected['State']['Running'])
+        self.assertEqual(
+            1, len(self.engine.run_one(self.engine.containers(
+                filters={'name': 'test'}))))
+        self.engine.run_one(self.engine.stop(created['Id'], timeout=1))
+        self.assertEqual(
+            0, self.engine.run_one(
+                self.engine.wait(created['Id']))['StatusCode'])
+        self.engine.run_one(self.engine.remove_container(created['Id']))
+        self.assertEqual({}, self.daemon.containers)
+
+    def test_calls_are_concurrent(self):
+        self.daemon.latency = 0.2
+        calls = self.engine.run([
+            self.engine.create_container('busybox:latest', name=str(i))
+            for i in range(40)])
+        self.assertEqual([None] * 40, [call.error for call in calls])
+        self.assertEqual(40, len(self.daemon.containers))
+        self.assertLess(max(call.duration for call in calls), 2)
+
+    def test_connections_are_bounded(self):
+        self.daemon.latency = 0.1
+        started = time.time()
+        self.engine.run([self.engine.top(str(i)) for i in range(4)],
+                        max_connections=1)
+        self.assertGreaterEqual(time.time() - started, 0.4)
+
+    def test_error_status(self):
+        call = self.engine.inspect_container('missing')
+        self.engine.run([call])
+        self.assertEqual(404, call.status)
+        error = self.assertRaises(engine.EngineError, call.get)
+        self.assertEqual(404, error.status)
+        self.assertIn('No such container: missing', str(error))
+
+    def test_pull_streams_progress(self):
+        messages = []
+        self.engine.run_one(self.engine.pull('alpine', 'edge',
+                                             on_message=messages.append))
+        self.assertEqual(5, len(messages))
+        self.assertEqual('Downloading', messages[1]['status'])
+        self.assertEqual(1, len(self.engine.run_one(
+            self.engine.images(name='alpine'))))
+
+    def test_pull_error(self):
+        call = self.engine.pull('missing')
+        self.engine.run([call])
+        self.assertRaises(streams.StreamError, call.get)
+
+    def test_timeout(self):
+        self.daemon.latency = 0.5
+        call = self.engine.top('test')
+        call.timeout = 0.1
+        self.engine.run([call])
+        error = self.assertRaises(engine.EngineError, call.get)
+        self.assertIn('timed out', str(error))
+
+    def test_file_descriptors_above_fd_setsize(self):
+        # select only takes file descriptors below 1024
+        fds = []
+        self.addCleanup(lambda: [os.close(fd) for fd in fds])
+        while not fds or fds[-1] < 1100:
+            fds.append(os.open(os.devnull, os.O_RDONLY))
+        calls = self.engine.run([
+            self.engine.create_container('busybox:latest', name=str(i))
+            for i in range(5)])
+        self.assertEqual([None] * 5, [call.error for call in calls])
+
+    def test_connection_refused(self):
+        client = engine.EngineClient({'base_url': 'unix://{0}'.format(
+            os.path.join(self.daemon.tmp, 'missing.sock'))})
+        call = client.top('test')
+        client.run([call])
+        self.assertRaises(engine.EngineError, call.get)
+
+    def test_auto_version(self):
+        client = engine.EngineClient(dict(self.daemon.daemon_client,
+                                          version='auto'))
+        self.assertEqual('1.18', client.version)
+        self.assertEqual(1, self.daemon.requests['version'])
+
+
+class TestBulkEngine(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBulkEngine, self).setUp()
+        self.daemon = StubDaemon().start()
+        self.addCleanup(self.daemon.stop)
+        self.client = Client(**self.daemon.daemon_client)
+        self.engine = engine.EngineClient(self.daemon.daemon_client)
+        self.logger = logging.getLogger('test_bulk_engine')
+
+    def run_bulk(self, operation, items, params=None):
+        return bulk.run(self.client, operation, items, params or {}, 8,
+                        self.logger, engine=self.engine)
+
+    def test_lifecycle(self):
+        items = [bulk.BulkItem(
+            'node_{0}'.format(i),
+            {'image': {'repository': 'busybox'}, 'name': ''}, {})
+            for i in range(20)]
+
+        self.assertEqual([], self.run_bulk(bulk.CREATE, items))
+        self.assertEqual(1, self.daemon.requests['pull'])
+        self.assertEqual(20, len(self.daemon.containers))
+        self.assertEqual('/node_3', self.daemon.containers[
+            items[3].runtime_properties['container_id']]['Name'])
+
+        self.assertEqual([], self.run_bulk(bulk.START, items))
+        self.assertEqual('172.17.0.2',
+                         items[0].runtime_properties['ip_address'])
+        self.assertEqual({'80/tcp': ['0.0.0.0:8080']},
+                         items[0].runtime_properties['ports'])
+        self.assertTrue(all(c['Running']
+                            for c in self.daemon.containers.values()))
+
+        self.assertEqual([], self.run_bulk(bulk.STOP, items, {'timeout': 1}))
+        self.assertEqual(20, self.daemon.requests['wait_container'])
+
+        self.assertEqual([], self.run_bulk(bulk.DELETE, items))
+        self.assertEqual({}, self.daemon.containers)
+        self.assertNotIn('container_id', items[0].runtime_properties)
+
+    def test_errors_are_per_item(self):
+        items = [bulk.BulkItem('node_{0}'.format(i), {},
+                               {'container_id': 'missing_{0}'.format(i)})
+                 for i in range(3)]
+        items[1].runtime_properties['container_id'] = \
+            self.daemon.add_container('present')
+
+        failed = self.run_bulk(bulk.START, items)
+
+        self.assertEqual([items[0], items[2]], failed)
+        self.assertIn('No such container: missing_0', items[0].error)
+        self.assertIn('ip_address', items[1].runtime_properties)
+        self.assertEqual(1, self.daemon.requests['inspect_container'])
@@ -0,0 +1,82 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import importlib
+import os
+import sys
+
+# Third Party Imports
+import testtools
+import yaml
+
+# Cloudify Imports is imported and used in operations
+from docker_plugin import lazy
+from docker_plugin import readiness
+from docker_plugin import tasks
+from docker_plugin.tests import benchmark
+
+PLUGIN_YAML = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, 'plugin.yaml')
+
+
+class TestImportTime(testtools.TestCase):
+
+    def test_tasks_defer_optional_modules(self):
+        seconds, modules = benchmark.import_time('docker_plugin.tasks')
+        for module in ('docker_plugin.imports', 'docker_plugin.locks',
+                       'docker_plugin.readiness', 'docker_plugin.streams',
+                       'docker_plugin.logs', 'docker_plugin.builds',
+                       'docker_plugin.registries',
+                       'docker_plugin.engine', 'docker_plugin.bulk'):
+            self.assertNotIn(module, modules)
+        self.assertLess(seconds, 1)
+
+    def test_workflows_defer_optional_modules(self):
+        seconds, modules = benchmark.import_time('docker_plugin.workflows')
+        for module in ('docker_plugin.bulk', 'docker_plugin.engine',
+                       'docker_plugin.stats', 'docker_plugin.distribution',
+                       'docker_plugin.imports',
+                       'docker_plugin.streams', 'multiprocessing.pool'):
+            self.assertNotIn(module, modules)
+        self.assertLess(seconds, 1)
+
+    def test_lazy_module(self):
+        sys.modules.pop('colorsys', None)
+        colorsys = lazy.LazyModule('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual((1, 1, 1), colorsys.hsv_to_rgb(0, 0, 1))
+        self.assertIn('colorsys', sys.modules)
+
+    def test_lazy_module_sees_patches(self):
+        describe = lambda probe: 'patched'  # noqa
+        self.patch(readiness, 'describe', describe)
+        self.assertIs(describe, tasks.readiness.describe)
+
+    def test_plugin_entry_points(self):
+        with open(PLUGIN_YAML) as f:
+            plugin = yaml.safe_load(f)
+        paths = [operation['implementation']
+                 for node_type in plugin['node_types'].values()
+                 for interface in node_type['interfaces'].values()
+                 for operation in interface.values()]
+        paths.extend(workflow['mapping']
+                     for workflow in plugin['workflows'].values())
+        for path in paths:
+            plugin_name, _, path = path.partition('.')
+            self.assertIn(plugin_name, plugin['plugins'])
+            module, _, function = path.rpartition('.')
+            self.assertTrue(callable(getattr(
+                importlib.import_module(module), function)), path)
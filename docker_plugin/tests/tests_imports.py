@@ -0,0 +1,135 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# Third Party Imports
+import requests
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import docker_client
+from docker_plugin import imports
+from docker_plugin import locks
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDockerClient
+
+
+class TestImportTarball(testtools.TestCase):
+
+    def setUp(self):
+        super(TestImportTarball, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.patch(locks, 'LOCK_DIR', os.path.join(self.tmp, 'locks'))
+        self.patch(imports, 'CHUNK_SIZE', 1024)
+        self.client = FakeDockerClient()
+        self.logger = logging.getLogger('test_import_tarball')
+
+    def write_tarball(self, name, data, compress=False):
+        path = os.path.join(self.tmp, name)
+        f = gzip.open(path, 'wb') if compress else open(path, 'wb')
+        with f:
+            f.write(data)
+        return path
+
+    def import_tarball(self, path, tag='latest'):
+        return imports.import_tarball(
+            self.client, path, 'repo', tag, self.logger)
+
+    def test_streams_in_chunks(self):
+        data = os.urandom(10 * 1024 + 10)
+        path = self.write_tarball('image.tar', data)
+        self.assertEquals('imported_1', self.import_tarball(path))
+        self.assertEquals(11, len(self.client.uploaded_chunks))
+        self.assertEquals(1024, max(self.client.uploaded_chunks))
+        self.assertEquals(len(data), sum(self.client.uploaded_chunks))
+
+    def test_import_has_no_read_timeout(self):
+        path = self.write_tarball('image.tar', os.urandom(4096))
+        client = docker_client.OperationClient(self.client)
+        self.assertEquals('imported_1', imports.import_tarball(
+            client, path, 'repo', 'latest', self.logger))
+        self.assertEquals([None], self.client.post_timeouts)
+        self.assertEquals(1, client.calls['import_image_from_stream'])
+
+    def test_same_tarball_is_imported_once(self):
+        path = self.write_tarball('image.tar.gz', os.urandom(4096), True)
+        first = self.import_tarball(path)
+        second = self.import_tarball(path, tag='2')
+        self.assertEquals(first, second)
+        self.assertEquals(1, self.client.calls['import_image_from_stream'])
+        self.assertEquals(['repo:latest', 'repo:2'],
+                          self.client.images_by_id[first]['RepoTags'])
+
+    def test_same_content_at_another_path_is_imported_once(self):
+        data = os.urandom(4096)
+        first = self.import_tarball(self.write_tarball('a.tar', data))
+        second = self.import_tarball(self.write_tarball('b.tar', data))
+        self.assertEquals(first, second)
+        self.assertEquals(1, self.client.calls['import_image_from_stream'])
+
+    def test_changed_tarball_is_imported_again(self):
+        path = self.write_tarball('image.tar', os.urandom(4096))
+        first = self.import_tarball(path)
+        self.write_tarball('image.tar', os.urandom(4096))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertNotEqual(first, self.import_tarball(path))
+
+    def test_removed_image_is_imported_again(self):
+        path = self.write_tarball('image.tar', os.urandom(4096))
+        first = self.import_tarball(path)
+        del self.client.images_by_id[first]
+        self.assertEquals('imported_2', self.import_tarball(path))
+
+    def test_digest(self):
+        data = os.urandom(4096)
+        path = self.write_tarball('image.tar', data)
+        self.import_tarball(path)
+        self.assertEquals(
+            'sha256:{0}'.format(hashlib.sha256(data).hexdigest()),
+            imports.ImportCache(self.client).digest(path))
+
+    def test_import_image_task(self):
+        path = self.write_tarball('image.tar', os.urandom(4096))
+        ctx = MockCloudifyContext(node_id='test_import_image_task')
+        current_ctx.set(ctx=ctx)
+        image_id = tasks.import_image(
+            self.client, {'src': path, 'repository': 'repo', 'tag': '1'})
+        self.assertEquals('imported_1', image_id)
+        self.assertEquals('imported_1',
+                          ctx.instance.runtime_properties['image_id'])
+        self.assertEquals(0, self.client.calls['images'])
+
+    def test_import_image_task_connection_error(self):
+        def post(*_, **__):
+            raise requests.exceptions.ReadTimeout('Read timed out.')
+        self.client._post = post
+        path = self.write_tarball('image.tar', os.urandom(4096))
+        current_ctx.set(ctx=MockCloudifyContext(node_id='test_timeout'))
+        ex = self.assertRaises(
+            NonRecoverableError, tasks.import_image,
+            self.client, {'src': path, 'repository': 'repo', 'tag': '1'})
+        self.assertIn('Read timed out', str(ex))
@@ -0,0 +1,183 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+import os
+import tempfile
+import time
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import docker_client
+from docker_plugin import instrumentation
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDaemonTestCase, FakeDockerClient
+from docker_plugin.tests.stub_daemon import StubDaemon
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class TestRecorder(testtools.TestCase):
+
+    def test_summary(self):
+        recorder = instrumentation.Recorder(clock=lambda: 10.0)
+        recorder.record('top', 0.5, 100)
+        recorder.record('top', 1.5, 50)
+        recorder.record('start', 0.25, 0, 'APIError')
+
+        summary = recorder.summary()
+
+        self.assertEqual(3, summary['calls'])
+        self.assertEqual(2.25, summary['api_duration'])
+        self.assertEqual(150, summary['bytes'])
+        self.assertEqual(1, summary['errors'])
+        self.assertEqual({'count': 2, 'duration': 2.0, 'max_duration': 1.5,
+                          'bytes': 150, 'errors': {}},
+                         summary['by_call']['top'])
+        self.assertEqual({'APIError': 1},
+                         summary['by_call']['start']['errors'])
+
+    def test_json_lines_sink(self):
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        recorder = instrumentation.Recorder(
+            context={'operation': 'start'},
+            sink=instrumentation.JsonLinesSink(path), clock=lambda: 10.0)
+        recorder.record('top', 0.5, 100)
+        recorder.record('start', 0.25, 0, 'APIError')
+
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            [{'operation': 'start', 'call': 'top', 'duration': 0.5,
+              'bytes': 100, 'error': None, 'timestamp': 10.0},
+             {'operation': 'start', 'call': 'start', 'duration': 0.25,
+              'bytes': 0, 'error': 'APIError', 'timestamp': 10.0}],
+            records)
+
+    def test_sink_errors_are_kept(self):
+        recorder = instrumentation.Recorder(
+            sink=instrumentation.JsonLinesSink('/nonexistent/calls.jsonl'))
+        recorder.record('top', 0.5, 100)
+        self.assertIn('nonexistent', recorder.sink_error)
+        self.assertEqual(1, recorder.summary()['calls'])
+
+
+class TestOperationClientRecording(testtools.TestCase):
+
+    def test_records_calls_and_errors(self):
+        docker = FakeDockerClient()
+        docker.add_container('c' * 64, 'test')
+        recorder = instrumentation.Recorder()
+        client = docker_client.OperationClient(docker, recorder=recorder)
+
+        client.inspect_container('c' * 64)
+        client.inspect_container('c' * 64)
+        client.uncached().top('c' * 64)
+        self.assertRaises(Exception, client.inspect_container, 'missing')
+
+        calls = recorder.summary()['by_call']
+        self.assertEqual(2, calls['inspect_container']['count'])
+        self.assertEqual({'APIError': 1}, calls['inspect_container']['errors'])
+        self.assertEqual(1, calls['top']['count'])
+
+    def test_streams_are_recorded_when_read(self):
+        docker = FakeDockerClient()
+        docker.add_image('image_id', repo_tags=['repo:1.0'])
+        recorder = instrumentation.Recorder()
+        client = docker_client.OperationClient(docker, recorder=recorder)
+
+        stream = client.pull('repo', tag='1.0', stream=True)
+        self.assertEqual(0, recorder.summary()['calls'])
+        time.sleep(0.1)
+        received = sum(len(chunk) for chunk in stream)
+
+        archive = client.get_image('repo:1.0')
+        size = len(archive.read(100)) + len(archive.read())
+
+        calls = recorder.summary()['by_call']
+        self.assertGreaterEqual(calls['pull']['duration'], 0.1)
+        self.assertEqual(received, calls['pull']['bytes'])
+        self.assertEqual(size, calls['get_image']['bytes'])
+        self.assertEqual(1, calls['get_image']['count'])
+
+    def test_closed_streams_are_recorded(self):
+        recorder = instrumentation.Recorder()
+        client = docker_client.OperationClient(FakeDockerClient(),
+                                               recorder=recorder)
+        stream = client.pull('repo', tag='1.0', stream=True)
+        next(stream)
+        stream.close()
+        self.assertEqual(1, recorder.summary()['by_call']['pull']['count'])
+
+    def test_counts_bytes(self):
+        daemon = StubDaemon().start()
+        self.addCleanup(daemon.stop)
+        daemon.add_container('test')
+        self.patch(docker_client, '_pool', {})
+        recorder = instrumentation.Recorder()
+        client = docker_client.OperationClient(
+            docker_client.get_client(daemon.daemon_client),
+            recorder=recorder)
+
+        client.containers(all=True)
+
+        self.assertGreater(recorder.summary()['bytes'], 100)
+
+
+class TestInstrumentedOperation(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestInstrumentedOperation, self).setUp()
+        self.client.add_container('c' * 64, 'test', status='Up 1 second')
+        self.sink = ListSink()
+        instrumentation.set_sink(self.sink)
+        self.addCleanup(instrumentation.set_sink, None)
+        self.set_context(
+            'test_instrumented',
+            properties={'api_call_stats': True},
+            runtime_properties={'container_id': 'c' * 64})
+
+    def test_stores_summary(self):
+        tasks.stop(10, {}, ctx=self.ctx)
+
+        stats = self.ctx.instance.runtime_properties['api_call_stats']
+        self.assertEqual(2, stats['stop']['calls'])
+        self.assertEqual(['stop', 'wait'], sorted(stats['stop']['by_call']))
+        self.assertEqual(
+            [('stop', 'test_instrumented', 'stop'),
+             ('stop', 'test_instrumented', 'wait')],
+            sorted((r['operation'], r['node_instance'], r['call'])
+                   for r in self.sink.records))
+        self.assertIsNone(instrumentation.current_recorder())
+
+    def test_records_failed_operation(self):
+        self.ctx.instance.runtime_properties['container_id'] = 'missing'
+        self.assertRaises(NonRecoverableError, tasks.remove_container, {},
+                          ctx=self.ctx)
+
+        stats = self.ctx.instance.runtime_properties['api_call_stats']
+        self.assertEqual(1, stats['remove_container']['errors'])
@@ -0,0 +1,37 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from docker_plugin.tests import load
+
+
+class TestLoadHarness(testtools.TestCase):
+
+    def test_install_uninstall(self):
+        result = load.run(5, threads=2)
+
+        self.assertEqual(5, result['containers_after_install'])
+        self.assertEqual(0, result['containers_after_uninstall'])
+        self.assertEqual(0, result['retries'])
+        self.assertEqual(0, result['failed_attempts'])
+        self.assertEqual(
+            {'list_images': 1, 'create_container': 5, 'start_container': 5,
+             'inspect_container': 5, 'top': 5, 'stop_container': 5,
+             'wait_container': 5, 'remove_container': 5},
+            result['requests'])
+        self.assertIn('5', load.report([result]))
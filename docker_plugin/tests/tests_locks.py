@@ -0,0 +1,110 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import shutil
+import tempfile
+import threading
+import time
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import RecoverableError
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import locks
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDockerClient
+
+
+class SlowPullClient(FakeDockerClient):
+
+    def pull(self, repository, tag=None, **kwargs):
+        time.sleep(0.3)
+        return super(SlowPullClient, self).pull(repository, tag, **kwargs)
+
+
+class TestImageLock(testtools.TestCase):
+
+    def setUp(self):
+        super(TestImageLock, self).setUp()
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir)
+        self.patch(locks, 'LOCK_DIR', lock_dir)
+
+    def test_waiter_reuses_result(self):
+        results = []
+
+        def holder():
+            with locks.ImageLock('daemon', 'repo:tag') as lock:
+                time.sleep(0.3)
+                lock.record('image_id')
+
+        def waiter():
+            with locks.ImageLock('daemon', 'repo:tag') as lock:
+                results.append(lock.result())
+
+        threads = [threading.Thread(target=holder)]
+        threads[0].start()
+        time.sleep(0.1)
+        threads.append(threading.Thread(target=waiter))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(['image_id'], results)
+
+    def test_earlier_result_is_not_reused(self):
+        with locks.ImageLock('daemon', 'repo:tag') as lock:
+            lock.record('old_id')
+        with locks.ImageLock('daemon', 'repo:tag') as lock:
+            self.assertIsNone(lock.result())
+
+    def test_wait_times_out(self):
+        with locks.ImageLock('daemon', 'repo:tag'):
+            started = time.time()
+            ex = self.assertRaises(
+                RecoverableError,
+                locks.ImageLock('daemon', 'repo:tag', 0.3).__enter__)
+            self.assertGreaterEqual(time.time() - started, 0.3)
+            self.assertIn('waiting for another operation', str(ex))
+        with locks.ImageLock('daemon', 'repo:tag', 0.3) as lock:
+            self.assertIsNone(lock.result())
+
+    def test_locks_are_per_daemon_and_image(self):
+        paths = set(locks.ImageLock(daemon, image).path
+                    for daemon in ('a', 'b') for image in ('r:1', 'r:2'))
+        self.assertEquals(4, len(paths))
+
+    def test_concurrent_get_image_pulls_once(self):
+        client = SlowPullClient()
+        image_ids = []
+
+        def create(instance):
+            ctx = MockCloudifyContext(
+                node_id='test_concurrent_get_image_{0}'.format(instance),
+                properties={'image': {'repository': 'repo'}})
+            current_ctx.set(ctx=ctx)
+            image_ids.append(tasks.get_image(client))
+
+        threads = [threading.Thread(target=create, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, client.calls['pull'])
+        self.assertEquals(['repo_latest_id'] * 4, image_ids)
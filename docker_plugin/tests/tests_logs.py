@@ -0,0 +1,181 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import os
+import shutil
+import struct
+import tempfile
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import logs
+from docker_plugin import tasks
+from docker_plugin.tests.stub_daemon import StubDaemon
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+class TestLogStreamer(testtools.TestCase):
+
+    def setUp(self):
+        super(TestLogStreamer, self).setUp()
+        self.lines = []
+
+    def sink(self, stream, timestamp, text):
+        self.lines.append((stream, timestamp, text))
+
+    def test_parse_timestamp(self):
+        self.assertEqual((1430000000, 120000000), logs.parse_timestamp(
+            '2015-04-25T22:13:20.12Z'))
+        self.assertEqual((1430000000, 0), logs.parse_timestamp(
+            '2015-04-25T22:13:20Z'))
+        self.assertIsNone(logs.parse_timestamp('hello'))
+
+    def test_frames_split_anywhere(self):
+        data = frame(1, b'2015-04-25T22:13:20.1Z out\n') + \
+            frame(2, b'2015-04-25T22:13:20.2Z err\n') + \
+            frame(1, b'2015-04-25T22:13:20.3Z par') + \
+            frame(1, b'tial\n')
+        streamer = logs.LogStreamer(self.sink)
+        for i in range(len(data)):
+            streamer.on_data(data[i:i + 1])
+
+        self.assertEqual([
+            ('stdout', '2015-04-25T22:13:20.1Z', 'out'),
+            ('stderr', '2015-04-25T22:13:20.2Z', 'err'),
+            ('stdout', '2015-04-25T22:13:20.3Z', 'partial'),
+        ], self.lines)
+        self.assertEqual('2015-04-25T22:13:20.3Z', streamer.cursor)
+
+    def test_tty_output_is_not_multiplexed(self):
+        streamer = logs.LogStreamer(self.sink)
+        streamer.on_data(b'2015-04-25T22:13:20Z hello\r\nno newline')
+        streamer.close()
+        self.assertEqual([
+            ('stdout', '2015-04-25T22:13:20Z', 'hello'),
+            ('stdout', None, 'no newline'),
+        ], self.lines)
+
+    def test_lines_up_to_the_cursor_are_skipped(self):
+        streamer = logs.LogStreamer(self.sink, '2015-04-25T22:13:20.2Z')
+        self.assertEqual(1430000000, streamer.since)
+        for nanoseconds in ('1', '2', '25'):
+            streamer.on_data(frame(1, '2015-04-25T22:13:20.{0}Z line\n'
+                                   .format(nanoseconds).encode()))
+        self.assertEqual(2, streamer.skipped)
+        self.assertEqual(['2015-04-25T22:13:20.25Z'],
+                         [timestamp for _, timestamp, _ in self.lines])
+
+    def test_long_lines_are_truncated(self):
+        streamer = logs.LogStreamer(self.sink, max_line_length=100)
+        streamer.on_data(frame(1, b'x' * 10 ** 6))
+        self.assertLessEqual(sum(len(p) for p in streamer._partial['stdout']),
+                             100)
+        streamer.on_data(frame(1, b'x\n'))
+        self.assertEqual(1, streamer.truncated)
+        self.assertEqual(100, len(self.lines[0][2]))
+
+    def test_max_lines(self):
+        streamer = logs.LogStreamer(self.sink, max_lines=2)
+        streamer.on_data(frame(1, b'2015-04-25T22:13:20.1Z a\n'
+                                  b'2015-04-25T22:13:20.2Z b\n'))
+        self.assertRaises(logs.docker_engine.StopStream, streamer.on_data,
+                          frame(1, b'2015-04-25T22:13:20.3Z c\n'))
+        self.assertEqual(2, len(self.lines))
+        self.assertEqual('2015-04-25T22:13:20.2Z', streamer.cursor)
+
+
+class TestStreamLogs(testtools.TestCase):
+
+    def setUp(self):
+        super(TestStreamLogs, self).setUp()
+        self.daemon = StubDaemon().start()
+        self.addCleanup(self.daemon.stop)
+        self.container_id = self.daemon.add_container('logs', running=True)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.output = os.path.join(self.tmp, 'container.log')
+        self.ctx = MockCloudifyContext(
+            node_id='test_logs',
+            properties={'use_external_resource': False},
+            runtime_properties={'container_id': self.container_id})
+        current_ctx.set(ctx=self.ctx)
+
+    def log(self, count, seconds, stream=1):
+        for i in range(count):
+            self.daemon.add_log(
+                self.container_id, 'line {0} at {1}'.format(i, seconds),
+                stream=stream, seconds=seconds, nanoseconds=i * 1000)
+
+    def stream_logs(self, **kwargs):
+        sent = self.daemon.bytes_sent
+        tasks.stream_logs(daemon_client=self.daemon.daemon_client,
+                          ctx=self.ctx, **kwargs)
+        return self.daemon.bytes_sent - sent
+
+    def output_lines(self):
+        with open(self.output) as f:
+            return f.read().splitlines()
+
+    def test_only_new_lines_are_fetched(self):
+        self.log(1000, 1430000000)
+        self.log(10, 1430000001, stream=2)
+        first = self.stream_logs(output=self.output)
+        self.assertEqual(1010, len(self.output_lines()))
+        self.assertEqual('2015-04-25T22:13:21.000009Z',
+                         self.ctx.instance.runtime_properties['logs_cursor'])
+
+        # one more line in the last second fetched, and a later one
+        self.daemon.add_log(self.container_id, 'late', seconds=1430000001,
+                            nanoseconds=10 ** 6)
+        self.daemon.add_log(self.container_id, 'later', seconds=1430000002)
+        second = self.stream_logs(output=self.output)
+
+        lines = self.output_lines()
+        self.assertEqual(1012, len(lines))
+        self.assertEqual([
+            '2015-04-25T22:13:21.001Z stdout late',
+            '2015-04-25T22:13:22Z stdout later',
+        ], lines[-2:])
+        self.assertIn('2015-04-25T22:13:21.000009Z stderr line 9 at '
+                      '1430000001', lines)
+        self.assertLess(second * 20, first)
+        self.assertEqual(2, self.daemon.requests['logs'])
+
+    def test_max_lines_continue_from_the_cursor(self):
+        self.log(25, 1430000000)
+        for _ in range(3):
+            self.stream_logs(output=self.output, max_lines=10)
+        self.assertEqual(
+            ['line {0} at 1430000000'.format(i) for i in range(25)],
+            [line.split(' ', 2)[2] for line in self.output_lines()])
+
+    def test_missing_container_keeps_the_cursor(self):
+        self.ctx.instance.runtime_properties['container_id'] = 'missing'
+        self.ctx.instance.runtime_properties['logs_cursor'] = \
+            '2015-04-25T22:13:20Z'
+        ex = self.assertRaises(NonRecoverableError, self.stream_logs,
+                               output=self.output)
+        self.assertIn('No such container: missing', str(ex))
+        self.assertEqual('2015-04-25T22:13:20Z',
+                         self.ctx.instance.runtime_properties['logs_cursor'])
@@ -0,0 +1,183 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import logging
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import bulk
+from docker_plugin import oplog
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDaemonTestCase
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+    @property
+    def volume(self):
+        return sum(len(message) for _, message in self.records)
+
+
+class TestOperationLogger(testtools.TestCase):
+
+    def setUp(self):
+        super(TestOperationLogger, self).setUp()
+        self.now = 0
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('test_oplog')
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def clock(self):
+        return self.now
+
+    def messages(self):
+        return [message for _, message in self.handler.records]
+
+    def test_structured_record(self):
+        oplog.OperationLogger(self.logger).info(
+            'Container created.', container='c1')
+        self.assertEqual(['Container created. {"container": "c1"}'],
+                         self.messages())
+
+    def test_bound(self):
+        bounded = oplog.bound({
+            'list': range(100),
+            'string': 'x' * 1000,
+            'dict': dict(('k{0}'.format(i), i) for i in range(100)),
+        }, max_items=3, max_string=5)
+        self.assertEqual([0, 1, 2, '...+97 items'], bounded['list'])
+        self.assertEqual('xxxxx...(+995 chars)', bounded['string'])
+        self.assertEqual(4, len(bounded['dict']))
+        self.assertEqual('+97 keys', bounded['dict']['...'])
+
+    def test_record_length_is_capped(self):
+        oplog.OperationLogger(self.logger, max_length=100).info(
+            'Arguments.', arguments=dict(('k' * 50 + str(i), 'v' * 200)
+                                         for i in range(50)))
+        self.assertEqual(1, len(self.messages()))
+        self.assertLess(len(self.messages()[0]), 120)
+
+    def test_verbosity(self):
+        log = oplog.OperationLogger(self.logger, verbosity='warning')
+        log.debug('Debug.')
+        log.info('Info.')
+        log.warning('Warning.')
+        log.error('Error.')
+        self.assertEqual(['Warning.', 'Error.'], self.messages())
+
+    def test_debug_verbosity_is_written_at_info(self):
+        log = oplog.OperationLogger(self.logger, verbosity='debug')
+        log.debug('Debug.')
+        self.assertEqual([(logging.INFO, 'Debug.')], self.handler.records)
+
+    def test_unknown_verbosity(self):
+        ex = self.assertRaises(NonRecoverableError, oplog.OperationLogger,
+                               self.logger, verbosity='loud')
+        self.assertIn('Unknown log_verbosity loud', str(ex))
+
+    def test_rate_limit(self):
+        log = oplog.OperationLogger(self.logger, burst=2, interval=10,
+                                    clock=self.clock)
+        for i in range(5):
+            log.info('Repeated.', i=i)
+        log.info('Other.')
+        self.assertEqual(['Repeated. {"i": 0}', 'Repeated. {"i": 1}',
+                          'Other.'], self.messages())
+
+        self.now = 10
+        log.info('Repeated.', i=5)
+        self.assertEqual(
+            'Suppressed repeated messages. '
+            '{"message": "Repeated.", "suppressed": 3}',
+            self.messages()[-2])
+        self.assertEqual('Repeated. {"i": 5}', self.messages()[-1])
+
+    def test_flush_reports_suppressed(self):
+        log = oplog.OperationLogger(self.logger, burst=1, clock=self.clock)
+        log.error('Failed.')
+        log.error('Failed.')
+        log.flush()
+        log.flush()
+        self.assertEqual(
+            [(logging.ERROR, 'Failed.'),
+             (logging.ERROR, 'Suppressed repeated messages. '
+                             '{"message": "Failed.", "suppressed": 1}')],
+            self.handler.records)
+
+
+class TestOperationLogVolume(FakeDaemonTestCase):
+
+    def start_log(self, processes, verbosity):
+        container_id = '{0:064x}'.format(processes)
+        self.client.add_container(container_id, 'test_volume')
+        container = self.client.containers_by_id[container_id]
+        container['Processes'] = [
+            [str(pid), '/bin/worker --id {0}'.format(pid)]
+            for pid in range(processes)]
+        ctx = self.set_context(
+            'test_volume',
+            properties={'use_external_resource': False},
+            runtime_properties={'container_id': container_id})
+        handler = ListHandler()
+        ctx.logger.addHandler(handler)
+        try:
+            tasks.start({}, ['/bin/worker'], 1, log_verbosity=verbosity,
+                        ctx=ctx)
+        finally:
+            ctx.logger.removeHandler(handler)
+        return handler
+
+    def test_start_log_volume_does_not_grow(self):
+        for verbosity in (oplog.INFO, oplog.DEBUG):
+            small = self.start_log(10, verbosity)
+            large = self.start_log(1000, verbosity)
+            self.assertEqual(len(small.records), len(large.records))
+            self.assertLessEqual(large.volume, small.volume + 100)
+
+    def test_debug_details_are_dropped_by_default(self):
+        info = self.start_log(10, oplog.INFO)
+        debug = self.start_log(10, oplog.DEBUG)
+        self.assertEqual(4, len(info.records))
+        self.assertEqual(7, len(debug.records))
+        self.assertIn('Start arguments.', debug.records[0][1])
+
+    def test_bulk_failures_are_rate_limited(self):
+        handler = ListHandler()
+        logger = logging.getLogger('test_oplog_bulk')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        items = [bulk.BulkItem('db_{0}'.format(i), {},
+                               {'container_id': 'missing'})
+                 for i in range(100)]
+        failed = bulk.run(self.client, bulk.DELETE, items, {}, 4, logger)
+
+        self.assertEqual(100, len(failed))
+        self.assertEqual(oplog.BURST + 1, len(handler.records))
+        self.assertIn('"suppressed": {0}'.format(100 - oplog.BURST),
+                      handler.records[-1][1])
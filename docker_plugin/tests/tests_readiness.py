@@ -0,0 +1,153 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import BaseHTTPServer
+import socket
+import threading
+import time
+
+# Third Party Imports
+import requests
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import readiness
+from docker_plugin.tests.fakes import FakeDockerClient
+
+CONTAINER = 'c' * 64
+
+
+class HealthHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200 if self.path == '/health' else 503)
+        self.end_headers()
+
+    def log_message(self, *_):
+        pass
+
+
+class TestReadiness(testtools.TestCase):
+
+    def setUp(self):
+        super(TestReadiness, self).setUp()
+        self.client = FakeDockerClient()
+        self.client.add_container(CONTAINER, 'test_readiness')
+        self.container = self.client.containers_by_id[CONTAINER]
+
+    def listen(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+        return server.getsockname()[1]
+
+    def serve_http(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), HealthHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def test_all_probe_types_pass(self):
+        self.container['Processes'] = [['1', '/usr/sbin/sshd -D']]
+        self.container['ExitCodes']['true'] = 0
+        probes = [
+            {'type': 'process', 'name': 'sshd'},
+            {'type': 'tcp', 'port': self.listen()},
+            {'type': 'http', 'port': self.serve_http(), 'path': '/health'},
+            {'type': 'exec', 'command': 'true'},
+        ]
+        not_ready = readiness.run_probes(self.client, CONTAINER, probes, 5)
+        self.assertEquals([], not_ready)
+
+    def test_probes_that_never_pass_are_returned(self):
+        port = self.listen()
+        probes = [
+            {'type': 'process', 'name': 'mongod'},
+            {'type': 'tcp', 'port': port},
+            {'type': 'http', 'port': self.serve_http(), 'path': '/down'},
+        ]
+        started = time.time()
+        not_ready = readiness.run_probes(self.client, CONTAINER, probes, 0.5)
+        self.assertLess(time.time() - started, 3)
+        self.assertEquals(['process', 'http'],
+                          [probe['type'] for probe in not_ready])
+
+    def test_probe_passes_as_soon_as_process_appears(self):
+        def start_process():
+            time.sleep(0.3)
+            self.container['Processes'] = [['1', 'mongod']]
+        threading.Thread(target=start_process).start()
+        started = time.time()
+        not_ready = readiness.run_probes(
+            self.client, CONTAINER, [{'type': 'process', 'name': 'mongod'}],
+            10)
+        self.assertEquals([], not_ready)
+        self.assertLess(time.time() - started, 3)
+
+    def test_unknown_probe_type(self):
+        ex = self.assertRaises(
+            NonRecoverableError, readiness.run_probes,
+            self.client, CONTAINER, [{'type': 'smoke_signal'}], 1)
+        self.assertIn('Unknown readiness probe type', ex.message)
+
+    def test_missing_keys(self):
+        ex = self.assertRaises(
+            NonRecoverableError, readiness.run_probes,
+            self.client, CONTAINER, [{'type': 'tcp'}], 1)
+        self.assertIn('is missing port', ex.message)
+
+    def test_probe_errors_fail_fast(self):
+        def top(container):
+            raise requests.exceptions.ConnectionError('connection refused')
+        self.client.top = top
+        started = time.time()
+        ex = self.assertRaises(
+            NonRecoverableError, readiness.run_probes,
+            self.client, CONTAINER, [{'type': 'process', 'name': 'sshd'}], 5)
+        self.assertIn('connection refused', ex.message)
+        self.assertLess(time.time() - started, 1)
+
+    def test_probe_errors_stop_the_other_probes(self):
+        def top(container):
+            raise requests.exceptions.ConnectionError('connection refused')
+        self.client.top = top
+        probes = [
+            {'type': 'http', 'port': self.serve_http(), 'path': '/down'},
+            {'type': 'process', 'name': 'sshd'},
+        ]
+        started = time.time()
+        ex = self.assertRaises(
+            NonRecoverableError, readiness.run_probes,
+            self.client, CONTAINER, probes, 10)
+        self.assertIn('name=sshd', ex.message)
+        self.assertLess(time.time() - started, 1)
+
+    def test_container_without_ip_address(self):
+        self.container['NetworkSettings'] = {'IPAddress': ''}
+        ex = self.assertRaises(
+            NonRecoverableError, readiness.run_probes,
+            self.client, CONTAINER, [{'type': 'tcp', 'port': 22}], 5)
+        self.assertIn('no IP address', ex.message)
+
+        port = self.listen()
+        self.assertEquals([], readiness.run_probes(
+            self.client, CONTAINER,
+            [{'type': 'tcp', 'port': port, 'host': '127.0.0.1'}], 5))
@@ -0,0 +1,205 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import locks
+from docker_plugin import registries
+from docker_plugin import tasks
+from docker_plugin.tests.fakes import FakeDockerClient
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        registry = self.server.registry
+        registry.probes += 1
+        time.sleep(registry.latency)
+        self.send_response(registry.status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('{}')
+
+
+class StubRegistry(object):
+    """ Answers the API root like a registry, after latency seconds.
+    """
+
+    def __init__(self, latency=0, status=200):
+        self.latency = latency
+        self.status = status
+        self.probes = 0
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.registry = self
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.host = self.url[len('http://'):]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RegistryTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(RegistryTestCase, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.patch(locks, 'LOCK_DIR', os.path.join(self.tmp, 'locks'))
+
+    def registry(self, latency=0, status=200):
+        registry = StubRegistry(latency, status)
+        self.addCleanup(registry.stop)
+        return registry
+
+
+class TestRanking(RegistryTestCase):
+
+    def setUp(self):
+        super(TestRanking, self).setUp()
+        self.now = 1000
+        self.ranking = registries.Ranking(clock=lambda: self.now)
+
+    def test_config(self):
+        config = registries.Config({'mirrors': ['mirror:5000']})
+        self.assertTrue(config.applies('ubuntu'))
+        self.assertTrue(config.applies('cloudify/manager'))
+        self.assertFalse(config.applies('quay.io/coreos/etcd'))
+        self.assertFalse(config.applies('localhost/repo'))
+        self.assertFalse(registries.Config().applies('ubuntu'))
+        self.assertEqual('mirror:5000/library/ubuntu',
+                         config.mirrors[0].repository('ubuntu'))
+        self.assertRaises(ValueError, registries.Config, {'mirror': []})
+
+    def test_ranked_by_latency(self):
+        slow, fast, down = self.registry(0.2), self.registry(), \
+            self.registry(status=503)
+        config = registries.Config({'mirrors': [down.url, slow.url,
+                                                fast.url]})
+        started = time.time()
+        ranked = self.ranking.rank(config)
+        self.assertEqual([fast.host, slow.host, down.host],
+                         [m.host for m in ranked])
+        # probed concurrently
+        self.assertLess(time.time() - started, 0.4)
+
+    def test_probes_expire(self):
+        registry = self.registry()
+        config = registries.Config({'mirrors': [registry.url], 'ttl': 60})
+        self.ranking.rank(config)
+        self.ranking.rank(config)
+        self.assertEqual(1, registry.probes)
+        self.now += 60
+        self.ranking.rank(config)
+        self.assertEqual(2, registry.probes)
+
+    def test_throughput_and_failures(self):
+        first, second = self.registry(), self.registry()
+        config = registries.Config({'mirrors': [first.url, second.url]})
+        mirrors = dict((m.host, m) for m in config.mirrors)
+        self.ranking.rank(config)
+
+        self.ranking.record_pull(mirrors[first.host], 10 * 1024 ** 2, 10)
+        self.ranking.record_pull(mirrors[second.host], 10 * 1024 ** 2, 1)
+        self.assertEqual([second.host, first.host],
+                         [m.host for m in self.ranking.rank(config)])
+
+        self.ranking.record_failure(mirrors[second.host])
+        self.assertEqual([first.host, second.host],
+                         [m.host for m in self.ranking.rank(config)])
+
+
+class TestPullFromMirrors(RegistryTestCase):
+
+    def setUp(self):
+        super(TestPullFromMirrors, self).setUp()
+        self.client = FakeDockerClient()
+        self.ctx = MockCloudifyContext(node_id='test_mirrors')
+        current_ctx.set(ctx=self.ctx)
+        self.slow, self.fast = self.registry(0.1), self.registry()
+        self.config = {'mirrors': [self.slow.url, self.fast.url]}
+
+    def pull(self, repository='repo', config=None):
+        return tasks.pull(self.client, {'repository': repository,
+                                        'tag': '1.0'},
+                          registries=config or self.config)
+
+    def test_pulls_from_the_fastest_mirror(self):
+        image_id = self.pull()
+        self.assertEqual(['{0}/library/repo:1.0'.format(self.fast.host)],
+                         self.client.pulled)
+        self.assertIn('repo:1.0',
+                      self.client.images_by_id[image_id]['RepoTags'])
+        self.assertEqual(self.fast.host,
+                         self.ctx.instance.runtime_properties['pull_mirror'])
+
+    def test_falls_back_to_the_next_mirror(self):
+        self.client.unavailable.add(self.fast.host)
+        self.pull()
+        self.assertEqual(['{0}/library/repo:1.0'.format(self.fast.host),
+                          '{0}/library/repo:1.0'.format(self.slow.host)],
+                         self.client.pulled)
+
+        # the failed mirror is tried last from now on
+        self.client.unavailable.clear()
+        del self.client.pulled[:]
+        self.pull()
+        self.assertEqual(['{0}/library/repo:1.0'.format(self.slow.host)],
+                         self.client.pulled)
+
+    def test_falls_back_to_the_default_registry(self):
+        self.client.unavailable.update([self.fast.host, self.slow.host])
+        self.pull()
+        self.assertEqual('repo:1.0', self.client.pulled[-1])
+
+        self.config['fallback'] = False
+        ex = self.assertRaises(NonRecoverableError, self.pull)
+        self.assertIn('fallback is disabled', str(ex))
+
+    def test_other_registries_are_pulled_directly(self):
+        self.pull('quay.io/repo')
+        self.assertEqual(['quay.io/repo:1.0'], self.client.pulled)
+        self.assertEqual(0, self.fast.probes)
+
+        # even when the default registry must not be pulled from
+        self.config['fallback'] = False
+        self.pull('localhost:5000/repo')
+        self.assertEqual('localhost:5000/repo:1.0', self.client.pulled[-1])
+        self.assertEqual(0, self.fast.probes)
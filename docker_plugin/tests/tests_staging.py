@@ -0,0 +1,141 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import staging
+from docker_plugin import tasks
+from docker_plugin.tests import TEST_IMAGE
+from docker_plugin.tests.fakes import FakeDaemonTestCase, server_error
+
+
+class RecordingDict(dict):
+    """ Records the calls that change it, like cloudify's
+        DirtyTrackingDict marks itself dirty.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingDict, self).__init__(*args, **kwargs)
+        self.writes = []
+
+    def __setitem__(self, key, value):
+        self.writes.append(('set', key))
+        super(RecordingDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.writes.append(('delete', key))
+        super(RecordingDict, self).__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self.writes.append(('update', ))
+        super(RecordingDict, self).update(*args, **kwargs)
+
+    def pop(self, key, *default):
+        self.writes.append(('delete', key))
+        return super(RecordingDict, self).pop(key, *default)
+
+
+class TestRuntimePropertyBuffer(testtools.TestCase):
+
+    def test_changes_are_staged(self):
+        runtime_properties = RecordingDict(a=1, b=2)
+        buffer = staging.RuntimePropertyBuffer(runtime_properties)
+
+        buffer['a'] = 10
+        buffer['c'] = 3
+        del buffer['b']
+
+        self.assertEqual({'a': 10, 'c': 3}, dict(buffer))
+        self.assertNotIn('b', buffer)
+        self.assertIsNone(buffer.get('b'))
+        self.assertRaises(KeyError, buffer.__delitem__, 'b')
+        self.assertEqual([], runtime_properties.writes)
+
+        buffer.flush()
+        self.assertEqual({'a': 10, 'c': 3}, runtime_properties)
+        self.assertEqual([('delete', 'b'), ('update', )],
+                         runtime_properties.writes)
+
+    def test_discard(self):
+        runtime_properties = RecordingDict(a=1)
+        buffer = staging.RuntimePropertyBuffer(runtime_properties)
+        buffer['a'] = 2
+        buffer.discard()
+        buffer.flush()
+        self.assertEqual({'a': 1}, runtime_properties)
+        self.assertEqual([], runtime_properties.writes)
+
+
+class TestStagedOperations(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestStagedOperations, self).setUp()
+        # Not empty, the mock context replaces empty runtime properties.
+        self.runtime_properties = RecordingDict(owner='test')
+        self.set_context(
+            'test_staged',
+            properties={
+                'use_external_resource': False,
+                'name': 'test_staged',
+                'image': {'repository': TEST_IMAGE},
+            },
+            runtime_properties=self.runtime_properties)
+
+    def writes(self):
+        writes = list(self.runtime_properties.writes)
+        del self.runtime_properties.writes[:]
+        return writes
+
+    def test_one_mutation_per_operation(self):
+        # of the instance's runtime properties, not of manager updates
+        tasks.create_container({}, ctx=self.ctx)
+        self.assertEqual([('update', )], self.writes())
+        self.assertEqual(['container_id', 'image_id', 'owner', 'pull_bytes',
+                          'pull_duration'], sorted(self.runtime_properties))
+
+        tasks.start({}, [], 1, ctx=self.ctx)
+        self.assertEqual([('update', )], self.writes())
+        self.assertEqual('running', self.runtime_properties['state'])
+
+        tasks.stop(10, {}, ctx=self.ctx)
+        self.assertEqual([], self.writes())
+
+        tasks.remove_container({}, ctx=self.ctx)
+        self.assertEqual([('delete', 'container_id')], self.writes())
+        self.assertNotIn('container_id', self.runtime_properties)
+
+    def fail_create(self):
+        def create_container(**_):
+            raise server_error('create failed')
+        self.patch(self.client, 'create_container', create_container)
+
+    def test_failed_operation_writes_are_dropped(self):
+        self.fail_create()
+        self.assertRaises(NonRecoverableError, tasks.create_container, {},
+                          ctx=self.ctx)
+        self.assertEqual(1, self.client.calls['pull'])
+        self.assertEqual([], self.writes())
+        self.assertEqual({'owner': 'test'}, self.runtime_properties)
+
+    def test_api_call_stats_are_kept_when_operation_fails(self):
+        self.ctx.node.properties['api_call_stats'] = True
+        self.fail_create()
+        self.assertRaises(NonRecoverableError, tasks.create_container, {},
+                          ctx=self.ctx)
+        self.assertEqual(['api_call_stats', 'owner'],
+                         sorted(self.runtime_properties))
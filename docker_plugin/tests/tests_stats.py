@@ -0,0 +1,195 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import engine
+from docker_plugin import stats
+from docker_plugin import workflows
+from docker_plugin.tests.stub_daemon import StubDaemon
+from docker_plugin.tests.tests_bulk import FakeStore, Instance
+
+
+def message(second, cpu=0, system=0, rx=0, memory=0):
+    return {
+        'read': '2015-04-25T22:13:{0:02d}Z'.format(second),
+        'cpu_stats': {'cpu_usage': {'total_usage': cpu,
+                                    'percpu_usage': [0, 0, 0, 0]},
+                      'system_cpu_usage': system},
+        'memory_stats': {'usage': memory, 'limit': 1000},
+        'network': {'rx_bytes': rx, 'tx_bytes': 0},
+    }
+
+
+class TestContainerStats(testtools.TestCase):
+
+    def test_parse_timestamp(self):
+        self.assertEqual(1430000000.25, stats.parse_timestamp(
+            '2015-04-25T22:13:20.250000000Z'))
+        self.assertEqual(1430000000, stats.parse_timestamp(
+            '2015-04-26T00:13:20+02:00'))
+        self.assertIsNone(stats.parse_timestamp('yesterday'))
+
+    def test_ring_buffer(self):
+        buffer = stats.RingBuffer(2, 3)
+        for i in range(5):
+            buffer.append((i, i * 10))
+        self.assertEqual(3, len(buffer))
+        self.assertEqual([(2, 20), (3, 30), (4, 40)], buffer.rows())
+
+    def test_downsampling(self):
+        container = stats.ContainerStats(interval=5, capacity=2)
+        # 1430000000 is 22:13:20
+        for second in range(20, 41):
+            container.add(message(second, cpu=second * 10 ** 8,
+                                  system=second * 4 * 10 ** 9,
+                                  rx=second * 100,
+                                  memory=second % 3 * 100))
+        container.flush()
+
+        summary = container.summary()
+        self.assertEqual(20, container.samples)
+        # 20 samples in intervals of 5 seconds, the last two kept
+        self.assertEqual(2, summary['intervals'])
+        self.assertEqual(1430000015, summary['start'])
+        self.assertEqual(1430000025, summary['end'])
+        self.assertEqual(10.0, summary['cpu_percent'])
+        self.assertEqual(100.0, summary['network_rx_bps'])
+        self.assertEqual(200, summary['max_memory_bytes'])
+        self.assertEqual(1000, summary['memory_limit'])
+
+    def test_counter_reset(self):
+        container = stats.ContainerStats(interval=60)
+        container.add(message(1, cpu=10 ** 9, system=10 ** 10, rx=5000))
+        container.add(message(2, cpu=0, system=2 * 10 ** 10, rx=0))
+        container.flush()
+        summary = container.summary()
+        self.assertEqual(0, summary['cpu_percent'])
+        self.assertEqual(0, summary['network_rx_bps'])
+
+
+class TestCollector(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCollector, self).setUp()
+        self.daemon = StubDaemon(stats_interval=0.01).start()
+        self.addCleanup(self.daemon.stop)
+        self.containers = dict(
+            ('web_{0}'.format(i),
+             self.daemon.add_container('web_{0}'.format(i), running=True))
+            for i in range(20))
+        self.engine = engine.EngineClient(self.daemon.daemon_client)
+
+    def test_one_request_per_container(self):
+        summaries = []
+        collector = stats.Collector(
+            self.engine, self.containers, duration=0.5, interval=5,
+            capacity=10, summary_interval=0.2, on_summary=summaries.append)
+        result = collector.run()
+
+        self.assertEqual({}, collector.errors)
+        self.assertEqual(20, self.daemon.requests['stats'])
+        self.assertEqual(sorted(self.containers), sorted(result))
+        self.assertGreater(len(summaries), 2)
+        summary = result['web_3']
+        self.assertGreater(summary['samples'], 5)
+        self.assertEqual(10.0, summary['cpu_percent'])
+        self.assertEqual(1000.0, summary['network_rx_bps'])
+        self.assertEqual(500.0, summary['network_tx_bps'])
+        self.assertEqual(4096.0, summary['blkio_read_bps'])
+        self.assertEqual(8192.0, summary['blkio_write_bps'])
+        self.assertEqual(65 * 2 ** 20, summary['max_memory_bytes'])
+
+    def test_quiet_streams_end_at_the_deadline(self):
+        self.daemon.stats_interval = 30
+        collector = stats.Collector(self.engine, self.containers,
+                                    duration=0.3)
+        started = time.time()
+        result = collector.run()
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual({}, collector.errors)
+        self.assertEqual(sorted(self.containers), sorted(result))
+
+    def test_missing_container(self):
+        collector = stats.Collector(
+            self.engine,
+            {'gone': 'missing', 'web_0': self.containers['web_0']},
+            duration=0.1)
+        collector.run()
+        self.assertEqual(['gone'], list(collector.errors))
+        self.assertIn('No such container: missing', collector.errors['gone'])
+
+
+class FakeNode(object):
+
+    def __init__(self, instance_ids):
+        self.instances = [Instance(i) for i in instance_ids]
+
+
+class TestCollectStatsWorkflow(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCollectStatsWorkflow, self).setUp()
+        self.daemon = StubDaemon(stats_interval=0.01).start()
+        self.addCleanup(self.daemon.stop)
+        self.store = FakeStore()
+        for i in range(3):
+            self.store.update(
+                'web_{0}'.format(i),
+                {'container_id': self.daemon.add_container(
+                    'web_{0}'.format(i), running=True)}, 1)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.logger = logging.getLogger('test_collect_stats')
+
+    def collect(self, instance_ids):
+        output = os.path.join(self.tmp, 'stats.jsonl')
+        summaries = workflows.run_collect_stats(
+            [FakeNode(instance_ids)], self.store, self.daemon.daemon_client,
+            0.3, 1, 10, 60, output, self.logger)
+        with open(output) as f:
+            return summaries, [json.loads(line) for line in f]
+
+    def test_stores_summaries(self):
+        summaries, lines = self.collect(['web_0', 'web_1', 'web_2'])
+
+        self.assertEqual(3, len(summaries))
+        stored = self.store.get('web_1').runtime_properties
+        self.assertIn('container_id', stored)
+        self.assertEqual(summaries['web_1'], stored['stats'])
+        self.assertEqual(['web_0', 'web_1', 'web_2'],
+                         [line['node_instance'] for line in lines])
+
+    def test_instances_without_container_are_skipped(self):
+        summaries, _ = self.collect(['web_0', 'not_created'])
+        self.assertEqual(['web_0'], list(summaries))
+
+    def test_failed_container(self):
+        self.store.update('web_3', {'container_id': 'missing'}, 1)
+        ex = self.assertRaises(NonRecoverableError, self.collect,
+                               ['web_0', 'web_3'])
+        self.assertIn('web_3 (', str(ex))
+        self.assertIn('stats', self.store.get('web_0').runtime_properties)
@@ -0,0 +1,133 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import json
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from docker_plugin import tasks
+from docker_plugin import streams
+from docker_plugin.tests.fakes import FakeDockerClient
+
+
+class ListLogger(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def downloading(layer, current, total):
+    return {'status': 'Downloading', 'id': layer,
+            'progressDetail': {'current': current, 'total': total}}
+
+
+class TestDecodeJsonStream(testtools.TestCase):
+
+    def test_several_objects_in_one_chunk(self):
+        chunks = ['{"status": "a"}\r\n{"status": "b"}{"status": "c"}']
+        self.assertEquals(
+            ['a', 'b', 'c'],
+            [m['status'] for m in streams.decode_json_stream(chunks)])
+
+    def test_object_split_across_chunks(self):
+        data = json.dumps({'status': 'Downloading', 'id': 'caf\xc3\xa9'})
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertEquals(
+            [{'status': 'Downloading', 'id': u'caf\xe9'}],
+            list(streams.decode_json_stream(chunks)))
+
+    def test_truncated_stream(self):
+        self.assertRaises(
+            ValueError, list, streams.decode_json_stream(['{"status": ']))
+
+
+class TestPullProgress(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPullProgress, self).setUp()
+        self.logger = ListLogger()
+        self.clock = Clock()
+        self.progress = streams.PullProgress(
+            self.logger, 'repo:tag', 10, clock=self.clock)
+
+    def test_aggregates_layers(self):
+        self.progress.update(downloading('a', 10, 100))
+        self.progress.update(downloading('b', 50, 200))
+        self.progress.update(downloading('a', 60, 100))
+        self.assertEquals(110, self.progress.downloaded_bytes)
+        self.assertEquals(300, self.progress.total_bytes)
+        self.progress.update({'status': 'Download complete', 'id': 'b'})
+        self.assertEquals(260, self.progress.downloaded_bytes)
+
+    def test_logs_at_most_once_per_interval(self):
+        for second in range(30):
+            self.clock.now = second
+            self.progress.update(downloading('a', second, 100))
+        self.assertEquals(3, len(self.logger.messages))
+        self.progress.finish()
+        self.assertIn('repo:tag: 0/1 layers, 29/100 bytes, 29.0s',
+                      self.logger.messages[-1])
+
+    def test_error_in_stream(self):
+        ex = self.assertRaises(
+            streams.StreamError, self.progress.update,
+            {'errorDetail': {'message': 'not found'}, 'error': 'not found'})
+        self.assertIn('not found', str(ex))
+
+
+class ErrorPullClient(FakeDockerClient):
+
+    def pull(self, repository, tag=None, **_):
+        return iter(['{"status": "Pulling"}{"error": "manifest unknown"}'])
+
+
+class TestPull(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPull, self).setUp()
+        self.ctx = MockCloudifyContext(node_id='test_pull')
+        current_ctx.set(ctx=self.ctx)
+
+    def test_pull_records_transfer(self):
+        client = FakeDockerClient()
+        image_id = tasks.pull(client, {'repository': 'repo', 'tag': 'tag'})
+        self.assertEquals('repo_tag_id', image_id)
+        self.assertEquals(
+            0, self.ctx.instance.runtime_properties['pull_bytes'])
+        self.assertIn('pull_duration', self.ctx.instance.runtime_properties)
+
+    def test_pull_stream_error(self):
+        ex = self.assertRaises(
+            NonRecoverableError, tasks.pull, ErrorPullClient(),
+            {'repository': 'repo', 'tag': 'tag'})
+        self.assertIn('manifest unknown', ex.message)
@@ -19,13 +19,16 @@ import json
 
 # Third Party Imports
 import docker
+import requests
 
 # Cloudify Imports is imported and used in operations
 from cloudify.mocks import MockCloudifyContext
 from docker_plugin import tasks
 from cloudify.state import current_ctx
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, RecoverableError
 from docker_plugin.tests import TEST_IMAGE
+from docker_plugin.tests.fakes import (FakeDaemonTestCase, FakeDockerClient,
+                                       not_found)
 
 
 class TestTasks(testtools.TestCase):
@@ -132,3 +135,212 @@ class TestTasks(testtools.TestCase):
         params = dict()
 
         tasks.start(params, processes, 1, {}, ctx=ctx)
+
+
+class TestStop(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestStop, self).setUp()
+        self.client.add_container('c' * 64, 'test_stop', status='Up 1 second')
+        self.set_context(
+            'test_stop',
+            properties={'use_external_resource': False},
+            runtime_properties={'container_id': 'c' * 64})
+
+    def test_stop_waits_for_exit(self):
+        tasks.stop(10, {}, wait_timeout=5, ctx=self.ctx)
+        self.assertEquals(1, self.client.calls['wait'])
+        self.assertEquals(0, self.client.calls['containers'])
+
+    def test_stop_retries_after_deadline(self):
+        self.client.containers_by_id['c' * 64]['StopHangs'] = True
+        ex = self.assertRaises(
+            RecoverableError, tasks.stop, 10, {}, wait_timeout=1,
+            ctx=self.ctx)
+        self.assertEquals(10, ex.retry_after)
+        self.assertEquals(1, self.client.calls['containers'])
+
+    def test_container_removed_while_waiting(self):
+        def wait(container, timeout=None):
+            del self.client.containers_by_id[container]
+            raise requests.exceptions.ReadTimeout('Read timed out.')
+        self.client.wait = wait
+        tasks.stop(10, {}, wait_timeout=1, ctx=self.ctx)
+        self.assertEquals(1, self.client.calls['containers'])
+
+
+class TestStart(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestStart, self).setUp()
+        self.client.add_container('c' * 64, 'test_start')
+        self.set_context(
+            'test_start',
+            properties={'use_external_resource': False},
+            runtime_properties={'container_id': 'c' * 64})
+
+    def test_start_waits_for_processes(self):
+        self.client.containers_by_id['c' * 64]['Processes'] = \
+            [['1', '/bin/sh']]
+        tasks.start({}, ['/bin/sh'], 1, ctx=self.ctx)
+        self.assertEquals(1, self.client.calls['start'])
+
+    def test_start_retries_when_probes_do_not_pass(self):
+        ex = self.assertRaises(
+            RecoverableError, tasks.start, {}, [], 7,
+            readiness_probes=[{'type': 'exec', 'command': 'false'}],
+            readiness_timeout=0.2, ctx=self.ctx)
+        self.assertIn('type=exec', str(ex))
+        self.assertEquals(7, ex.retry_after)
+
+
+class TestTaskApiCalls(FakeDaemonTestCase):
+
+    def setUp(self):
+        super(TestTaskApiCalls, self).setUp()
+        self.set_context(
+            'test_task_api_calls',
+            properties={
+                'use_external_resource': False,
+                'name': 'test_task_api_calls',
+                'image': {'repository': TEST_IMAGE}
+            })
+
+    def api_calls(self):
+        calls = dict(self.client.calls)
+        self.client.calls.clear()
+        return calls
+
+    def test_lifecycle_api_calls(self):
+        # latest is pulled without looking for it first
+        tasks.create_container({}, ctx=self.ctx)
+        self.assertEquals(
+            {'pull': 1, 'images': 1, 'create_container': 1},
+            self.api_calls())
+
+        container = self.client.containers_by_id[
+            self.ctx.instance.runtime_properties['container_id']]
+        container['Processes'] = [['1', '/bin/sh']]
+        tasks.start({}, ['/bin/sh'], 1, ctx=self.ctx)
+        self.assertEquals(
+            {'start': 1, 'top': 2, 'inspect_container': 1},
+            self.api_calls())
+
+        tasks.stop(10, {}, ctx=self.ctx)
+        self.assertEquals({'stop': 1, 'wait': 1}, self.api_calls())
+
+        tasks.remove_container({}, ctx=self.ctx)
+        self.assertEquals({'remove_container': 1}, self.api_calls())
+
+    def test_start_external_resource_api_calls(self):
+        self.client.add_container('c' * 64, 'test_task_api_calls')
+        self.ctx.node.properties['use_external_resource'] = True
+        self.ctx.instance.runtime_properties['container_id'] = 'c' * 64
+        tasks.start({}, [], 1, ctx=self.ctx)
+        self.assertEquals(
+            {'containers': 1, 'start': 1, 'top': 1, 'inspect_container': 1},
+            self.api_calls())
+
+    def test_create_with_removed_image_is_retried(self):
+        self.client.add_image(
+            'removed_id', repo_tags=['{0}:latest'.format(TEST_IMAGE)])
+        self.ctx.node.properties['image']['pull_policy'] = 'if_not_present'
+        tasks.get_image(self.client)
+        # removed outside of the plugin after it was indexed
+        del self.client.images_by_id['removed_id']
+
+        def create_container(**_):
+            raise not_found()
+        self.client.create_container = create_container
+        ex = self.assertRaises(RecoverableError, tasks.create_container, {},
+                               ctx=self.ctx)
+        self.assertIn('removed_id is not present any more', ex.message)
+        del self.client.create_container
+        tasks.create_container({}, ctx=self.ctx)
+        self.assertEquals(1, self.client.calls['pull'])
+
+    def test_create_with_present_image_does_not_pull(self):
+        self.client.add_image(
+            'present_id', repo_tags=['{0}:latest'.format(TEST_IMAGE)])
+        self.ctx.node.properties['image']['pull_policy'] = 'if_not_present'
+        tasks.create_container({}, ctx=self.ctx)
+        self.assertEquals(
+            {'images': 1, 'create_container': 1}, self.api_calls())
+        self.assertEquals(
+            'present_id', self.ctx.instance.runtime_properties['image_id'])
+
+
+class TestPullPolicy(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPullPolicy, self).setUp()
+        self.client = FakeDockerClient()
+        self.ctx = MockCloudifyContext(
+            node_id='test_pull_policy',
+            properties={'image': {'repository': 'repo', 'tag': '1.0'}})
+        current_ctx.set(ctx=self.ctx)
+
+    def set_policy(self, policy):
+        self.ctx.node.properties['image']['pull_policy'] = policy
+
+    def test_if_not_present_is_default(self):
+        self.client.add_image('local_id', repo_tags=['repo:1.0'])
+        self.assertEquals('local_id', tasks.get_image(self.client))
+        self.assertEquals(0, self.client.calls['pull'])
+
+    def test_latest_defaults_to_always(self):
+        self.client.add_image('local_id', repo_tags=['repo:latest'])
+        for tag in ('latest', None):
+            self.ctx.node.properties['image']['tag'] = tag
+            self.assertEquals('repo_latest_id', tasks.get_image(self.client))
+        self.assertEquals(2, self.client.calls['pull'])
+
+    def test_null_policy_is_the_default(self):
+        self.set_policy(None)
+        self.client.add_image('local_id', repo_tags=['repo:1.0'])
+        self.assertEquals('local_id', tasks.get_image(self.client))
+        self.assertEquals(0, self.client.calls['pull'])
+
+    def test_if_not_present_pulls_missing_image(self):
+        self.set_policy('if-not-present')
+        self.assertEquals('repo_1.0_id', tasks.get_image(self.client))
+        self.assertEquals(1, self.client.calls['pull'])
+
+    def test_always(self):
+        self.set_policy('always')
+        self.client.add_image('local_id', repo_tags=['repo:1.0'])
+        self.assertEquals('repo_1.0_id', tasks.get_image(self.client))
+        self.assertEquals(1, self.client.calls['pull'])
+
+    def test_never(self):
+        self.set_policy('never')
+        ex = self.assertRaises(
+            NonRecoverableError, tasks.get_image, self.client)
+        self.assertIn('is not present and pull_policy is never', ex.message)
+        self.client.add_image('local_id', repo_tags=['repo:1.0'])
+        self.assertEquals('local_id', tasks.get_image(self.client))
+        self.assertEquals(0, self.client.calls['pull'])
+
+    def test_unknown_policy(self):
+        self.set_policy('sometimes')
+        ex = self.assertRaises(
+            NonRecoverableError, tasks.get_image, self.client)
+        self.assertIn('Unknown pull_policy', ex.message)
+
+
+class TestPrefetchImage(FakeDaemonTestCase):
+
+    def prefetch(self, image):
+        self.set_context('test_prefetch', properties={'image': image})
+        tasks.prefetch_image(ctx=self.ctx)
+
+    def test_pulls_the_image(self):
+        self.prefetch({'repository': 'repo', 'tag': '1.0'})
+        self.assertEquals(['repo:1.0'], self.client.pulled)
+        self.assertEquals(
+            'repo_1.0_id', self.ctx.instance.runtime_properties['image_id'])
+
+    def test_skips_images_that_are_not_pulled(self):
+        self.prefetch({'repository': 'repo', 'src': '/tmp/image.tar'})
+        self.prefetch({'repository': 'repo', 'pull_policy': 'never'})
+        self.assertEquals(0, self.client.calls['pull'])
@@ -16,6 +16,11 @@
 # Built-in Imports
 import testtools
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 # Third Party Imports
 import docker
@@ -26,6 +31,7 @@ from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError
 from docker_plugin import utils
 from docker_plugin.tests import TEST_IMAGE
+from docker_plugin.tests.fakes import FakeDockerClient
 
 
 class TestUtils(testtools.TestCase):
@@ -103,49 +109,6 @@ class TestUtils(testtools.TestCase):
             NonRecoverableError, utils.inspect_container, client)
         self.assertIn('Unable to inspect container', ex.message)
 
-    def test_wait_for_processes_bad_container(self):
-
-        name = 'test_inspect_container_no_container'
-        client = self.get_docker_client()
-        ctx = self.get_mock_context(name)
-        current_ctx.set(ctx=ctx)
-
-        ctx.instance.runtime_properties['container_id'] = \
-            self.get_bad_container_id()
-
-        processes = ['/bin/sleep', 'mongod']
-
-        ex = self.assertRaises(
-            NonRecoverableError, utils.wait_for_processes,
-            processes, 1, client)
-
-        self.assertIn('Unable get container processes from top', ex.message)
-
-    def test_wait_for_processes(self):
-
-        name = 'test_wait_for_processes'
-        client = self.get_docker_client()
-        self.pull_image(client)
-        ctx = self.get_mock_context(name)
-        current_ctx.set(ctx=ctx)
-
-        for image in self.get_docker_images(client):
-            if '{0}:latest'.format(TEST_IMAGE) in \
-                    self.get_tags_for_docker_image(image):
-                image_id = self.get_id_from_image(image)
-
-        container = self.create_container(client, name, image_id)
-        self.addCleanup(client.remove_container, container=container)
-        self.addCleanup(client.stop, container=container, timeout=1)
-        ctx.instance.runtime_properties['container_id'] = container.get('Id')
-
-        processes = ['/bin/sh']
-
-        client.start(name)
-
-        out = utils.wait_for_processes(processes, 1, client)
-        self.assertEquals(True, out)
-
     def test_get_container_dictionary_none(self):
 
         name = 'test_get_container_dictionary_none'
@@ -211,9 +174,11 @@ class TestUtils(testtools.TestCase):
                 image_id = self.get_id_from_image(image)
         container = self.create_container(client, name, image_id)
         self.addCleanup(client.remove_container, container=container)
+        out = utils.get_container_id_from_name(name, client)
+        self.assertEquals(container['Id'], out)
         ex = self.assertRaises(
             NonRecoverableError, utils.get_container_id_from_name,
-            name, client)
+            '{0}_missing'.format(name), client)
         self.assertIn(
             'No such container', ex.message)
 
@@ -253,3 +218,254 @@ class TestUtils(testtools.TestCase):
 
         out = utils.get_container_dictionary(client)
         self.assertIsNone(out)
+
+
+class TestFindContainer(testtools.TestCase):
+
+    def setUp(self):
+        super(TestFindContainer, self).setUp()
+        ctx = MockCloudifyContext(node_id='test_find_container')
+        current_ctx.set(ctx=ctx)
+        self.ctx = ctx
+
+    def get_client(self, container_count):
+        client = FakeDockerClient()
+        for i in range(container_count):
+            client.add_container(
+                '{0:064x}'.format(i), 'other_{0}'.format(i))
+        client.add_container(
+            'f' * 64, 'wanted', status='Up 2 seconds',
+            labels={'deployment': 'd1'})
+        return client
+
+    def test_finds_container_that_is_not_listed_first(self):
+        client = self.get_client(5)
+        self.ctx.instance.runtime_properties['container_id'] = 'f' * 12
+        self.assertEquals('f' * 64,
+                          utils.get_container_dictionary(client)['Id'])
+        self.assertEquals('Up 2 seconds',
+                          utils.check_container_status(client))
+        self.assertEquals('f' * 64,
+                          utils.get_container_id_from_name('wanted', client))
+
+    def test_find_container_by_label(self):
+        client = self.get_client(5)
+        self.assertEquals(
+            'f' * 64,
+            utils.find_container(client, label='deployment=d1')['Id'])
+        self.assertIsNone(utils.find_container(client, label='deployment=d2'))
+
+    def test_find_container_by_status(self):
+        client = self.get_client(0)
+        client.add_container('e' * 64, 'stopped', status='Exited (0) 1s ago')
+        client.add_container('d' * 64, 'paused', status='Up 1s (Paused)')
+        self.assertEquals(
+            'e' * 64, utils.find_container(client, status='exited')['Id'])
+        self.assertEquals(
+            'd' * 64, utils.find_container(client, status='paused')['Id'])
+        self.assertEquals(
+            'f' * 64, utils.find_container(client, status='running')['Id'])
+        self.assertIsNone(utils.find_container(client, name='stopped',
+                                               status='running'))
+
+    def test_find_container_name_is_exact(self):
+        client = self.get_client(0)
+        client.add_container('e' * 64, 'wanted_too')
+        self.assertEquals('f' * 64,
+                          utils.find_container(client, name='wanted')['Id'])
+        self.assertIsNone(utils.find_container(client, name='want'))
+
+    def test_lookup_payload_does_not_grow_with_containers(self):
+        self.ctx.instance.runtime_properties['container_id'] = 'f' * 64
+        payloads = []
+        for container_count in (10, 1000):
+            client = self.get_client(container_count)
+            utils.get_container_dictionary(client)
+            utils.check_container_status(client)
+            utils.get_container_id_from_name('wanted', client)
+            payloads.append(client.payload_bytes)
+        self.assertEquals(payloads[0], payloads[1])
+
+
+class TestImageIndex(testtools.TestCase):
+
+    def get_client(self, image_count):
+        client = FakeDockerClient()
+        client.add_image('dangling', repo_tags=None)
+        for i in range(image_count):
+            client.add_image('other_{0}'.format(i),
+                             repo_tags=['other/{0}:latest'.format(i)])
+        client.add_image('wanted_id', repo_tags=['wanted:1.0', 'wanted:2'],
+                         repo_digests=['wanted@sha256:abc'])
+        return client
+
+    def test_get_image_id(self):
+        client = self.get_client(5)
+        self.assertEquals('wanted_id',
+                          utils.get_image_id('1.0', 'wanted', client))
+        self.assertEquals('wanted_id',
+                          utils.get_image_id('sha256:abc', 'wanted', client))
+
+    def test_get_image_id_exact_tag(self):
+        client = self.get_client(5)
+        ex = self.assertRaises(
+            NonRecoverableError, utils.get_image_id, '1', 'wanted', client)
+        self.assertIn('Could not find an image', ex.message)
+
+    def test_get_image_id_is_memoized(self):
+        client = self.get_client(5)
+        for _ in range(10):
+            utils.get_image_id('1.0', 'wanted', client)
+            utils.get_image_id('2', 'wanted', client)
+        self.assertEquals(1, client.calls['images'])
+
+    def test_invalidate_image_index(self):
+        client = self.get_client(5)
+        utils.get_image_id('1.0', 'wanted', client)
+        client.add_image('new_id', repo_tags=['wanted:1.0'])
+        self.assertEquals('wanted_id',
+                          utils.get_image_id('1.0', 'wanted', client))
+        utils.invalidate_image_index(client, 'wanted')
+        self.assertEquals('new_id',
+                          utils.get_image_id('1.0', 'wanted', client))
+        self.assertEquals(2, client.calls['images'])
+
+    def test_index_entries_expire(self):
+        client = self.get_client(5)
+        utils.get_image_index(client).ttl = 0
+        self.assertEquals('wanted_id',
+                          utils.find_image_id('1.0', 'wanted', client))
+        # removed outside of the plugin, e.g. with docker rmi
+        del client.images_by_id['wanted_id']
+        self.assertIsNone(utils.find_image_id('1.0', 'wanted', client))
+        self.assertEquals(2, client.calls['images'])
+
+    def test_lookups_do_not_wait_for_other_queries(self):
+        client = self.get_client(5)
+        images = client.images
+        slow = threading.Event()
+
+        def query(name=None, **kwargs):
+            if name == 'slow':
+                slow.wait(5)
+            return images(name=name, **kwargs)
+        client.images = query
+        thread = threading.Thread(target=utils.find_image_id,
+                                  args=('1.0', 'slow', client))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(slow.set)
+        started = time.time()
+        self.assertEquals('wanted_id',
+                          utils.find_image_id('1.0', 'wanted', client))
+        self.assertLess(time.time() - started, 1)
+
+    def test_lookups_of_a_repository_share_its_query(self):
+        client = self.get_client(5)
+        images = client.images
+        started = threading.Event()
+        answer = threading.Event()
+
+        def query(name=None, **kwargs):
+            started.set()
+            answer.wait(5)
+            return images(name=name, **kwargs)
+        client.images = query
+        found = []
+        threads = [threading.Thread(target=lambda tag=tag: found.append(
+            utils.find_image_id(tag, 'wanted', client)))
+            for tag in ('1.0', '2', '3')]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        answer.set()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(['wanted_id', 'wanted_id', None], sorted(
+            found, key=lambda image_id: image_id is None))
+        self.assertEquals(1, client.calls['images'])
+
+    def test_payload_does_not_grow_with_images(self):
+        payloads = []
+        for image_count in (10, 1000):
+            client = self.get_client(image_count)
+            utils.get_image_id('1.0', 'wanted', client)
+            payloads.append(client.payload_bytes)
+        self.assertEquals(payloads[0], payloads[1])
+
+
+class TestInspectProjection(testtools.TestCase):
+
+    INSPECT_OUTPUT = {
+        'Id': 'c' * 64,
+        'Image': 'i' * 64,
+        'State': {'Running': True, 'Paused': False, 'ExitCode': 0},
+        'Config': {'Env': ['A=' + 'a' * 1000]},
+        'NetworkSettings': {
+            'IPAddress': '172.17.0.2',
+            'Gateway': '172.17.42.1',
+            'Ports': {
+                '80/tcp': [{'HostIp': '0.0.0.0', 'HostPort': '8080'}],
+                '443/tcp': [{'HostIp': '127.0.0.1', 'HostPort': '8443'},
+                            {'HostIp': '', 'HostPort': '9443'}],
+                '9000/tcp': None,
+            },
+        },
+    }
+
+    def test_project_inspect(self):
+        self.assertEqual({
+            'ip_address': '172.17.0.2',
+            'gateway': '172.17.42.1',
+            'ports': {'80/tcp': ['0.0.0.0:8080'],
+                      '443/tcp': ['127.0.0.1:8443', '0.0.0.0:9443']},
+            'image_id': 'i' * 64,
+            'state': 'running',
+        }, utils.project_inspect(self.INSPECT_OUTPUT))
+
+    def test_project_inspect_state(self):
+        self.assertEqual({'state': 'exited'}, utils.project_inspect(
+            {'State': {'Running': False}}, ['state']))
+        self.assertEqual({'state': 'paused'}, utils.project_inspect(
+            {'State': {'Running': True, 'Paused': True}}, ['state']))
+        self.assertEqual({'state': 'restarting'}, utils.project_inspect(
+            {'State': {'Status': 'restarting'}}, ['state']))
+
+    def test_project_inspect_unknown_field(self):
+        ex = self.assertRaises(NonRecoverableError, utils.project_inspect,
+                               self.INSPECT_OUTPUT, ['ip_address', 'env'])
+        self.assertIn('Unknown inspect fields env', str(ex))
+
+    def test_store_inspect_is_smaller(self):
+        runtime_properties = {}
+        utils.store_inspect(runtime_properties, {}, 'web_1',
+                            self.INSPECT_OUTPUT)
+        self.assertNotIn('network_settings', runtime_properties)
+        self.assertLess(len(json.dumps(runtime_properties)), 250)
+
+    def test_store_inspect_network_settings(self):
+        runtime_properties = {}
+        utils.store_inspect(
+            runtime_properties,
+            {'inspect_fields': ['ip_address', 'network_settings']},
+            'web_1', self.INSPECT_OUTPUT)
+        self.assertEqual(['ip_address', 'network_settings'],
+                         sorted(runtime_properties))
+        self.assertEqual(self.INSPECT_OUTPUT['NetworkSettings'],
+                         runtime_properties['network_settings'])
+
+    def test_store_inspect_output_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output_dir = os.path.join(directory, 'inspect')
+        runtime_properties = {}
+        utils.store_inspect(
+            runtime_properties, {'inspect_output_dir': output_dir},
+            'web_1', self.INSPECT_OUTPUT)
+
+        path = runtime_properties['inspect_output_path']
+        self.assertEqual(os.path.join(output_dir, 'web_1.json'), path)
+        with open(path) as f:
+            self.assertEqual(self.INSPECT_OUTPUT, json.load(f))
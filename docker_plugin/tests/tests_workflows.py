@@ -0,0 +1,134 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import collections
+import logging
+
+# Third Party Imports
+import testtools
+
+# Cloudify Imports is imported and used in operations
+from docker_plugin import workflows
+
+StoredNodeInstance = collections.namedtuple('StoredNodeInstance', 'host_id')
+
+
+class FakeInstance(object):
+
+    def __init__(self, instance_id, host_id):
+        self.id = instance_id
+        self._node_instance = StoredNodeInstance(host_id)
+
+    def execute_operation(self, operation, kwargs=None):
+        return (self.id, operation, kwargs)
+
+
+class FakeNode(object):
+
+    def __init__(self, image, daemon_client=None,
+                 type_hierarchy=('cloudify.nodes.Root',
+                                 'cloudify.docker.Container'),
+                 hosts=('host_1', ), registries=None):
+        self.type_hierarchy = list(type_hierarchy)
+        self.properties = {'image': image}
+        inputs = {'pull_progress_interval': 10}
+        if daemon_client is not None:
+            inputs['daemon_client'] = daemon_client
+        if registries is not None:
+            inputs['registries'] = registries
+        self.operations = {
+            'cloudify.interfaces.lifecycle.create': {'inputs': inputs}
+        }
+        self.instances = [
+            FakeInstance('{0}_{1}'.format(image.get('repository'), index),
+                         host_id)
+            for index, host_id in enumerate(hosts)]
+
+
+class FakeSequence(list):
+
+    def add(self, *tasks):
+        self.extend(tasks)
+
+
+class FakeGraph(object):
+
+    def __init__(self):
+        self.sequences = []
+        self.executed = False
+
+    def sequence(self):
+        sequence = FakeSequence()
+        self.sequences.append(sequence)
+        return sequence
+
+    def execute(self):
+        self.executed = True
+
+
+class TestPrefetchImages(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPrefetchImages, self).setUp()
+        self.logger = logging.getLogger('test_prefetch_images')
+
+    def get_nodes(self):
+        return [
+            FakeNode({'repository': 'redis'},
+                     hosts=['host_1', 'host_1', 'host_2']),
+            FakeNode({'repository': 'redis', 'tag': 'latest'}),
+            FakeNode({'repository': 'nginx', 'tag': '1.9'},
+                     registries={'mirrors': ['mirror:5000']}),
+            FakeNode({'repository': 'redis'}, {'base_url': 'tcp://b:2375'}),
+            FakeNode({'repository': 'imported', 'src': '/tmp/image.tar'}),
+            FakeNode({'repository': 'built', 'build': '/tmp/context'}),
+            FakeNode({'repository': 'local', 'pull_policy': 'never'}),
+            FakeNode({'repository': 'mysql'},
+                     type_hierarchy=['cloudify.nodes.Root']),
+        ]
+
+    def test_one_instance_per_host_daemon_and_image(self):
+        jobs = workflows.get_prefetch_jobs(self.get_nodes())
+        self.assertEquals(
+            {'host_1': ['redis_0', 'nginx_0', 'redis_0'],
+             'host_2': ['redis_2']},
+            dict((host_id, [instance.id for instance, _ in host_jobs])
+                 for host_id, host_jobs in jobs.items()))
+        self.assertEquals({'base_url': 'tcp://b:2375'},
+                          jobs['host_1'][2][1]['daemon_client'])
+
+    def test_prefetch_runs_operations_per_host(self):
+        graph = FakeGraph()
+        self.assertEquals(
+            4, workflows.prefetch(graph, self.get_nodes(), 2, self.logger))
+        self.assertTrue(graph.executed)
+        # the lanes of host_1, then the lane of host_2
+        self.assertEquals([2, 1, 1], [len(s) for s in graph.sequences])
+        self.assertEquals(
+            ('nginx_0', 'docker.images.prefetch',
+             {'pull_progress_interval': 10,
+              'registries': {'mirrors': ['mirror:5000']}}),
+            graph.sequences[1][0])
+        self.assertEquals(
+            {'pull_progress_interval': 10,
+             'daemon_client': {'base_url': 'tcp://b:2375'}},
+            graph.sequences[0][1][2])
+
+    def test_nothing_to_prefetch(self):
+        graph = FakeGraph()
+        self.assertEquals(0, workflows.prefetch(
+            graph, [FakeNode({'src': '/tmp/image.tar'})], 2, self.logger))
+        self.assertFalse(graph.executed)
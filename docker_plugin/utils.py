@@ -12,29 +12,230 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+# Built-in Imports
+import json
+import os
+import threading
+import time
+import weakref
+
 # Third-party Imports
+import requests
 from docker.errors import APIError
 
 # Cloudify Imports
-from cloudify import ctx
-from cloudify.exceptions import RecoverableError, NonRecoverableError
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import docker_client
+from docker_plugin import oplog
+from docker_plugin import staging
+
+IP_ADDRESS = 'ip_address'
+GATEWAY = 'gateway'
+PORTS = 'ports'
+IMAGE_ID = 'image_id'
+STATE = 'state'
+NETWORK_SETTINGS = 'network_settings'
+INSPECT_FIELDS = (IP_ADDRESS, GATEWAY, PORTS, IMAGE_ID, STATE)
+ALL_INSPECT_FIELDS = INSPECT_FIELDS + (NETWORK_SETTINGS,)
+
+ALWAYS = 'always'
+IF_NOT_PRESENT = 'if_not_present'
+NEVER = 'never'
+PULL_POLICIES = (ALWAYS, IF_NOT_PRESENT, NEVER)
+
+# Seconds an indexed image id is trusted, images can be removed outside
+# of the plugin.
+INDEX_TTL = 30
+
+
+class _Load(object):
+    """ A query of one repository's images, that lookups of the same
+        repository wait for instead of querying again.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.images = None
+
+
+class ImageIndex(object):
+    """ Maps repository:tag and repository@digest references to image ids
+        for one daemon. A reference that is not indexed yet, or was
+        indexed more than ttl seconds ago, loads its repository with a
+        filtered images query, so lookups do not depend on how many
+        images the host has. Misses are not cached, images pulled outside
+        of the plugin are found. The query runs without the lock, a slow
+        daemon does not hold up lookups of other repositories; lookups
+        of the same repository wait for it and use its result.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = INDEX_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        # reference: (image id, time indexed)
+        self._images = dict()
+        # repository: the _Load running for it
+        self._loads = dict()
+        # bumped by invalidate, a load that started before is not stored
+        self._generation = 0
+
+    def lookup(self, client, repository, reference):
+        while True:
+            with self._lock:
+                entry = self._images.get(reference)
+                if entry is not None and time.time() - entry[1] < self.ttl:
+                    return entry[0]
+                load = self._loads.get(repository)
+                if load is None:
+                    load = self._loads[repository] = _Load()
+                    generation = self._generation
+                    break
+            load.done.wait()
+            # else the query failed, try it in this thread
+            if load.images is not None:
+                return load.images.get(reference)
+
+        try:
+            loaded = time.time()
+            load.images = self._query(client, repository)
+            with self._lock:
+                if generation == self._generation:
+                    self._forget(repository)
+                    self._images.update(
+                        (other, (image_id, loaded))
+                        for other, image_id in load.images.items())
+        finally:
+            with self._lock:
+                del self._loads[repository]
+            load.done.set()
+        return load.images.get(reference)
+
+    def _query(self, client, repository):
+        try:
+            images = client.images(name=repository)
+        except APIError as e:
+            raise NonRecoverableError(
+                'Unable to get last created image: {0}'.format(e))
+
+        return dict(
+            (reference, image.get('Id')) for image in images
+            for reference in (image.get('RepoTags') or []) +
+            (image.get('RepoDigests') or []))
+
+    def _forget(self, repository):
+        for reference in list(self._images):
+            if reference.startswith(repository + ':') or \
+                    reference.startswith(repository + '@'):
+                del self._images[reference]
+
+    def invalidate(self, repository=None):
+        with self._lock:
+            self._generation += 1
+            if repository is None:
+                self._images.clear()
+            else:
+                self._forget(repository)
+
+
+_image_indexes = weakref.WeakKeyDictionary()
+_image_indexes_lock = threading.Lock()
+
+
+def get_image_index(client):
+    """ Returns the ImageIndex of the daemon behind client.
+        Clients are pooled per daemon, see docker_client.
+
+    :param client: the client. see docker_client.
+    """
+
+    client = docker_client.unwrap(client)
+    with _image_indexes_lock:
+        index = _image_indexes.get(client)
+        if index is None:
+            index = _image_indexes[client] = ImageIndex()
+        return index
+
+
+def invalidate_image_index(client, repository=None):
+    """ Forgets the cached image ids of repository, or of every
+        repository if none is given. Call after pulling, importing
+        or removing images, or when the daemon does not know an indexed
+        image any more.
+
+    :param client: the client. see docker_client.
+    :param repository: the repository name.
+    """
+
+    get_image_index(client).invalidate(repository)
+
+
+def find_image_id(tag, repository, client):
+    """ Resolves repository:tag, or repository@digest when tag is a
+        digest, to an image id.
+
+    :param tag: the image tag or digest.
+    :param repository: the repository name.
+    :param client: the client. see docker_client.
+    :return: the image id or None if the image is not present.
+    """
+
+    separator = '@' if tag and ':' in tag else ':'
+    reference = '{0}{1}{2}'.format(repository, separator, tag)
+    return get_image_index(client).lookup(client, repository, reference)
 
 
 def get_image_id(tag, repository, client):
+    """ Like find_image_id, but the image must be present.
 
-    try:
-        images = client.images()
-    except APIError as e:
+    :raises NonRecoverableError: when the image is not present.
+    :return: the image id.
+    """
+
+    image_id = find_image_id(tag, repository, client)
+    if image_id is None:
+        raise NonRecoverableError(
+            'Could not find an image that matches repository:tag'
+            ' {0}:{1}.'.format(repository, tag))
+    return image_id
+
+
+def get_pull_policy(image):
+    """ Returns the pull_policy of an image node property, - spelled _.
+        Without one, images imported from src, built, tagged latest or
+        not tagged are pulled, imported or built every time, as before
+        pull policies, and other images only when they are missing.
+
+    :param image: the image node property.
+    :raises NonRecoverableError: for an unknown pull_policy.
+    """
+
+    pull_policy = (image.get('pull_policy') or '').replace('-', '_')
+    if not pull_policy:
+        if image.get('src') or image.get('build') or \
+                (image.get('tag') or 'latest') == 'latest':
+            return ALWAYS
+        return IF_NOT_PRESENT
+    if pull_policy not in PULL_POLICIES:
         raise NonRecoverableError(
-            'Unable to get last created image: {0}'.format(e))
+            'Unknown pull_policy {0}. Allowed values: {1}.'.format(
+                pull_policy, ', '.join(PULL_POLICIES)))
+    return pull_policy
+
+
+def pulled_image(image):
+    """ Returns the repository and tag of an image node property that is
+        pulled from a registry, or None when it is imported, built or
+        its pull_policy is never.
 
-    for image in images:
-        if '{0}:{1}'.format(repository, tag) in image.get('RepoTags'):
-            return image.get('Id')
+    :param image: the image node property.
+    :raises NonRecoverableError: for an unknown pull_policy.
+    """
 
-    raise NonRecoverableError(
-        'Could not find an image that matches repository:tag'
-        ' {0}:{1}.'.format(repository, tag))
+    image = image or {}
+    if image.get('src') or image.get('build') or \
+            not image.get('repository') or get_pull_policy(image) == NEVER:
+        return None
+    return image['repository'], image.get('tag') or 'latest'
 
 
 def inspect_container(client):
@@ -47,7 +248,7 @@ def inspect_container(client):
     :return: container_info
     """
 
-    container = ctx.instance.runtime_properties.get('container_id')
+    container = staging.runtime_properties().get('container_id')
 
     if container is not None:
         try:
@@ -61,44 +262,195 @@ def inspect_container(client):
         return None
 
 
-def wait_for_processes(process_names, retry_interval, client):
-    """ The user may provide a node param in the blueprint wait_for_processes.
-        This is a list of processes to verify are active on the container
-        before completing the start operation. If all processes are not active
-        the function will be retried.
+def project_inspect(inspect_output, fields=INSPECT_FIELDS):
+    """ Extracts the fields consumers need from the inspect output of a
+        container, in a schema that does not depend on the API version:
+
+        ip_address and gateway: of the default network.
+        ports: the published ports, e.g. {'80/tcp': ['0.0.0.0:8080']}.
+        image_id: the id of the image the container runs.
+        state: running, paused, restarting or exited.
+        network_settings: the whole NetworkSettings dict, only if asked
+            for, it is large and version dependent.
+
+    :param inspect_output: the inspect_container result.
+    :param fields: the fields to extract, see ALL_INSPECT_FIELDS.
+    :raises NonRecoverableError: when fields has an unknown field.
+    :return: a dict of the fields.
+    """
+
+    unknown = set(fields) - set(ALL_INSPECT_FIELDS)
+    if unknown:
+        raise NonRecoverableError(
+            'Unknown inspect fields {0}. Allowed fields: {1}.'.format(
+                ', '.join(sorted(unknown)), ', '.join(ALL_INSPECT_FIELDS)))
+
+    network_settings = inspect_output.get('NetworkSettings') or {}
+    projected = {
+        IP_ADDRESS: network_settings.get('IPAddress') or None,
+        GATEWAY: network_settings.get('Gateway') or None,
+        PORTS: dict(
+            (port, ['{0}:{1}'.format(binding.get('HostIp') or '0.0.0.0',
+                                     binding.get('HostPort'))
+                    for binding in bindings])
+            for port, bindings in
+            (network_settings.get('Ports') or {}).items() if bindings),
+        IMAGE_ID: inspect_output.get('Image'),
+        STATE: _state(inspect_output.get('State')),
+        NETWORK_SETTINGS: inspect_output.get('NetworkSettings'),
+    }
+    return dict((field, projected[field]) for field in fields)
+
+
+def _state(state):
+    if not state:
+        return None
+    if state.get('Status'):
+        return state['Status']
+    for flag, status in (('Paused', 'paused'),
+                         ('Restarting', 'restarting'),
+                         ('Running', 'running')):
+        if state.get(flag):
+            return status
+    return 'exited'
+
+
+def store_inspect(runtime_properties, properties, instance_id,
+                  inspect_output):
+    """ Stores the projection of inspect_output selected by the
+        inspect_fields node property in runtime_properties. If the
+        inspect_output_dir node property is set, the whole output is
+        written to <inspect_output_dir>/<instance_id>.json and its path
+        stored in the inspect_output_path runtime property.
+
+    :param runtime_properties: the instance's runtime properties.
+    :param properties: the node properties.
+    :raises NonRecoverableError: when the output can not be written.
+    """
+
+    fields = properties.get('inspect_fields')
+    if fields is None:
+        fields = INSPECT_FIELDS
+    runtime_properties.update(project_inspect(inspect_output, fields))
+
+    directory = properties.get('inspect_output_dir')
+    if not directory:
+        return
+    path = os.path.join(directory, '{0}.json'.format(instance_id))
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            json.dump(inspect_output, f)
+    except (IOError, OSError) as e:
+        raise NonRecoverableError(
+            'Unable to write inspect output to {0}: {1}'.format(
+                path, str(e)))
+    runtime_properties['inspect_output_path'] = path
+
+
+def wait_for_container_exit(client, timeout):
+    """ Blocks on the daemon's wait endpoint until the container in
+        ctx.instance.runtime_properties['container_id'] exits.
 
-    :param retry_interval: the number of seconds between retries.
     :param client: the client. see docker_client.
-    :param ctx: the cloudify context.
+    :param timeout: the number of seconds to wait before giving up.
+    :return: the exit code of the container or None if it did not
+        exit within timeout seconds.
     """
 
-    ctx.logger.info('Waiting for these processes to finish: '
-                    '{}'.format(process_names))
+    container = staging.runtime_properties().get('container_id')
+
+    try:
+        return client.wait(container, timeout=timeout)
+    except (requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError):
+        oplog.current().debug('Container did not exit in time.',
+                              container=container, timeout=timeout)
+        return None
+    except APIError as e:
+        raise NonRecoverableError(
+            'Unable to wait for container: {0}'.format(str(e)))
+
 
-    container = ctx.instance.runtime_properties.get('container_id')
+def find_container(client, container_id=None, name=None,
+                   label=None, status=None):
+    """ Looks up a single container using server side filters, so the
+        daemon only returns the matching containers instead of every
+        container on the host. Daemons that do not support a filter
+        ignore it, so the result is also checked here.
+
+    :param client: the client. see docker_client.
+    :param container_id: the full or truncated id of the container.
+    :param name: the name of the container.
+    :param label: a label, either key or key=value, the container has.
+    :param status: the container status, e.g. running or exited.
+    :return: the container dictionary or None if not found.
+    """
+
+    filters = dict()
+    if container_id:
+        filters['id'] = container_id
+    if name:
+        name = name.lstrip('/')
+        filters['name'] = name
+    if label:
+        filters['label'] = label
+    if status:
+        filters['status'] = status
 
     try:
-        top_result = client.top(container)
+        containers = client.containers(all=True, filters=filters)
     except APIError as e:
         raise NonRecoverableError(
-            'Unable get container processes from top: {0}'.format(str(e)))
+            'Unable to list all containers: {0}.'.format(str(e)))
 
-    top_result_processes = top_result.get('Processes')
-    all_active = all([
-        any([
-            # last element of list is the command executed
-            process_name in top_result_process[-1]
-            for top_result_process in top_result_processes
-        ])
-        for process_name in process_names
-    ])
-    if all_active:
-        ctx.logger.info('Container.top(): {0}'.format(top_result))
-        return all_active
-    else:
-        raise RecoverableError(
-            'Waiting for all these processes. Retrying...',
-            retry_after=retry_interval)
+    for container in containers:
+        if container_id and \
+                not container.get('Id', '').startswith(container_id):
+            continue
+        if name and \
+                '/{0}'.format(name) not in (container.get('Names') or []):
+            continue
+        if label and not _has_label(container, label):
+            continue
+        if status and _container_status(container) != status:
+            continue
+        return container
+
+    return None
+
+
+# The prefixes of the Status text of a listed container, for daemons
+# that do not list its State yet.
+_STATUS_PREFIXES = (
+    ('Up', 'running'),
+    ('Exited', 'exited'),
+    ('Created', 'created'),
+    ('Restarting', 'restarting'),
+    ('Dead', 'dead'),
+    ('Removal In Progress', 'removing'),
+)
+
+
+def _container_status(container):
+    if container.get('State'):
+        return container['State']
+    text = container.get('Status') or ''
+    if text.startswith('Up') and text.endswith('(Paused)'):
+        return 'paused'
+    for prefix, status in _STATUS_PREFIXES:
+        if text.startswith(prefix):
+            return status
+    return None
+
+
+def _has_label(container, label):
+    labels = container.get('Labels') or {}
+    key, _, value = label.partition('=')
+    if key not in labels:
+        return False
+    return not value or labels[key] == value
 
 
 def get_container_dictionary(client):
@@ -106,38 +458,23 @@ def get_container_dictionary(client):
         Searches Docker for that container ID.
         Returns dockers dictionary for that container ID.
 
-    Get list of containers dictionaries from docker containers function.
-    Find container which is specified in
-    ctx.instance.runtime_properties['container'].
-
     :param client: the client. see docker_client.
     :param ctx: the cloudify context.
     :return: container dictionary
     """
 
-    container_id = ctx.instance.runtime_properties.get('container_id')
+    container_id = staging.runtime_properties().get('container_id')
     if container_id is None:
-        ctx.logger.debug(
-            'Unable to retrieve container dictionary.'
-            'ctx container ID value is None')
+        oplog.current().debug('Unable to retrieve container dictionary, '
+                              'ctx container ID value is None.')
         return None
 
-    try:
-        all_containers = client.containers(all=True)
-    except APIError as e:
-        raise NonRecoverableError(
-            'Unable to list all containers: {0}.'.format(str(e)))
-
-    for container in all_containers:
-        if container_id in \
-                container.get('Id'):
-            return container
-        else:
-            ctx.logger.debug(
-                'Unable to retrieve container dictionary.'
-                'container with ID {} does not exist.'
-                .format(container_id))
-            return None
+    container = find_container(client, container_id=container_id)
+    if container is None:
+        oplog.current().debug('Unable to retrieve container dictionary, '
+                              'the container does not exist.',
+                              container=container_id)
+    return container
 
 
 def check_container_status(client):
@@ -155,23 +492,20 @@ def check_container_status(client):
 
 
 def get_container_id_from_name(name, client):
-    """ Queries the local list of containers for a container with name.
+    """ Queries docker for a container with name.
 
     :param name: the name of a container.
     :param client: the client. see docker_client.
     :param ctx: the cloudify context.
-    if name is in the list of containers return the id of the container.
-    if name is not in the list of containers raise NonRecoverableError
+    if a container with name exists return the id of the container.
+    if no container with name exists raise NonRecoverableError
     """
 
-    for n, i in \
-            [(c.get('Names'),
-              c.get('Id')) for c in client.containers(all=True)]:
-        if name in n:
-            return i
-        else:
-            raise NonRecoverableError(
-                'No such container: {0}.'.format(name))
+    container = find_container(client, name=name)
+    if container is None:
+        raise NonRecoverableError(
+            'No such container: {0}.'.format(name))
+    return container.get('Id')
 
 
 def get_top_info(client):
@@ -191,9 +525,9 @@ def get_top_info(client):
         top_table += '\n'.join(' '.join(p) for p in top_dict['Processes'])
         return top_table
 
-    ctx.logger.info('Getting TOP info of container.')
+    oplog.current().debug('Getting TOP info of container.')
 
-    container = ctx.instance.runtime_properties.get('container_id')
+    container = staging.runtime_properties().get('container_id')
 
     try:
         top_dict = client.top(container)
@@ -0,0 +1,465 @@
+# coding=utf-8
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cloudify workflows for deployments of cloudify.docker.Container nodes"""
+
+# Built-in Imports
+import collections
+import time
+
+# Third-party Imports
+from docker.errors import APIError
+
+# Cloudify Imports
+from cloudify import manager
+from cloudify.decorators import workflow
+from cloudify.exceptions import NonRecoverableError
+from docker_plugin import docker_client
+from docker_plugin import instrumentation
+from docker_plugin import oplog
+from docker_plugin import utils
+from docker_plugin.lazy import LazyModule
+
+# Each workflow needs only some of these.
+bulk = LazyModule('docker_plugin.bulk')
+distribution = LazyModule('docker_plugin.distribution')
+docker_engine = LazyModule('docker_plugin.engine')
+imports = LazyModule('docker_plugin.imports')
+stats = LazyModule('docker_plugin.stats')
+
+CONTAINER_TYPE = 'cloudify.docker.Container'
+CREATE_OPERATION = 'cloudify.interfaces.lifecycle.create'
+START_OPERATION = 'cloudify.interfaces.lifecycle.start'
+PREFETCH_OPERATION = 'docker.images.prefetch'
+
+# The inputs of the create operation the prefetch operation pulls with.
+PREFETCH_INPUTS = ('daemon_client', 'pull_progress_interval', 'registries',
+                   'image_lock_timeout')
+
+THREADS = 'threads'
+ENGINE = 'engine'
+BACKENDS = (THREADS, ENGINE)
+
+
+@workflow
+def prefetch_images(ctx, max_workers=4, **_):
+    """ Pulls the images of every cloudify.docker.Container node, so
+        create_container finds them already present. Run before install.
+        The pulls are docker.images.prefetch operations, so they run on
+        the agents of the hosts whose daemons the containers use.
+
+    :param max_workers: The maximum number of concurrent pulls per host.
+    """
+
+    prefetch(ctx.graph_mode(), ctx.nodes, max_workers, ctx.logger)
+
+
+def get_prefetch_jobs(nodes):
+    """ Picks one instance per host, daemon_client and image of the
+        container nodes to pull the image with. Images that are not
+        pulled are skipped, see utils.pulled_image.
+
+    :param nodes: the workflow nodes.
+    :return: an ordered dict of host instance id to a list of
+        (instance, create inputs) pairs.
+    """
+
+    jobs = collections.OrderedDict()
+    seen = set()
+
+    for node in nodes:
+        if CONTAINER_TYPE not in node.type_hierarchy:
+            continue
+        image = utils.pulled_image(node.properties.get('image'))
+        if image is None:
+            continue
+        create = node.operations.get(CREATE_OPERATION) or {}
+        inputs = create.get('inputs') or {}
+        daemon = docker_client._pool_key(inputs.get('daemon_client') or {})
+        for instance in node.instances:
+            host_id = instance._node_instance.host_id
+            key = (host_id, daemon, image)
+            if key in seen:
+                continue
+            seen.add(key)
+            jobs.setdefault(host_id, []).append((instance, inputs))
+
+    return jobs
+
+
+def prefetch(graph, nodes, max_workers, logger):
+    """ Runs the prefetch operations of nodes as max_workers sequences of
+        tasks per host.
+
+    :param graph: the workflow's task graph, see ctx.graph_mode.
+    :return: the number of prefetch operations.
+    """
+
+    jobs = get_prefetch_jobs(nodes)
+    if not jobs:
+        logger.info('No images to prefetch.')
+        return 0
+
+    count = 0
+    for host_jobs in jobs.values():
+        lanes = [graph.sequence()
+                 for _ in range(min(max_workers, len(host_jobs)))]
+        for index, (instance, inputs) in enumerate(host_jobs):
+            lanes[index % len(lanes)].add(instance.execute_operation(
+                PREFETCH_OPERATION, kwargs=dict(
+                    (key, inputs[key]) for key in PREFETCH_INPUTS
+                    if key in inputs)))
+            count += 1
+    graph.execute()
+    return count
+
+
+@workflow
+def bulk_lifecycle(ctx, operation, node_ids=None, params=None,
+                   daemon_client=None, max_workers=16, backend=THREADS, **_):
+    """ Runs one lifecycle operation (create, start, stop or delete) for
+        every instance of the container nodes at once, instead of one
+        task per instance. All instances must use the same daemon. Start
+        waits for the readiness probes of the nodes' start operations,
+        see bulk for the instances that are not supported.
+
+    :param operation: create, start, stop or delete.
+    :param node_ids: The container nodes, all of them if not given.
+    :param params: docker-py parameters of the operation.
+    :param daemon_client: optional configuration for client creation
+    :param max_workers: The maximum number of concurrent docker calls.
+    :param backend: threads, docker-py calls on a thread pool, or engine,
+        calls multiplexed on one thread by engine.EngineClient.
+    """
+
+    check_remote_daemon(ctx, daemon_client)
+    run_bulk(container_nodes(ctx, node_ids), InstanceStore(ctx), operation,
+             params or {}, daemon_client or {}, max_workers, ctx.logger,
+             backend)
+
+
+@workflow
+def collect_stats(ctx, node_ids=None, daemon_client=None, duration=60,
+                  interval=10, capacity=60, summary_interval=60, output=None,
+                  **_):
+    """ Watches the resource usage of the containers of the container
+        nodes for duration seconds, see stats.Collector, and stores the
+        summary of each in its stats runtime property. All instances must
+        use the same daemon.
+
+    :param node_ids: The container nodes, all of them if not given.
+    :param daemon_client: optional configuration for client creation
+    :param duration: The number of seconds to collect for.
+    :param interval: The number of seconds aggregated into one interval.
+    :param capacity: The number of intervals kept per container.
+    :param summary_interval: The number of seconds between summaries.
+    :param output: A JSON lines file the summaries are appended to.
+    """
+
+    check_remote_daemon(ctx, daemon_client)
+    run_collect_stats(container_nodes(ctx, node_ids), InstanceStore(ctx),
+                      daemon_client or {}, duration, interval, capacity,
+                      summary_interval, output, ctx.logger)
+
+
+@workflow
+def distribute_image(ctx, image, source_daemon_client=None,
+                     target_daemon_clients=None, compress=False, output=None,
+                     queue_size=8, **_):
+    """ Saves image from the source daemon and loads it, layers, tags
+        and all, into the target daemons in parallel, reading it from the
+        source once, see distribution. For hosts without registry access.
+
+    :param image: The image to distribute, e.g. repository:tag.
+    :param source_daemon_client: The daemon_client of the daemon that
+        has the image.
+    :param target_daemon_clients: A list of daemon_client dictionaries,
+        by default those of the create operations of the container nodes.
+        On the manager they must all be remote, see check_remote_daemon.
+    :param compress: Whether to gzip the archive on the way.
+    :param output: A local file to also write the archive to.
+    :param queue_size: The number of chunks of 1MiB buffered per target.
+    """
+
+    source_daemon_client = source_daemon_client or {}
+    check_remote_daemon(ctx, source_daemon_client, 'source_daemon_client')
+    if target_daemon_clients is None:
+        target_daemon_clients = get_daemon_clients(ctx.nodes)
+    for daemon_client in target_daemon_clients:
+        check_remote_daemon(ctx, daemon_client, 'target_daemon_clients')
+    run_distribute(image, source_daemon_client, target_daemon_clients,
+                   compress, output, queue_size, ctx.logger)
+
+
+def get_daemon_clients(nodes):
+    """ Returns the distinct daemon_client inputs of the create
+        operations of the container nodes.
+    """
+
+    daemon_clients = []
+    for node in nodes:
+        if CONTAINER_TYPE not in node.type_hierarchy:
+            continue
+        create = node.operations.get(CREATE_OPERATION) or {}
+        daemon_client = (create.get('inputs') or {}).get('daemon_client') \
+            or {}
+        if daemon_client not in daemon_clients:
+            daemon_clients.append(daemon_client)
+    return daemon_clients
+
+
+@docker_client.leased
+def run_distribute(image, source_daemon_client, target_daemon_clients,
+                   compress, output, queue_size, logger):
+    """ Distributes image, see distribute_image, and checks that every
+        target has it afterwards. Targets with the same configuration as
+        the source, see docker_client, are skipped, and so are repeated
+        ones.
+
+    :raises NonRecoverableError: when the save or any load failed.
+    :return: the result of distribution.distribute, its targets named
+        by base_url.
+    """
+
+    log = oplog.wrap(logger)
+    seen = set([docker_client._pool_key(source_daemon_client)])
+    names = collections.Counter()
+    targets = {}
+    for daemon_client in target_daemon_clients:
+        key = docker_client._pool_key(daemon_client)
+        if key in seen:
+            continue
+        seen.add(key)
+        # the same daemon under another configuration, e.g. API version
+        base_url = daemon_client.get('base_url', 'default')
+        names[base_url] += 1
+        name = base_url if names[base_url] == 1 else '{0} ({1})'.format(
+            base_url, names[base_url])
+        targets[name] = docker_client.get_client(daemon_client)
+    if not targets and not output:
+        log.info('No daemons to distribute the image to.', image=image)
+        return {}
+
+    try:
+        result = distribution.distribute(
+            docker_client.get_client(source_daemon_client), image, targets,
+            compress=compress, output=output, queue_size=queue_size)
+    except APIError as e:
+        raise NonRecoverableError(
+            'Failed to save image {0}: {1}.'.format(image, str(e)))
+
+    loaded = result['targets']
+    for name, client in targets.items():
+        if loaded[name]['error'] is None and \
+                not imports.image_exists(client, image):
+            loaded[name]['error'] = 'the image is missing after the load'
+    errors = ['{0} ({1})'.format(name, loaded[name]['error'])
+              for name in sorted(loaded)
+              if loaded[name]['error'] is not None]
+
+    log.info('Distributed image.', image=image, bytes=result['bytes'],
+             duration=round(result['duration'], 2),
+             targets=len(result['targets']), failed=len(errors))
+    log.flush()
+    if errors:
+        raise NonRecoverableError(
+            'Failed to distribute image {0} to {1}.'.format(
+                image, '; '.join(oplog.bound(errors))))
+    return result
+
+
+def check_remote_daemon(ctx, daemon_client, name='daemon_client'):
+    """ Workflows run on the manager, where a daemon_client without a
+        remote base_url is the manager's own daemon, not the one of the
+        containers. Raises NonRecoverableError for such a daemon_client,
+        unless the workflow runs locally, next to the daemon.
+    """
+
+    if ctx.local:
+        return
+    base_url = (daemon_client or {}).get('base_url') or ''
+    if not base_url or base_url.startswith(('unix:', 'http+unix:')):
+        raise NonRecoverableError(
+            'The workflow runs on the manager, {0} must have the base_url '
+            'of the remote daemon of the containers, e.g. '
+            'tcp://10.0.0.5:2376, not {1}.'.format(
+                name, base_url or 'the local socket'))
+
+
+def container_nodes(ctx, node_ids=None):
+    """ Returns the nodes node_ids, or all container nodes.
+    """
+
+    if node_ids:
+        return [ctx.get_node(node_id) for node_id in node_ids]
+    return [node for node in ctx.nodes
+            if CONTAINER_TYPE in node.type_hierarchy]
+
+
+class InstanceStore(object):
+    """ Reads and writes node instance runtime properties from a workflow,
+        through the local storage or the manager REST API.
+    """
+
+    def __init__(self, ctx):
+        if ctx.local:
+            self._storage = ctx.internal.handler.storage
+            self._rest = None
+        else:
+            self._storage = None
+            self._rest = manager.get_rest_client()
+
+    def get(self, instance_id):
+        if self._storage is not None:
+            return self._storage.get_node_instance(instance_id)
+        return self._rest.node_instances.get(instance_id)
+
+    def update(self, instance_id, runtime_properties, version):
+        if self._storage is not None:
+            self._storage.update_node_instance(
+                instance_id, version=version,
+                runtime_properties=runtime_properties)
+        else:
+            self._rest.node_instances.update(
+                instance_id, runtime_properties=runtime_properties,
+                version=version)
+
+
+@docker_client.leased
+def run_bulk(nodes, store, operation, params, daemon_client, max_workers,
+             logger, backend=THREADS):
+    """ Runs operation for the instances of nodes, see bulk.run, and
+        writes the runtime properties of the instances that succeeded.
+
+    :raises NonRecoverableError: when any instance failed.
+    """
+
+    if backend not in BACKENDS:
+        raise NonRecoverableError(
+            'Unknown bulk backend {0}. Allowed backends: {1}.'.format(
+                backend, ', '.join(BACKENDS)))
+
+    items = []
+    versions = dict()
+    for node in nodes:
+        # the readiness probes of the start operation, see tasks.start
+        start = (node.operations.get(START_OPERATION) or {}).get(
+            'inputs') or {}
+        probes = [{'type': 'process', 'name': name}
+                  for name in start.get('processes_to_wait_for') or []]
+        probes.extend(start.get('readiness_probes') or [])
+        for instance in node.instances:
+            stored = store.get(instance.id)
+            versions[instance.id] = stored.version
+            items.append(bulk.BulkItem(
+                instance.id, node.properties,
+                dict(stored.runtime_properties or {}), probes,
+                start.get('readiness_timeout', 60)))
+
+    started = time.time()
+    client = docker_client.get_client(daemon_client)
+    engine = docker_engine.EngineClient(daemon_client) \
+        if backend == ENGINE else None
+    try:
+        failed = bulk.run(client, operation, items, params, max_workers,
+                          logger, engine=engine)
+    finally:
+        # the containers of the items that succeeded exist even if
+        # another item raised
+        for item in items:
+            if item.error is None:
+                store.update(item.instance_id, item.runtime_properties,
+                             versions[item.instance_id])
+
+    logger.info('Bulk {0} of {1} instances took {2:.1f}s, {3} failed.'
+                .format(operation, len(items), time.time() - started,
+                        len(failed)))
+    if failed:
+        raise NonRecoverableError(
+            'Bulk {0} failed for {1}.'.format(
+                operation, '; '.join(oplog.bound(['{0} ({1})'.format(
+                    item.instance_id, item.error) for item in failed]))))
+
+
+def run_collect_stats(nodes, store, daemon_client, duration, interval,
+                      capacity, summary_interval, output, logger):
+    """ Collects the stats of the containers of nodes, see collect_stats.
+
+    :raises NonRecoverableError: when the stats of any container could
+        not be read.
+    :return: a dict of instance id to stats summary.
+    """
+
+    containers = dict()
+    stored = dict()
+    for node in nodes:
+        for instance in node.instances:
+            stored[instance.id] = store.get(instance.id)
+            container_id = (stored[instance.id].runtime_properties or {}) \
+                .get('container_id')
+            if container_id:
+                containers[instance.id] = container_id
+
+    log = oplog.wrap(logger)
+    if not containers:
+        log.info('No containers to collect stats of.')
+        return {}
+    sink = instrumentation.JsonLinesSink(output) if output else None
+
+    def on_summary(summaries):
+        _log_stats(log, summaries)
+        if sink is None:
+            return
+        now = time.time()
+        try:
+            for instance_id, summary in sorted(summaries.items()):
+                sink.write(dict(summary, node_instance=instance_id,
+                                timestamp=now))
+        except (IOError, OSError) as e:
+            log.warning('Failed to write container stats.', error=str(e))
+
+    collector = stats.Collector(
+        docker_engine.EngineClient(daemon_client), containers, duration,
+        interval, capacity, summary_interval, on_summary)
+    summaries = collector.run()
+
+    for instance_id, summary in summaries.items():
+        if instance_id in collector.errors:
+            continue
+        runtime_properties = dict(
+            stored[instance_id].runtime_properties or {})
+        runtime_properties['stats'] = summary
+        store.update(instance_id, runtime_properties,
+                     stored[instance_id].version)
+    log.flush()
+
+    if collector.errors:
+        raise NonRecoverableError(
+            'Failed to collect stats of {0}.'.format('; '.join(oplog.bound(
+                ['{0} ({1})'.format(instance_id, error) for instance_id, error
+                 in sorted(collector.errors.items())]))))
+    return summaries
+
+
+def _log_stats(log, summaries):
+    measured = [(summary['cpu_percent'], instance_id)
+                for instance_id, summary in summaries.items()
+                if summary['intervals']]
+    log.info('Container stats.', containers=len(summaries),
+             measured=len(measured),
+             cpu_percent=round(sum(cpu for cpu, _ in measured) /
+                               len(measured), 2) if measured else None,
+             busiest=['{0}: {1}%'.format(instance_id, cpu)
+                      for cpu, instance_id in sorted(measured,
+                                                     reverse=True)[:5]])